@@ -17,5 +17,7 @@ void nle_set_seed(nle_ctx_t *, unsigned long, unsigned long, boolean,
                   unsigned long);
 void nle_get_seed(nle_ctx_t *, unsigned long *, unsigned long *, boolean *,
                   unsigned long *, bool *);
+void nle_get_initial_seeds(unsigned long *, unsigned long *, boolean *,
+                           unsigned long *, boolean *);
 
 #endif
\ No newline at end of file
@@ -16,6 +16,7 @@
 #define NLE_SCREEN_DESCRIPTION_LENGTH 80
 #define NLE_TERM_CO 80
 #define NLE_TERM_LI 24
+#define NLE_SCORE_ENTRY_SIZE 4096
 
 /* blstats indices, see also botl.c and statusfields in botl.h. */
 #define NLE_BL_X 0
@@ -81,6 +82,10 @@ typedef struct nle_observation {
     signed char *tty_colors;            /* Size NLE_TERM_LI * NLE_TERM_CO */
     unsigned char *tty_cursor;          /* Size 2 */
     int *misc;                          /* Size NLE_MISC_SIZE */
+    /* If set, topten() writes the logfile and xlogfile entries of the game
+       into these buffers instead of the files, see nle_score_stream(). */
+    char *logentry;  /* Size NLE_SCORE_ENTRY_SIZE */
+    char *xlogentry; /* Size NLE_SCORE_ENTRY_SIZE */
 } nle_obs;
 
 typedef struct {
@@ -97,6 +102,7 @@ typedef struct nle_globals {
     fcontext_t generatorcontext;
 
     FILE *ttyrec;
+    long ttyrec_score; /* Last score written to the ttyrec (channel 2). */
     TMT *vterminal;
     char outbuf[BUFSIZ];
     char *outbuf_write_ptr;
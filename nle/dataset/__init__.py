@@ -1,5 +1,11 @@
 import nle.dataset.db
 from nle._pyconverter import Converter
+from nle._pyconverter import TtyrecReader
 from nle.dataset.dataset import TtyrecDataset
+from nle.dataset.framestore import FrameStore
+from nle.dataset.framestore import materialize
+from nle.dataset.gamecache import GameCache
 from nle.dataset.populate_db import add_altorg_directory
 from nle.dataset.populate_db import add_nledata_directory
+from nle.dataset.resim import resimulate
+from nle.dataset.resim import resimulate_dataset
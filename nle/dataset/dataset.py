@@ -1,96 +1,66 @@
+import concurrent.futures
+import contextlib
+import heapq
+import logging
 import os
+import queue
 import sqlite3
+import threading
 from collections import defaultdict
-from functools import partial
 
 import numpy as np
 
 from nle import _pyconverter as converter
 from nle import dataset as nld
+from nle.dataset import framestore
+from nle.dataset import gamecache
+from nle.dataset import resim
+from nle.dataset import sampling
 
+logger = logging.getLogger("dataset")
 
-def convert_frames(
-    converter,
-    chars,
-    colors,
-    curs,
-    timestamps,
-    actions,
-    scores,
-    resets,
-    gameids,
-    load_fn,
-):
-    """Convert frames for a single batch entry.
-
-    :param converter: A ttychars.Converter object with a loaded file.
-    :param chars: Array of characters -  np.array(np.uint8) [ SEQ x ROW x COL]
-    :param colors: Array of colors -  np.array(np.uint8) [ SEQ x ROW x COL]
-    :param curs: Array of cursors -  np.array(np.int16) [ SEQ x 2 ]
-    :param timestamps: Array of timestamps -  np.array(np.int64) [ SEQ ]
-    :param actions: Array of actions at t in response to output at t
-        - np.array(np.uint8) [ SEQ ]
-    :param scores: Array of in-game scores -  np.array(np.int32) [ SEQ ]
-    :param resets: Array of resets -  np.array(np.uint8) [ SEQ ]
-    :param gameids: Array of the gameid of each frame - np.array(np.int32) [ SEQ ]
-    :param load_fn: A callback that loads the next file into a converter:
-        sig: load_fn(converter) -> bool is_success
 
-    """
+FRAME_KEYS = (
+    "tty_chars",
+    "tty_colors",
+    "tty_cursor",
+    "timestamps",
+    "keypresses",
+    "scores",
+)
 
-    resets[0] = 0
-    while True:
-        remaining = converter.convert(chars, colors, curs, timestamps, actions, scores)
-        end = np.shape(chars)[0] - remaining
-
-        resets[1:end] = 0
-        gameids[:end] = converter.gameid
-        if remaining == 0:
-            return
-
-        # There still space in the buffers; load a new ttyrec and carry on.
-        chars = chars[-remaining:]
-        colors = colors[-remaining:]
-        curs = curs[-remaining:]
-        timestamps = timestamps[-remaining:]
-        actions = actions[-remaining:]
-        scores = scores[-remaining:]
-        resets = resets[-remaining:]
-        gameids = gameids[-remaining:]
-        if load_fn(converter):
-            if converter.part == 0:
-                resets[0] = 1
-        else:
-            chars.fill(0)
-            colors.fill(0)
-            curs.fill(0)
-            timestamps.fill(0)
-            actions.fill(0)
-            scores.fill(0)
-            resets.fill(0)
-            gameids.fill(0)
-            return
+# Parsed from the top line and the status lines of frames (see
+# `converter.parse_status`), only converted if requested with `keys`.
+STATUS_KEYS = ("blstats", "message")
 
 
-def _ttyrec_generator(
-    batch_size, seq_length, rows, cols, load_fns, map_fn, ttyrec_version
-):
-    """A generator to fill minibatches with ttyrecs.
-
-    :param load_fns: a list of functions to load the next ttyrec into a converter.
-       load_fn(ttyrecs.Converter conv) -> bool is_success
-    :param map_fn: a function that maps a series of iterables through a fn.
-       map_fn(fn, *iterables) -> <generator> (can use built-in map)
+def _new_buffers(batch_size, seq_length, rows, cols, ttyrec_version, keys=None):
+    """Allocates the arrays of one minibatch.
 
+    :param keys: The `FRAME_KEYS` and `STATUS_KEYS` to allocate arrays for,
+        or None for all `FRAME_KEYS`.
+    :returns: A tuple of all arrays, in the order of `BatchConverter.convert`
+        and None for keys left out, and the minibatch dict of the arrays that
+        `ttyrec_version` provides.
     """
-    chars = np.zeros((batch_size, seq_length, rows, cols), dtype=np.uint8)
-    colors = np.zeros((batch_size, seq_length, rows, cols), dtype=np.int8)
-    cursors = np.zeros((batch_size, seq_length, 2), dtype=np.int16)
-    timestamps = np.zeros((batch_size, seq_length), dtype=np.int64)
-    actions = np.zeros((batch_size, seq_length), dtype=np.uint8)
+
+    def new(key, shape, dtype):
+        if (keys is None and key in STATUS_KEYS) or (
+            keys is not None and key not in keys
+        ):
+            return None
+        return np.zeros((batch_size, seq_length) + shape, dtype=dtype)
+
+    chars = new("tty_chars", (rows, cols), np.uint8)
+    colors = new("tty_colors", (rows, cols), np.int8)
+    cursors = new("tty_cursor", (2,), np.int16)
+    timestamps = new("timestamps", (), np.int64)
+    actions = new("keypresses", (), np.uint8)
     resets = np.zeros((batch_size, seq_length), dtype=np.uint8)
     gameids = np.zeros((batch_size, seq_length), dtype=np.int32)
-    scores = np.zeros((batch_size, seq_length), dtype=np.int32)
+    scores = new("scores", (), np.int32)
+    blstats = new("blstats", (converter.BLSTATS_SIZE,), np.int64)
+    message = new("message", (converter.MESSAGE_SIZE,), np.uint8)
 
     key_vals = [
         ("tty_chars", chars),
@@ -104,37 +74,195 @@ def _ttyrec_generator(
         key_vals.append(("keypresses", actions))
     if ttyrec_version >= 3:
         key_vals.append(("scores", scores))
+    key_vals += [("blstats", blstats), ("message", message)]
 
-    # Load initial gameids.
-    converters = [
-        converter.Converter(rows, cols, ttyrec_version) for _ in range(batch_size)
-    ]
-    assert all(
-        fn(c) for fn, c in zip(load_fns, converters)
-    ), "Not enough ttyrecs to fill a batch!"
+    arrays = (chars, colors, cursors, timestamps, actions, scores, resets, gameids)
+    arrays += (blstats, message)
+    return arrays, {key: array for key, array in key_vals if array is not None}
+
+
+def _ttyrec_generator(
+    batch_size,
+    seq_length,
+    rows,
+    cols,
+    batch,
+    ttyrec_version,
+    save_state=None,
+    keys=None,
+):
+    """A generator to fill minibatches with ttyrecs.
+
+    :param batch: A `BatchConverter` with the ttyrecs of each batch entry.
+    :param save_state: If given, called with `batch.state()` after converting
+        each minibatch, right before handing it out.
+    :param keys: The keys to convert, see `_new_buffers`.
+    """
+    arrays, mb = _new_buffers(batch_size, seq_length, rows, cols, ttyrec_version, keys)
+    gameids = mb["gameids"]
 
     # Convert (at least one minibatch)
     gameids[0, -1] = 1  # basically creating a "do-while" loop by setting an indicator
     while np.any(
         gameids[:, -1] != 0
     ):  # loop until only padding is found, i.e. end of data
-        list(
-            map_fn(
-                convert_frames,
-                converters,
-                chars,
-                colors,
-                cursors,
-                timestamps,
-                actions,
-                scores,
-                resets,
-                gameids,
-                load_fns,
+        batch.convert(*arrays)
+        if save_state is not None:
+            save_state(batch.state())
+        yield dict(mb)
+
+
+class PrefetchedMinibatch(dict):
+    """A minibatch handed out by a prefetching `TtyrecDataset` iterator.
+
+    Its arrays stay valid until `release` is called, after which they are
+    overwritten by a later minibatch. Can be used as a context manager that
+    releases on exit.
+    """
+
+    def __init__(self, mb, buffers, free):
+        super().__init__(mb)
+        self._buffers = buffers
+        self._free = free
+
+    def release(self):
+        """Hands the arrays back to the iterator for reuse."""
+        if self._buffers is not None:
+            self._free.put(self._buffers)
+            self._buffers = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.release()
+
+
+def _prefetching_generator(
+    batch_size,
+    seq_length,
+    rows,
+    cols,
+    batch,
+    ttyrec_version,
+    prefetch,
+    save_state=None,
+    keys=None,
+):
+    """Like `_ttyrec_generator`, but converts up to `prefetch` minibatches ahead
+    on a background thread, into a ring of `prefetch` buffers.
+
+    Yields `PrefetchedMinibatch` objects, which need to be released before their
+    buffers get reused. `save_state` is called with the state of the batch
+    after converting each minibatch when that minibatch is handed out, not when
+    it is converted.
+    """
+    free = queue.Queue()
+    full = queue.Queue()
+    for _ in range(prefetch):
+        free.put(_new_buffers(batch_size, seq_length, rows, cols, ttyrec_version, keys))
+    stopped = threading.Event()
+
+    def convert():
+        try:
+            while True:
+                buffers = free.get()
+                if stopped.is_set():
+                    return
+                arrays, mb = buffers
+                batch.convert(*arrays)
+                state = batch.state() if save_state is not None else None
+                full.put((buffers, state))
+                if not np.any(mb["gameids"][:, -1] != 0):
+                    full.put(None)  # End of data.
+                    return
+        except Exception as e:  # Re-raised in the consuming thread.
+            full.put(e)
+
+    thread = threading.Thread(target=convert, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = full.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            buffers, state = item
+            if save_state is not None:
+                save_state(state)
+            yield PrefetchedMinibatch(buffers[1], buffers, free)
+    finally:
+        stopped.set()
+        free.put(None)  # Wake up the thread if it waits for a buffer.
+        thread.join()
+
+
+def _balance_lanes(gameids, frame_counts, batch_size):
+    """Spreads games over batch entries ("lanes") so that all lanes run out of
+    games at about the same time.
+
+    Games are assigned longest first to the lane with the fewest frames so far.
+    Each lane still reads its games in the order of `gameids`.
+
+    :returns: The lane of each game.
+    """
+    loads = [(0, lane) for lane in range(batch_size)]
+    lanes = [0] * len(gameids)
+    by_length = sorted(
+        range(len(gameids)), key=lambda i: frame_counts[gameids[i]], reverse=True
+    )
+    for i in by_length:
+        load, lane = heapq.heappop(loads)
+        lanes[i] = lane
+        heapq.heappush(loads, (load + frame_counts[gameids[i]], lane))
+    return lanes
+
+
+def _shard_games(conn, games_sql, sql_args, rank, world_size, seed, gameids=None):
+    """Deterministically splits the games selected by `games_sql` over
+    `world_size` shards and returns the set of gameids of shard `rank`.
+
+    Games are shuffled with `seed`, then spread over the shards like lanes in
+    `_balance_lanes` if the frame counts of all of them are in the database
+    (see `populate_db.add_frame_counts`), or round robin otherwise. Every game
+    is in exactly one shard.
+
+    :param games_sql: A query selecting `(gameid, part, path)` of the dataset's
+        ttyrecs, with arguments `sql_args`.
+    :param gameids: If given, only shard the selected games among these.
+    """
+    try:
+        rows = conn.execute(
+            """SELECT selected.gameid,
+            SUM(frame_counts.frames), COUNT(*) - COUNT(frame_counts.frames)
+            FROM (%s) AS selected
+            LEFT JOIN frame_counts ON frame_counts.gameid=selected.gameid
+            AND frame_counts.part=selected.part
+            GROUP BY selected.gameid ORDER BY selected.gameid"""
+            % games_sql,
+            sql_args,
+        ).fetchall()
+    except sqlite3.OperationalError:  # Database without frame counts.
+        rows = [
+            (row[0], None, 1)
+            for row in conn.execute(
+                "SELECT DISTINCT gameid FROM (%s) ORDER BY gameid" % games_sql,
+                sql_args,
             )
-        )
+        ]
+    if gameids is not None:
+        gameids = set(gameids)
+        rows = [row for row in rows if row[0] in gameids]
 
-        yield dict(key_vals)
+    rows = [rows[i] for i in np.random.RandomState(seed).permutation(len(rows))]
+    shuffled = [row[0] for row in rows]
+    if all(missing == 0 for _, _, missing in rows):
+        frame_counts = {gameid: frames for gameid, frames, _ in rows}
+        shards = _balance_lanes(shuffled, frame_counts, world_size)
+    else:
+        shards = [i % world_size for i in range(len(shuffled))]
+    return {gameid for gameid, shard in zip(shuffled, shards) if shard == rank}
 
 
 class TtyrecDataset:
@@ -156,6 +284,21 @@ class TtyrecDataset:
         loop_forever=False,
         subselect_sql=None,
         subselect_sql_args=None,
+        num_threads=None,
+        prefetch=0,
+        use_framestore=True,
+        random_windows=False,
+        rank=0,
+        world_size=1,
+        seed=None,
+        decode_threads=1,
+        weights=None,
+        weights_sql=None,
+        weights_sql_args=None,
+        stratify_by=None,
+        cache=None,
+        crop=None,
+        keys=None,
     ):
         """
         An iterable dataset to load minibatches of NetHack games from compressed
@@ -182,6 +325,11 @@ class TtyrecDataset:
             for mb in dataset:
                 # NB: dataset reuses np arrays, for performance reasons
                 print(mb)
+
+            # Convert up to two minibatches ahead on a background thread.
+            for mb in nld.TtyrecDataset("data1", prefetch=2):
+                with mb:  # Releases the arrays for reuse afterwards.
+                    print(mb)
             ```
 
         :param batch_size: Number of parallel games to load.
@@ -189,18 +337,105 @@ class TtyrecDataset:
         :param rows: Row size of the terminal screen.
         :param cols: Column size of the terminal screen.
         :param dbfilename: Path to the database file
+        :param threadpool: Deprecated, use `num_threads`. If given and
+            `num_threads` is None, convert using one thread per CPU.
         :param gameids: Use a subselection of games (gameids) only.
         :param shuffle: Shuffle the order of gameids before iterating through them.
         :param loop_forever: If true, cycle through gameids forever,
-            insted of padding empty batch dims with 0's.
+            insted of padding empty batch dims with 0's. Otherwise, if the
+            frame counts of all games are known (see `get_frame_counts`), games
+            are spread over batch dims so that all run out at about the same
+            time. The fraction of padding is then logged after each epoch and
+            kept in `padding_fraction`.
         :param subselect_sql: SQL Query to subselect games (gameids) using metadata
         :param subselect_sql_args: SQL Query Args to subselect games (gameids)
             using metadata.
+        :param num_threads: Number of native threads converting the entries of
+            a minibatch in parallel. 0 means one per CPU. Defaults to 1.
+        :param prefetch: If > 0, convert up to this many minibatches ahead of
+            time on a background thread, into a ring of `prefetch` buffers.
+            Minibatches are then `PrefetchedMinibatch` dicts that stay valid
+            until their `release()` method is called; iteration blocks while
+            all buffers are held. Use at least 2 to overlap consuming a
+            minibatch with converting the next one.
+        :param use_framestore: Read frames from the dataset's frame store (see
+            `nld.materialize`) instead of converting ttyrecs, if it holds all
+            games.
+        :param random_windows: Instead of streaming games from start to end,
+            fill each batch entry with windows of `seq_length` frames starting
+            at uniformly random frames of random games (see `nld.sampling`).
+            `done` then marks the first frame of each window. Unless
+            `loop_forever` is set, an epoch reads as many frames as the games
+            hold, rounded up to a multiple of `batch_size`.
+        :param rank: Index of this process's shard of the games, for
+            distributed training. Each of the `world_size` processes should
+            create the dataset with the same arguments but its own `rank`.
+        :param world_size: Number of shards. Games are shuffled with `seed` and
+            split into shards of about equal numbers of frames if the frame
+            counts of all games are in the database, and of equal numbers of
+            games otherwise. Every game ends up in exactly one shard, and only
+            the games of shard `rank` are read from the database.
+        :param seed: Seed of the sharding and of the shuffling of each epoch.
+            If None, shards use seed 0 and epochs are shuffled with
+            `np.random`. Given a seed, the order of games, or the random
+            windows, of each epoch only depend on the seed and the number of
+            the epoch (see `epoch`).
+        :param decode_threads: Number of threads decompressing each large
+            (>= 1 MB) ttyrec, in addition to the `num_threads` converting the
+            entries of a minibatch. Keeps single huge games from holding up
+            whole minibatches.
+        :param weights: Draw games with these weights instead of reading each
+            once per epoch: A dict {gameid: weight}, or an array with the
+            weight of each of the dataset's games, in the order of
+            `get_meta_arrays`. Each epoch then consists of as many games as
+            the dataset holds, drawn with replacement (so `shuffle` has no
+            effect). With `random_windows`, the windows of each game are drawn
+            in proportion to its weight.
+        :param weights_sql: SQL query selecting `(gameid, weight)` rows, eg
+            `"SELECT gameid, points FROM games"`, instead of `weights`. Games
+            it doesn't select get weight 0.
+        :param weights_sql_args: SQL Query Args of `weights_sql`.
+        :param stratify_by: Name of a column of the `games` table, eg "role".
+            Rescales the weights (all 1 by default) so that all values of the
+            column have the same total weight (see `sampling.stratify`).
+        :param cache: A `GameCache` keeping converted games in memory, which
+            can be shared between datasets, or its size in bytes. Used by
+            `get_game`, `get_ttyrecs` and `random_windows`.
+        :param crop: A window `(top, left, height, width)` of the `rows` x
+            `cols` terminal, eg `(1, 0, 21, 79)` for NetHack's map. Minibatch
+            `tty_chars` and `tty_colors` then only hold this window, which is
+            all the converter writes. `tty_cursor` keeps terminal coordinates.
+            `get_game` and `read_game` still return whole frames.
+        :param keys: The keys of frame data to convert, a subset of
+            `FRAME_KEYS` and `STATUS_KEYS`. Minibatches then only have these
+            and "done" and "gameids". Defaults to all `FRAME_KEYS` the ttyrec
+            version provides. "blstats" and "message" are parsed from the
+            status lines and the top line of each frame, like NLE's
+            observations of these names. The hero's position, and all of
+            blstats while the status lines are hidden, are carried forward
+            from earlier frames of the game; fields the status lines never
+            show, like the dungeon number, are 0 (see
+            `converter.parse_status`). With `random_windows`, the part of a
+            window in each minibatch starts without earlier frames, and so
+            do lanes after `load_state_dict`.
         """
+        if not 0 <= rank < world_size:
+            raise ValueError("Rank %i not in [0, %i)" % (rank, world_size))
+        if crop is not None:
+            top, left, height, width = crop
+            if min(crop) < 0 or top + height > rows or left + width > cols:
+                raise ValueError("Crop %s not within %i x %i" % (crop, rows, cols))
+        if keys is not None:
+            unknown = [key for key in keys if key not in FRAME_KEYS + STATUS_KEYS]
+            if unknown:
+                raise ValueError("Unknown keys: %s" % ", ".join(unknown))
+        self.dataset_name = dataset_name
         self.batch_size = batch_size
         self.seq_length = seq_length
         self.rows = rows
         self.cols = cols
+        self.crop = crop
+        self.keys = keys
 
         self.shuffle = shuffle
         self.subselect_sql = subselect_sql
@@ -238,10 +473,30 @@ class TtyrecDataset:
             sql_args = subselect_sql_args if subselect_sql_args else ()
             sql_args = (dataset_name,) + sql_args
 
+        self.rank = rank
+        self.world_size = world_size
+        self.seed = seed
+        self.epoch = 0
+        self._shard = None
+
         self._games = defaultdict(list)
         self._meta = None  # Populate lazily.
         self.dbfilename = dbfilename
-        with nld.db.connect(self.dbfilename) as conn:
+        with contextlib.closing(self._connect()) as conn:
+            if world_size > 1:
+                self._shard = _shard_games(
+                    conn,
+                    core_sql,
+                    sql_args,
+                    rank,
+                    world_size,
+                    0 if seed is None else seed,
+                    gameids,
+                )
+                # Only select the games of this shard, see `_connect`.
+                core_sql += " AND nle_in_shard(ttyrecs.gameid)"
+                meta_sql += " AND nle_in_shard(games.gameid)"
+
             c = conn.cursor()
 
             for row in c.execute(core_sql, sql_args):
@@ -256,13 +511,71 @@ class TtyrecDataset:
 
         if gameids is None:
             gameids = self._games.keys()
+        elif self._shard is not None:
+            gameids = [gameid for gameid in gameids if gameid in self._shard]
 
         self._core_sql = core_sql
         self._meta_sql = meta_sql
         self._sql_args = sql_args
         self._gameids = list(gameids)
-        self._threadpool = threadpool
-        self._map = partial(self._threadpool.map, timeout=60) if threadpool else map
+        if num_threads is None:
+            num_threads = 0 if threadpool is not None else 1
+        self.num_threads = num_threads
+        self.decode_threads = decode_threads
+        self.prefetch = prefetch
+        self.use_framestore = use_framestore
+        self._framestore = None  # Opened lazily.
+        self.random_windows = random_windows
+        self._part_frame_counts = None  # Populate lazily.
+        self._executor = None
+        self.padding_fraction = None
+        self._state = None  # Of the most recent iteration, see `state_dict`.
+        self._resume = None
+        if cache is not None and not isinstance(cache, gamecache.GameCache):
+            cache = gamecache.GameCache(cache)
+        self.cache = cache
+        self._weights = self._get_weights(
+            weights, weights_sql, weights_sql_args, stratify_by
+        )
+        self._game_sampler = None
+        if self._weights is not None:
+            self._game_sampler = sampling.AliasSampler(
+                [self._weights[gameid] for gameid in self._gameids]
+            )
+
+    def _get_weights(self, weights, weights_sql, weights_sql_args, stratify_by):
+        """Returns the weights of the dataset's games as {gameid: weight}, or
+        None if games aren't weighted."""
+        if weights is not None and weights_sql is not None:
+            raise ValueError("Pass either weights or weights_sql")
+        if weights_sql is not None:
+            with contextlib.closing(self._connect()) as conn:
+                rows = dict(conn.execute(weights_sql, weights_sql_args or ()))
+            weights = [rows.get(gameid, 0) for gameid in self._gameids]
+        elif isinstance(weights, dict):
+            weights = [weights.get(gameid, 0) for gameid in self._gameids]
+        elif weights is not None and len(weights) != len(self._gameids):
+            raise ValueError(
+                "Expected %i weights, got %i" % (len(self._gameids), len(weights))
+            )
+        if stratify_by is not None:
+            strata = self.get_meta_arrays([stratify_by])[stratify_by]
+            weights = sampling.stratify(strata, weights)
+        if weights is None:
+            return None
+        return dict(zip(self._gameids, np.asarray(weights, dtype=np.float64)))
+
+    def _connect(self):
+        """Connects to the database, defining the `nle_in_shard(gameid)` SQL
+        function that selects the games of this dataset's shard."""
+        conn = nld.db.connect(self.dbfilename)
+        conn.create_function(
+            "nle_in_shard",
+            1,
+            lambda gameid: self._shard is None or gameid in self._shard,
+            deterministic=True,
+        )
+        return conn
 
     def get_paths(self, gameid):
         return [path for _, path in self._games[gameid]]
@@ -279,88 +592,549 @@ class TtyrecDataset:
             self.populate_metadata()
         return self._meta_cols
 
+    def get_meta_arrays(self, columns=None):
+        """Returns columns of the `games` table as arrays over the dataset's games.
+
+        Allows filtering large datasets without looping over their games, eg
+        `m = data.get_meta_arrays(["role", "turns"])` and then
+        `m["gameid"][(m["role"] == "Val") & (m["turns"] > 1000)]`.
+
+        :param columns: Names of the columns, or None for all.
+        :returns: A dict {column: array} with "gameid" and each column, in the
+            order of the dataset's games. Integer columns are int64 arrays,
+            others string arrays. Missing values are -1 and "", respectively.
+        """
+        with contextlib.closing(self._connect()) as conn:
+            table = conn.execute("PRAGMA table_info(games)").fetchall()
+            types = {name: ctype for _, name, ctype, *_ in table}
+            if columns is None:
+                columns = list(types)
+            unknown = [column for column in columns if column not in types]
+            if unknown:
+                raise ValueError("Unknown columns: %s" % ", ".join(unknown))
+            columns = [column for column in columns if column != "gameid"]
+            select = ", ".join("games." + column for column in ["gameid"] + columns)
+            sql = self._meta_sql.replace("games.*", select, 1)
+            rows = {row[0]: row[1:] for row in conn.execute(sql, self._sql_args)}
+
+        found = [rows.get(gameid) for gameid in self._gameids]
+        result = dict(gameid=np.array(self._gameids, dtype=np.int64))
+        for i, column in enumerate(columns):
+            if types[column] == "INTEGER":
+                values = [-1 if r is None or r[i] is None else r[i] for r in found]
+                result[column] = np.array(values, dtype=np.int64)
+            else:
+                values = ["" if r is None or r[i] is None else r[i] for r in found]
+                result[column] = np.array(values, dtype=str)
+        return result
+
     def populate_metadata(self):
         self._meta = defaultdict(list)
-        with nld.db.connect(self.dbfilename) as conn:
+        with contextlib.closing(self._connect()) as conn:
             conn.row_factory = sqlite3.Row
             c = conn.cursor()
             for row in c.execute(self._meta_sql, self._sql_args):
                 self._meta[row[0]].append(row)
             self._meta_cols = [desc[0] for desc in c.description]
 
-    def _make_load_fns(self, gameids, batch_size):
-        """Create one closure per batch dimension."""
-        load_fns = []
-        for i in range(batch_size):
-            # Deterministically select a subset of games for this dimension.
-            my_gameids = gameids[i::batch_size]
-            load_fns.append(self._make_one_load_fn(my_gameids))
-        return load_fns
+    def _open_framestore(self):
+        """Returns the dataset's `FrameStore` and the (offset, length) of each of
+        its games, or (None, {}) if it has no usable one."""
+        if self._framestore is None:
+            self._framestore = (None, {})
+            if self.use_framestore:
+                conn = nld.db.get_connection(self.dbfilename)
+                path = nld.db.get_framestore(self.dataset_name, conn)
+                frames = nld.db.get_frames(self.dataset_name, conn)
+                if path is not None and os.path.exists(path):
+                    store = framestore.FrameStore(path)
+                    if (store.rows, store.cols) == (self.rows, self.cols):
+                        self._framestore = (store, frames)
+        return self._framestore
 
-    def _make_one_load_fn(self, gameids):
-        """Make a closure to load the next gameid from the db into the converter."""
-        count = [0]
+    def get_frames(self, gameid):
+        """Returns all frames of a game as zero-copy slices of the dataset's frame
+        store, or None if the game isn't in one."""
+        store, frames = self._open_framestore()
+        if gameid not in frames:
+            return None
+        return store.game(*frames[gameid])
 
-        def _load_fn(converter):
-            """Take the next part of the current game if available, else new game.
-            Return True if load successful, else False."""
-            gameid = converter.gameid
-            part = converter.part + 1
+    def get_game(self, gameid):
+        """Returns all frames of a game as a dict of arrays `[T, ...]`, with the
+        keys of `resim.read_ttyrec`.
 
-            files = self.get_paths(gameid)
-            if gameid == 0 or part >= len(files):
-                i = count[0]
-                count[0] += 1
+        Reads the frames from the frame store or the `cache` if they're there,
+        and converts the game's ttyrecs otherwise. The arrays are read-only
+        unless converted without a cache.
+        """
+        frames = self.get_frames(gameid)
+        if frames is not None:
+            return frames
+        paths = tuple(os.path.join(self._rootpath, p) for p in self.get_paths(gameid))
+
+        def load():
+            return resim.read_ttyrec(
+                paths,
+                self._ttyrec_version,
+                self.rows,
+                self.cols,
+                decode_threads=self.decode_threads,
+            )
+
+        if self.cache is None:
+            return load()
+        return self.cache.get((paths, self.rows, self.cols), load)
 
-                if (not self.loop_forever) and i >= len(gameids):
-                    return False
+    def _frame_shape(self):
+        """Returns the rows and columns of minibatch chars and colors."""
+        if self.crop is None:
+            return self.rows, self.cols
+        return self.crop[2:]
 
-                gameid = gameids[i % len(gameids)]
-                files = self.get_paths(gameid)
-                part = 0
+    def _crop(self, key, frames):
+        return framestore.crop_frames(key, frames, self.crop)
 
-            filename = files[part]
-            filepath = os.path.join(self._rootpath, filename)
-            converter.load_ttyrec(filepath, gameid=gameid, part=part)
-            return True
+    def _parse_status(self, chars, cursors, out):
+        """Parses whole `chars` and `cursors` frames into the start of the
+        `STATUS_KEYS` arrays at the end of `out` that aren't None."""
+        n = len(chars)
+        blstats, message = (a if a is None else a[:n] for a in out[len(FRAME_KEYS) :])
+        if blstats is not None or message is not None:
+            converter.parse_status(chars, cursors, blstats, message)
+
+    def _assign_lanes(self, gameids, batch_size):
+        """Returns the lane of each game of `gameids`.
+
+        Games are spread over lanes with `_balance_lanes` if their frame counts
+        are known and lanes don't loop.
+        """
+        frame_counts = self.get_frame_counts(count_missing=False)
+        if (
+            not self.loop_forever
+            and len(gameids) > batch_size
+            and all(gameid in frame_counts for gameid in gameids)
+        ):
+            return _balance_lanes(gameids, frame_counts, batch_size)
+        # Deterministically select a subset of games for each dimension.
+        return [i % batch_size for i in range(len(gameids))]
 
-        return _load_fn
+    def _make_batch_converter(self, gameids, batch_size, lanes=None, loop_forever=None):
+        """Create a `BatchConverter` converting `gameids` in `batch_size` lanes.
+
+        Returns a `FrameStoreBatch` instead if all games are in the frame store.
+
+        :param lanes: The lane of each game. Defaults to `_assign_lanes`.
+        :param loop_forever: Defaults to the dataset's `loop_forever`.
+        """
+        if lanes is None:
+            lanes = self._assign_lanes(gameids, batch_size)
+        if loop_forever is None:
+            loop_forever = self.loop_forever
+
+        store, frames = self._open_framestore()
+        if store is not None and all(gameid in frames for gameid in gameids):
+            batch = framestore.FrameStoreBatch(
+                store, batch_size, loop_forever, self.crop
+            )
+            for lane, gameid in zip(lanes, gameids):
+                batch.add_game(lane, gameid, *frames[gameid])
+            return batch
+
+        top, left, rows, cols = self.crop or (0, 0, self.rows, self.cols)
+        batch = converter.BatchConverter(
+            batch_size,
+            rows,
+            cols,
+            self._ttyrec_version,
+            loop_forever=loop_forever,
+            num_threads=self.num_threads,
+            term_rows=self.rows,
+            term_cols=self.cols,
+            decode_threads=self.decode_threads,
+            row_offset=top,
+            col_offset=left,
+        )
+        for lane, gameid in zip(lanes, gameids):
+            for part, filename in enumerate(self.get_paths(gameid)):
+                filepath = os.path.join(self._rootpath, filename)
+                batch.add_ttyrec(lane, gameid, part, filepath)
+        return batch
+
+    def _get_executor(self):
+        """Returns a thread pool of `num_threads` threads, or None for one."""
+        if self.num_threads != 1 and self._executor is None:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.num_threads or None
+            )
+        return self._executor
+
+    def get_frame_counts(self, count_missing=True):
+        """Returns the number of frames of each game, as {gameid: count}.
+
+        Uses the counts in the database (see `populate_db.add_frame_counts`) or
+        in the frame store. Other games are counted from the ttyrecs' indexes,
+        which are built on first use (see `TtyrecReader`), or left out if
+        `count_missing` is false.
+        """
+        if self._part_frame_counts is None:
+            self._part_frame_counts = nld.db.get_frame_counts(
+                self.dataset_name, nld.db.get_connection(self.dbfilename)
+            )
+        store, frames = self._open_framestore()
+        missing = [
+            gameid
+            for gameid in self._gameids
+            if gameid not in frames and gameid not in self._part_frame_counts
+        ]
+        if count_missing:
+            paths = [
+                os.path.join(self._rootpath, path)
+                for gameid in missing
+                for path in self.get_paths(gameid)
+            ]
+            executor = self._get_executor()
+            map_fn = map if executor is None else executor.map
+            counts = list(
+                map_fn(
+                    sampling.count_frames, paths, [self._ttyrec_version] * len(paths)
+                )
+            )
+            for gameid in missing:
+                num_parts = len(self.get_paths(gameid))
+                self._part_frame_counts[gameid] = counts[:num_parts]
+                del counts[:num_parts]
+
+        return {
+            gameid: frames[gameid][1]
+            if gameid in frames
+            else sum(self._part_frame_counts[gameid])
+            for gameid in self._gameids
+            if gameid in frames or gameid in self._part_frame_counts
+        }
+
+    def _make_window_batch(self, batch_size, random_state=np.random):
+        """Create a `WindowBatch` filling `batch_size` lanes with random windows
+        drawn with `random_state`."""
+        frame_counts = self.get_frame_counts()
+        sampler = sampling.WindowSampler(
+            frame_counts, self.seq_length, self._weights, random_state
+        )
+
+        store, frames = self._open_framestore()
+        if store is not None and all(gameid in frames for gameid in frame_counts):
+
+            def read_fn(gameid, start, length, out):
+                offset, count = frames[gameid]
+                n = min(length, count - start)
+                begin = offset + start
+                for key, array in zip(FRAME_KEYS, out):
+                    if array is not None:
+                        array[:n] = self._crop(key, store[key][begin : begin + n])
+                self._parse_status(
+                    store["tty_chars"][begin : begin + n],
+                    store["tty_cursor"][begin : begin + n],
+                    out,
+                )
+                return n
+
+        elif self.cache is not None:
+
+            def read_fn(gameid, start, length, out):
+                game = self.get_game(gameid)
+                n = min(length, len(game["timestamps"]) - start)
+                for key, array in zip(FRAME_KEYS, out):
+                    if array is not None:
+                        array[:n] = self._crop(key, game[key][start : start + n])
+                self._parse_status(
+                    game["tty_chars"][start : start + n],
+                    game["tty_cursor"][start : start + n],
+                    out,
+                )
+                return n
+
+        else:
+
+            def read_fn(gameid, start, length, out):
+                paths = [
+                    os.path.join(self._rootpath, p) for p in self.get_paths(gameid)
+                ]
+                frames = out[: len(FRAME_KEYS)]
+                scratch = self.crop is not None or any(a is None for a in frames)
+                if scratch:
+                    # Read whole frames, then copy what's needed.
+                    arrays, _ = _new_buffers(
+                        1, length, self.rows, self.cols, self._ttyrec_version
+                    )
+                    frames = [array[0] for array in arrays[: len(FRAME_KEYS)]]
+                n = sampling.read_window(
+                    paths,
+                    self._part_frame_counts[gameid],
+                    self._ttyrec_version,
+                    start,
+                    frames,
+                )
+                if scratch:
+                    for key, array, window in zip(FRAME_KEYS, out, frames):
+                        if array is not None:
+                            array[:n] = self._crop(key, window[:n])
+                self._parse_status(frames[0][:n], frames[2][:n], out)
+                return n
+
+        frames_per_lane = None
+        if not self.loop_forever:
+            frames_per_lane = -(-sum(frame_counts.values()) // batch_size)
+        return sampling.WindowBatch(
+            sampler, read_fn, batch_size, frames_per_lane, self._get_executor()
+        )
 
     def __iter__(self):
-        gameids = list(self._gameids)
-        if self.shuffle:
-            np.random.shuffle(gameids)
+        epoch = self.epoch
+        resume, self._resume = self._resume, None
+        random_state = np.random
+        if self.seed is not None:
+            random_state = np.random.RandomState([self.seed, epoch])
+        if self.random_windows:
+            batch = self._make_window_batch(self.batch_size, random_state)
+            state = dict(epoch=epoch)
+        else:
+            if resume is not None:
+                gameids, lanes = resume["gameids"], resume["lanes"]
+            else:
+                gameids = list(self._gameids)
+                if self._game_sampler is not None:
+                    draws = self._game_sampler.sample(len(gameids), random_state)
+                    gameids = [gameids[i] for i in draws]
+                elif self.shuffle:
+                    random_state.shuffle(gameids)
+                lanes = self._assign_lanes(gameids, self.batch_size)
+            batch = self._make_batch_converter(gameids, self.batch_size, lanes)
+            state = dict(epoch=epoch, gameids=gameids, lanes=lanes)
+        # The batch states of the backends mean different things.
+        if isinstance(batch, sampling.WindowBatch):
+            state["backend"] = "windows"
+        elif isinstance(batch, framestore.FrameStoreBatch):
+            state["backend"] = "framestore"
+        else:
+            state["backend"] = "ttyrecs"
+        if resume is not None and resume["batch"] is not None:
+            if resume.get("backend") != state["backend"]:
+                raise ValueError(
+                    "Can't restore a state of reading from %s when reading from %s"
+                    % (resume.get("backend"), state["backend"])
+                )
+            batch.restore(resume["batch"])
+            state["batch"] = resume["batch"]
+        else:
+            state["batch"] = None
+        self.epoch = epoch + 1
+        self._state = state
 
-        load_fns = self._make_load_fns(gameids, self.batch_size)
+        def save_state(batch_state):
+            self._state = dict(state, batch=batch_state)
 
-        return _ttyrec_generator(
+        args = (
             self.batch_size,
             self.seq_length,
-            self.rows,
-            self.cols,
-            load_fns,
-            self._map,
+            *self._frame_shape(),
+            batch,
             self._ttyrec_version,
         )
+        if self.prefetch > 0:
+            minibatches = _prefetching_generator(
+                *args, self.prefetch, save_state=save_state, keys=self.keys
+            )
+        else:
+            minibatches = _ttyrec_generator(
+                *args, save_state=save_state, keys=self.keys
+            )
+        return self._track_epoch(minibatches)
+
+    def state_dict(self):
+        """Returns the position of the most recent iteration over the dataset, as
+        of the last minibatch it handed out.
+
+        The state holds the order of the epoch's games, the lane of each game
+        and, for each lane, the index of the ttyrec it's converting and the
+        number of frames converted from it, or its position in the frame
+        store. It also names the source of the frames ("ttyrecs", "framestore"
+        or "windows"), as these positions only apply to it. Passing it to
+        `load_state_dict` of a dataset created with the same arguments makes
+        its next iteration continue with the following minibatch. After an
+        epoch is done, the state only holds the number of the next epoch.
+        """
+        if self._state is None:
+            return dict(epoch=self.epoch)
+        return dict(self._state)
+
+    def load_state_dict(self, state):
+        """Makes the next iteration continue from a `state_dict`.
+
+        Lanes skip to their position in their current ttyrec without writing
+        any frames, and without reading their previous ttyrecs. With
+        `random_windows`, the lanes' current windows are restored, and with a
+        `seed` the windows drawn after them too. Parsed "blstats" carry
+        nothing forward from before the restored position, so the hero's
+        position is 0 until a frame shows it.
+
+        The next iteration raises a ValueError if its frames come from another
+        source than the state's, eg if the frame store was built or removed
+        in between.
+        """
+        self.epoch = state["epoch"]
+        self._state = None
+        self._resume = state if "batch" in state else None
+
+    def _track_epoch(self, minibatches):
+        """Passes on `minibatches`, logging the fraction of padding frames once
+        they are exhausted."""
+        padding = total = 0
+        with contextlib.closing(minibatches):
+            for mb in minibatches:
+                padding += np.count_nonzero(mb["gameids"] == 0)
+                total += mb["gameids"].size
+                yield mb
+        self._state = dict(epoch=self.epoch)
+        self.padding_fraction = padding / max(total, 1)
+        logger.info(
+            "Epoch of '%s' done: %.1f%% of %i frames were padding",
+            self.dataset_name,
+            100 * self.padding_fraction,
+            total,
+        )
 
     def get_ttyrecs(self, gameids, chunk_size=None):
-        """Fetch data from a single episode, chunked into a sequence of tensors."""
+        """Fetch data from episodes, chunked into a sequence of tensors.
+
+        Returns minibatches `[len(gameids), chunk_size, ...]` like iterating
+        without `loop_forever`, with one game per batch entry, until all games
+        ran out. Games are read with `get_game`. For a single game, the chunks
+        are views of its frames, except for the zero-padded last one. Use
+        `iter_ttyrecs` to not hold whole games in memory.
+        """
         seq_length = chunk_size or self.seq_length
         batch_size = len(gameids)
-        load_fns = self._make_load_fns(gameids, batch_size)
-
+        games = [self.get_game(gameid) for gameid in gameids]
+        lengths = [len(game["timestamps"]) for game in games]
+        keys = self.keys or ()
+        if "blstats" in keys or "message" in keys:
+            # Parse each game once, carrying fields forward over all of it.
+            for i, (game, length) in enumerate(zip(games, lengths)):
+                status = {}
+                if "blstats" in keys:
+                    status["blstats"] = np.zeros(
+                        (length, converter.BLSTATS_SIZE), dtype=np.int64
+                    )
+                if "message" in keys:
+                    status["message"] = np.zeros(
+                        (length, converter.MESSAGE_SIZE), dtype=np.uint8
+                    )
+                converter.parse_status(
+                    game["tty_chars"],
+                    game["tty_cursor"],
+                    status.get("blstats"),
+                    status.get("message"),
+                )
+                games[i] = dict(game, **status)
         mbs = []
-        for mb in _ttyrec_generator(
-            batch_size,
-            seq_length,
-            self.rows,
-            self.cols,
-            load_fns,
-            self._map,
-            self._ttyrec_version,
-        ):
-            mbs.append({k: t.copy() for k, t in mb.items()})
+        # Like the converter, end with the first chunk ending in padding.
+        for start in range(0, max(lengths) // seq_length * seq_length + 1, seq_length):
+            _, mb = _new_buffers(
+                batch_size,
+                seq_length,
+                *self._frame_shape(),
+                self._ttyrec_version,
+                self.keys,
+            )
+            keys = [k for k in mb if k not in ("done", "gameids")]
+            if batch_size == 1 and start + seq_length <= lengths[0]:
+                for key in keys:
+                    frames = games[0][key][None, start : start + seq_length]
+                    mb[key] = self._crop(key, frames)
+                mb["gameids"][:] = gameids[0]
+                mbs.append(mb)
+                continue
+            for lane, (gameid, game) in enumerate(zip(gameids, games)):
+                n = max(0, min(seq_length, lengths[lane] - start))
+                for key in keys:
+                    mb[key][lane, :n] = self._crop(key, game[key][start : start + n])
+                mb["gameids"][lane, :n] = gameid
+            mbs.append(mb)
         return mbs
 
     def get_ttyrec(self, gameid, chunk_size=None):
         return self.get_ttyrecs([gameid], chunk_size)
+
+    def iter_ttyrecs(self, gameids, chunk_size=None):
+        """Yields the chunks of `get_ttyrecs` one by one, as they're converted.
+
+        Only holds one chunk in memory at a time: Like iterating over the
+        dataset, the arrays of each chunk are reused for the next one, so copy
+        what you keep.
+        """
+        batch_size = len(gameids)
+        return _ttyrec_generator(
+            batch_size,
+            chunk_size or self.seq_length,
+            *self._frame_shape(),
+            self._make_batch_converter(gameids, batch_size, loop_forever=False),
+            self._ttyrec_version,
+            keys=self.keys,
+        )
+
+    def iter_ttyrec(self, gameid, chunk_size=None):
+        return self.iter_ttyrecs([gameid], chunk_size)
+
+    def get_frame_count(self, gameid):
+        """Returns the number of frames of a game.
+
+        Like `get_frame_counts`, but only counts this game's frames if they
+        aren't known yet.
+        """
+        store, frames = self._open_framestore()
+        if gameid in frames:
+            return frames[gameid][1]
+        if self._part_frame_counts is None:
+            self.get_frame_counts(count_missing=False)
+        if gameid not in self._part_frame_counts:
+            self._part_frame_counts[gameid] = [
+                sampling.count_frames(
+                    os.path.join(self._rootpath, path), self._ttyrec_version
+                )
+                for path in self.get_paths(gameid)
+            ]
+        return sum(self._part_frame_counts[gameid])
+
+    def read_game(self, gameid, out=None):
+        """Writes all frames of a game into preallocated arrays.
+
+        :param out: A dict of arrays `[T, ...]` with the keys of
+            `resim.read_ttyrec` and `T` at least the game's number of frames
+            (see `get_frame_count`), eg reused for several games. If None,
+            allocates arrays of just the right size.
+        :returns: A dict of the arrays of `out`, cut to the game's frames.
+        :raises ValueError: If the game doesn't fit into `out`.
+        """
+        if out is None:
+            length = self.get_frame_count(gameid)
+            out = {
+                key: np.zeros((length,) + desc["shape"], dtype=desc["dtype"])
+                for key, desc in framestore.frame_desc(self.rows, self.cols).items()
+            }
+        frames = self.get_frames(gameid)
+        if frames is not None:
+            n = len(frames["timestamps"])
+            if n > len(out["timestamps"]):
+                raise ValueError(
+                    "Game has more than %i frames" % len(out["timestamps"])
+                )
+            for key, array in frames.items():
+                out[key][:n] = array
+        else:
+            n = resim.read_ttyrec_into(
+                [os.path.join(self._rootpath, p) for p in self.get_paths(gameid)],
+                self._ttyrec_version,
+                out,
+                decode_threads=self.decode_threads,
+            )
+        return {key: array[:n] for key, array in out.items()}
@@ -2,12 +2,28 @@ import contextlib
 import logging
 import os
 import sqlite3
+import threading
 import time
 
 DB = "ttyrecs.db"
+
+# Columns of the `games` table with an index, see `create_indexes`.
+INDEXED_GAMES_COLUMNS = (
+    "role",
+    "race",
+    "gender",
+    "align",
+    "death",
+    "turns",
+    "points",
+    "maxlvl",
+)
 logger = logging.getLogger("db")
 
 
+_local = threading.local()
+
+
 @contextlib.contextmanager
 def db(conn=None, filename=DB, new=False, rw=None, **kwargs):
     if conn:
@@ -32,6 +48,52 @@ def connect(filename=DB, new=False, rw=None, **kwargs):
     return sqlite3.connect("file:" + filename, uri=True, **kwargs)
 
 
+def get_connection(filename=DB):
+    """Returns a read-only connection to the database, cached per thread.
+
+    Unlike connections from `connect` and `db`, it is reused by later calls,
+    so must not be closed or changed (eg its `row_factory`). A new connection
+    is opened in forked processes, or if the file was replaced.
+    """
+    if getattr(_local, "pid", None) != os.getpid():
+        _local.pid = os.getpid()
+        _local.connections = {}  # Never use connections of the parent.
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    key = (stat.st_dev, stat.st_ino)
+    cached = _local.connections.get(path)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    if cached is not None:
+        cached[1].close()
+    # Autocommit, so a long-lived connection never holds a read lock between
+    # statements, which would keep writers from committing.
+    conn = connect(path, isolation_level=None)
+    _local.connections[path] = (key, conn)
+    return conn
+
+
+def close_connections():
+    """Closes the connections `get_connection` cached for the calling thread."""
+    for _, conn in getattr(_local, "connections", {}).values():
+        conn.close()
+    _local.connections = {}
+
+
+def enable_wal(filename=DB):
+    """Switches the database to write-ahead logging, which lets writers (like
+    `populate_db` or `set_root`) commit while other processes read from it.
+
+    The journal mode is stored in the database, so this only needs to be done
+    once. Readers then need write access to the database's directory for the
+    `-wal` and `-shm` files.
+
+    :returns: The new journal mode, "wal" on success.
+    """
+    with db(filename=filename, rw=True) as conn:
+        return conn.execute("PRAGMA journal_mode=WAL").fetchone()[0]
+
+
 def ls(conn=None):
     with db(conn) as conn:
         c = conn.cursor()
@@ -89,6 +151,147 @@ def get_ttyrec_version(dataset_name, conn=None):
         ).fetchone()[0]
 
 
+def get_seeds(gameid, conn=None):
+    """Returns the initial (core, disp, reseed, lgen) seeds of a game, or None.
+
+    Seeds are only known for games recorded by NLE. `lgen` is None if the game
+    did not use a level generation seed.
+    """
+    with db(conn) as conn:
+        row = conn.execute(
+            "SELECT core, disp, reseed, lgen FROM seeds WHERE gameid=?", (gameid,)
+        ).fetchone()
+    if row is None:
+        return None
+    core, disp, reseed, lgen = row
+    return int(core), int(disp), bool(reseed), None if lgen is None else int(lgen)
+
+
+def create_seeds_table(conn):
+    # Seeds are unsigned 64 bit integers, which sqlite can't store as INTEGER.
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS seeds
+        (
+            gameid      INTEGER PRIMARY KEY,
+            core        TEXT,
+            disp        TEXT,
+            reseed      INTEGER,
+            lgen        TEXT
+        )"""
+    )
+
+
+def get_framestore(dataset_name, conn=None):
+    """Returns the path of the dataset's frame store, or None if there is none."""
+    with db(conn) as conn:
+        try:
+            row = conn.execute(
+                "SELECT path FROM framestores WHERE dataset_name=?", (dataset_name,)
+            ).fetchone()
+        except sqlite3.OperationalError:  # Database without frame stores.
+            return None
+    return None if row is None else row[0]
+
+
+def get_frames(dataset_name, conn=None):
+    """Returns a dict of gameid -> (offset, length) of the games in the dataset's
+    frame store."""
+    with db(conn) as conn:
+        try:
+            rows = conn.execute(
+                "SELECT gameid, offset, length FROM frames WHERE dataset_name=?",
+                (dataset_name,),
+            ).fetchall()
+        except sqlite3.OperationalError:  # Database without frame stores.
+            return {}
+    return {gameid: (offset, length) for gameid, offset, length in rows}
+
+
+def create_framestore_tables(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS framestores
+        (
+            dataset_name  TEXT PRIMARY KEY,
+            path          TEXT
+        )"""
+    )
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS frames
+        (
+            dataset_name  TEXT,
+            gameid        INTEGER,
+            offset        INTEGER,
+            length        INTEGER,
+            PRIMARY KEY   (dataset_name, gameid)
+        )"""
+    )
+
+
+def get_frame_counts(dataset_name, conn=None):
+    """Returns a dict of gameid -> [number of frames of each part] of the games in
+    the dataset whose parts all have been counted."""
+    with db(conn) as conn:
+        try:
+            rows = conn.execute(
+                """SELECT ttyrecs.gameid, frame_counts.frames FROM ttyrecs
+                INNER JOIN datasets ON ttyrecs.gameid=datasets.gameid
+                LEFT JOIN frame_counts ON frame_counts.gameid=ttyrecs.gameid
+                AND frame_counts.part=ttyrecs.part
+                WHERE datasets.dataset_name=?
+                ORDER BY ttyrecs.gameid, ttyrecs.part""",
+                (dataset_name,),
+            ).fetchall()
+        except sqlite3.OperationalError:  # Database without frame counts.
+            return {}
+    counts = {}
+    for gameid, frames in rows:
+        counts.setdefault(gameid, []).append(frames)
+    return {gameid: parts for gameid, parts in counts.items() if None not in parts}
+
+
+def create_frame_counts_table(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS frame_counts
+        (
+            gameid      INTEGER,
+            part        INTEGER,
+            frames      INTEGER,
+            PRIMARY KEY (gameid, part)
+        )"""
+    )
+
+
+def create_indexes(conn):
+    """Creates the indexes of the columns `subselect_sql` queries commonly
+    filter on (see `INDEXED_GAMES_COLUMNS`), unless they exist.
+
+    Done by `create` and when adding datasets; call it to index databases
+    created before.
+    """
+    for column in INDEXED_GAMES_COLUMNS:
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS games_%s ON games (%s)" % (column, column)
+        )
+    # The primary keys of `datasets` and `ttyrecs` start with the dataset name
+    # and gameid, respectively. Joining games to datasets needs its own index.
+    conn.execute("CREATE INDEX IF NOT EXISTS datasets_gameid ON datasets (gameid)")
+
+
+def create_game_stats_table(conn):
+    conn.execute(
+        """CREATE TABLE IF NOT EXISTS game_stats
+        (
+            gameid       INTEGER PRIMARY KEY,
+            frames       INTEGER,
+            starttime    INTEGER,
+            duration     INTEGER,
+            final_score  INTEGER,
+            max_score    INTEGER,
+            actions      BLOB
+        )"""
+    )
+
+
 def get_most_recent_games(n=1, conn=None):
     with db(conn=conn) as conn:
         c = conn.execute("SELECT gameid FROM games ORDER BY gameid DESC LIMIT ?", (n,))
@@ -241,6 +444,11 @@ def create(filename=DB):
             """
         )
 
+        create_seeds_table(c)
+        create_framestore_tables(c)
+        create_frame_counts_table(c)
+        create_game_stats_table(c)
+
         c.execute(
             """CREATE TABLE roots
             (
@@ -249,6 +457,7 @@ def create(filename=DB):
                 ttyrec_version INTEGER
             )"""
         )
+        create_indexes(c)
 
         conn.commit()
     logger.info(
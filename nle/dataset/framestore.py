@@ -0,0 +1,392 @@
+"""Stores converted ttyrec frames for fast repeated reading.
+
+Converting ttyrecs means decompressing them and emulating a terminal, which
+dominates the cost of iterating over a dataset. `materialize` does this once
+and appends the frames of every game of a dataset to a `FrameStore`: a
+directory with one flat, memory-mappable file per key. The offset and length
+of each game in the store are kept in the `frames` table of the database.
+`TtyrecDataset` reads from the store instead of the ttyrecs if it holds all of
+its games.
+
+Each game is converted with a fresh terminal, while `TtyrecDataset` streaming
+from ttyrecs carries the terminal of a batch entry over from one game to the
+next. Frames only differ if a game doesn't start by clearing the screen.
+
+Example
+-------
+    ```
+    import nle.dataset as nld
+
+    nld.materialize("data1", "path/to/frames")
+    for mb in nld.TtyrecDataset("data1"):  # Reads from path/to/frames.
+        print(mb)
+    ```
+"""
+
+import collections
+import concurrent.futures
+import json
+import os
+
+import numpy as np
+
+from nle import _pyconverter as converter
+from nle import dataset as nld
+from nle.dataset import resim
+
+META_FILENAME = "meta.json"
+
+
+def frame_desc(rows, cols):
+    """The shape (per frame) and dtype of each key of a frame store."""
+    return {
+        "tty_chars": dict(shape=(rows, cols), dtype=np.uint8),
+        "tty_colors": dict(shape=(rows, cols), dtype=np.int8),
+        "tty_cursor": dict(shape=(2,), dtype=np.int16),
+        "timestamps": dict(shape=(), dtype=np.int64),
+        "keypresses": dict(shape=(), dtype=np.uint8),
+        "scores": dict(shape=(), dtype=np.int32),
+    }
+
+
+def crop_frames(key, frames, crop):
+    """Returns a view of the window `crop` of `frames` of `key` if they're
+    chars or colors, or `frames` otherwise.
+
+    :param crop: A window `(top, left, height, width)`, or None for all.
+    """
+    if crop is None or key not in ("tty_chars", "tty_colors"):
+        return frames
+    top, left, height, width = crop
+    return frames[..., top : top + height, left : left + width]
+
+
+class FrameStore:
+    """Converted frames of many games, concatenated into one file per key."""
+
+    def __init__(self, path, rows=24, cols=80, mode="r"):
+        """Opens or creates a frame store.
+
+        :param path: Directory of the store.
+        :param rows: Number of terminal rows. Ignored when reading.
+        :param cols: Number of terminal columns. Ignored when reading.
+        :param mode: "r" to memory-map the store for reading, "a" to append to
+            it (creating it if needed).
+        """
+        self.path = path
+        self.mode = mode
+        meta_path = os.path.join(path, META_FILENAME)
+        if mode == "a" and not os.path.exists(meta_path):
+            os.makedirs(path, exist_ok=True)
+            with open(meta_path, "w") as f:
+                json.dump({"rows": rows, "cols": cols}, f)
+        with open(meta_path) as f:
+            meta = json.load(f)
+        self.rows = meta["rows"]
+        self.cols = meta["cols"]
+        if mode == "a" and (rows, cols) != (self.rows, self.cols):
+            raise ValueError(
+                "Frame store '%s' has %i x %i frames, not %i x %i"
+                % (path, self.rows, self.cols, rows, cols)
+            )
+        self.desc = frame_desc(self.rows, self.cols)
+
+        # Appends may have been cut short, so only count complete frames.
+        self._length = min(
+            os.path.getsize(p) // self._frame_size(k) if os.path.exists(p) else 0
+            for k, p in self._paths().items()
+        )
+
+        self._files = {}
+        self._arrays = {}
+        if mode == "a":
+            for key, path in self._paths().items():
+                f = open(path, "ab")
+                f.truncate(self._length * self._frame_size(key))
+                self._files[key] = f
+        elif mode == "r":
+            for key, path in self._paths().items():
+                d = self.desc[key]
+                shape = (self._length,) + d["shape"]
+                if self._length == 0:
+                    self._arrays[key] = np.zeros(shape, dtype=d["dtype"])
+                else:
+                    self._arrays[key] = np.memmap(
+                        path, dtype=d["dtype"], mode="r", shape=shape
+                    )
+        else:
+            raise ValueError("Unknown mode '%s'" % mode)
+
+    def _paths(self):
+        return {key: os.path.join(self.path, key + ".bin") for key in self.desc}
+
+    def _frame_size(self, key):
+        d = self.desc[key]
+        return int(np.prod(d["shape"], dtype=np.int64)) * np.dtype(d["dtype"]).itemsize
+
+    def __len__(self):
+        """Total number of frames in the store."""
+        return self._length
+
+    def __getitem__(self, key):
+        """The memory-mapped `[len(self), ...]` array of `key`."""
+        return self._arrays[key]
+
+    def game(self, offset, length):
+        """Returns the frames of one game as a dict of zero-copy array slices."""
+        return {k: a[offset : offset + length] for k, a in self._arrays.items()}
+
+    def append(self, frames):
+        """Appends the frames of one game. Returns their offset in the store.
+
+        :param frames: A dict with an array `[T, ...]` for every key of `desc`.
+        """
+        offset = self._length
+        length = len(frames["timestamps"])
+        for key, d in self.desc.items():
+            array = np.ascontiguousarray(frames[key], dtype=d["dtype"])
+            if array.shape != (length,) + d["shape"]:
+                raise ValueError("Wrong shape %s of '%s'" % (array.shape, key))
+            self._files[key].write(array.tobytes())
+        self._length += length
+        return offset
+
+    def flush(self):
+        for f in self._files.values():
+            f.flush()
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files = {}
+        self._arrays = {}
+
+
+def materialize(
+    dataset_name,
+    path,
+    dbfilename=nld.db.DB,
+    rows=24,
+    cols=80,
+    max_workers=None,
+    commit_every=100,
+):
+    """Converts all games of a dataset once and writes them to a frame store.
+
+    Games already in the store are skipped, so this can be rerun after adding
+    games to the dataset. Can be interrupted: Games are only registered in the
+    database once their frames are written.
+
+    :param dataset_name: Name of the dataset in the database.
+    :param path: Directory of the frame store. A dataset has at most one store.
+    :param dbfilename: Path to the database file.
+    :param rows: Number of terminal rows to convert.
+    :param cols: Number of terminal columns to convert.
+    :param max_workers: Number of threads converting games.
+    :param commit_every: Number of games between database commits.
+    :returns: The number of games added to the store.
+    """
+    path = os.path.abspath(path)
+    with nld.db.db(filename=dbfilename, rw=True) as conn:
+        nld.db.create_framestore_tables(conn)
+        existing = nld.db.get_framestore(dataset_name, conn)
+        if existing is not None and existing != path:
+            raise ValueError(
+                "Dataset '%s' already has a frame store at '%s'"
+                % (dataset_name, existing)
+            )
+        conn.execute(
+            "INSERT OR REPLACE INTO framestores VALUES (?, ?)", (dataset_name, path)
+        )
+
+        root = nld.db.get_root(dataset_name, conn)
+        ttyrec_version = nld.db.get_ttyrec_version(dataset_name, conn)
+        done = nld.db.get_frames(dataset_name, conn)
+        games = collections.defaultdict(list)
+        for gameid, filename in conn.execute(
+            """SELECT ttyrecs.gameid, ttyrecs.path FROM ttyrecs
+            INNER JOIN datasets ON ttyrecs.gameid=datasets.gameid
+            WHERE datasets.dataset_name=?
+            ORDER BY ttyrecs.gameid, ttyrecs.part""",
+            (dataset_name,),
+        ):
+            if gameid not in done:
+                games[gameid].append(os.path.join(root, filename))
+
+        def convert(paths):
+            return resim.read_ttyrec(paths, ttyrec_version, rows, cols)
+
+        store = FrameStore(path, rows, cols, mode="a")
+        written = 0
+
+        def write(gameid, future):
+            nonlocal written
+            frames = future.result()
+            offset = store.append(frames)
+            conn.execute(
+                "INSERT INTO frames VALUES (?, ?, ?, ?)",
+                (dataset_name, gameid, offset, len(frames["timestamps"])),
+            )
+            written += 1
+            if written % commit_every == 0:
+                store.flush()
+                conn.commit()
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+                # Only keep a few converted games in memory at a time.
+                window = 2 * (max_workers or os.cpu_count() or 1)
+                pending = collections.deque()
+                for gameid, paths in games.items():
+                    pending.append((gameid, executor.submit(convert, paths)))
+                    if len(pending) >= window:
+                        write(*pending.popleft())
+                while pending:
+                    write(*pending.popleft())
+            store.flush()
+            conn.commit()
+        finally:
+            store.close()
+    return len(games)
+
+
+class FrameStoreBatch:
+    """Fills minibatches from a `FrameStore`.
+
+    A drop-in replacement of `BatchConverter` for `TtyrecDataset`: Each batch
+    entry ("lane") copies the frames of its games one after the other.
+    """
+
+    KEYS = ("tty_chars", "tty_colors", "tty_cursor", "timestamps")
+    KEYS += ("keypresses", "scores")
+
+    def __init__(self, store, batch_size, loop_forever=False, crop=None):
+        """
+        :param crop: If given, only copy this window `(top, left, height,
+            width)` of the chars and colors of each frame.
+        """
+        self.store = store
+        self.crop = crop
+        self.batch_size = batch_size
+        self.loop_forever = loop_forever
+        self._games = [[] for _ in range(batch_size)]
+        self._next = [0] * batch_size
+        self._current = [None] * batch_size  # [gameid, offset, length, position]
+        self._done = [False] * batch_size
+        self._blstats = [None] * batch_size  # Of the last frame of each lane.
+
+    def add_game(self, lane, gameid, offset, length):
+        """Appends a game to the queue of `lane`."""
+        self._games[lane].append((gameid, offset, length))
+
+    def _load_next(self, lane):
+        games = self._games[lane]
+        if self._next[lane] == len(games):
+            if not self.loop_forever or not games:
+                return False
+            self._next[lane] = 0
+        self._current[lane] = list(games[self._next[lane]]) + [0]
+        self._next[lane] += 1
+        return True
+
+    def convert(
+        self,
+        chars,
+        colors,
+        cursors,
+        timestamps,
+        inputs,
+        scores,
+        resets,
+        gameids,
+        blstats=None,
+        message=None,
+    ):
+        """Fills `[batch_size, seq_length, ...]` arrays, see `BatchConverter`.
+        All but `resets` and `gameids` may be None to not fill them.
+
+        Returns the number of lanes that still had data.
+        """
+        arrays = (chars, colors, cursors, timestamps, inputs, scores)
+        for lane in range(self.batch_size):
+            self._fill_lane(lane, arrays, resets, gameids, blstats, message)
+        return self._done.count(False)
+
+    def state(self):
+        """Returns the position of each lane, see `BatchConverter.state`."""
+        return [
+            (
+                self._next[lane] - 1 if self._current[lane] else -1,
+                self._current[lane][3] if self._current[lane] else 0,
+                self._done[lane],
+            )
+            for lane in range(self.batch_size)
+        ]
+
+    def restore(self, states):
+        """Restores the lane positions returned by `state`."""
+        if len(states) != self.batch_size:
+            raise ValueError("Expected one state per lane")
+        for lane, (item, position, done) in enumerate(states):
+            self._current[lane] = None
+            if item >= 0:
+                self._current[lane] = list(self._games[lane][item]) + [position]
+            self._next[lane] = max(item + 1, 0)
+            self._done[lane] = done
+            self._blstats[lane] = None
+
+    def _fill_lane(self, lane, arrays, resets, gameids, blstats, message):
+        seq_length = resets.shape[1]
+        if self._current[lane] is None and not self._load_next(lane):
+            raise RuntimeError("Not enough ttyrecs to fill a batch!")
+
+        start = 0
+        resets[lane, 0] = 0
+        while not self._done[lane]:
+            current = self._current[lane]
+            gameid, offset, length, position = current
+            n = min(seq_length - start, length - position)
+            frames = slice(offset + position, offset + position + n)
+            for key, array in zip(self.KEYS, arrays):
+                if array is not None:
+                    array[lane, start : start + n] = crop_frames(
+                        key, self.store[key][frames], self.crop
+                    )
+            if blstats is not None or message is not None:
+                self._parse_status(lane, frames, start, n, blstats, message)
+            resets[lane, start + 1 : start + n] = 0
+            gameids[lane, start : start + n] = gameid
+            current[3] += n
+            start += n
+            if start == seq_length:
+                return
+
+            # There is still space in the buffers; load a new game.
+            if self._load_next(lane):
+                resets[lane, start] = 1
+            else:
+                self._done[lane] = True
+
+        for array in arrays + (resets, gameids, blstats, message):
+            if array is not None:
+                array[lane, start:] = 0
+
+    def _parse_status(self, lane, frames, start, n, blstats, message):
+        """Parses `frames` of the store into `n` frames of the lane, carrying
+        fields forward from the lane's previous frame of the same game."""
+        if n == 0:
+            return
+        previous = self._blstats[lane] if self._current[lane][3] else None
+        out = [
+            None if array is None else array[lane, start : start + n]
+            for array in (blstats, message)
+        ]
+        if out[0] is None:
+            out[0] = np.zeros((n, converter.BLSTATS_SIZE), dtype=np.int64)
+        converter.parse_status(
+            self.store["tty_chars"][frames],
+            self.store["tty_cursor"][frames],
+            *out,
+            previous=previous,
+        )
+        self._blstats[lane] = out[0][-1].copy()
@@ -0,0 +1,105 @@
+"""Keeps converted games in memory for repeated access.
+
+Evaluation and curriculum code often reads the same games over and over, eg
+with `TtyrecDataset.get_ttyrec` or `random_windows`, converting each of them
+from its ttyrecs every time. A `GameCache` holds the frames of recently used
+games up to a given number of bytes, dropping the least recently used games
+first. One cache can be shared by several datasets and threads.
+
+Example
+-------
+    ```
+    import nle.dataset as nld
+
+    cache = nld.GameCache(max_bytes=4 << 30)
+    dataset = nld.TtyrecDataset("data1", cache=cache)
+    chunks = dataset.get_ttyrec(gameid)  # Converts the game.
+    chunks = dataset.get_ttyrec(gameid)  # Reads the cached frames.
+    print(cache.stats())
+    ```
+"""
+
+import collections
+import threading
+
+
+class GameCache:
+    """A size-bounded least recently used cache of converted games.
+
+    Games are dicts of arrays, like those of `resim.read_ttyrec`. Cached arrays
+    are made read-only, as they are handed out without copying.
+    """
+
+    def __init__(self, max_bytes):
+        """
+        :param max_bytes: Maximum total size of the cached arrays. Games larger
+            than this are converted but not cached.
+        """
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._games = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        """Number of cached games."""
+        return len(self._games)
+
+    def __contains__(self, key):
+        return key in self._games
+
+    def get(self, key, load_fn):
+        """Returns the cached game `key`, or loads and caches it.
+
+        Games are loaded without holding the cache's lock, so other threads
+        can use the cache meanwhile. Two threads missing the same game both
+        load it.
+
+        :param key: A hashable key of the game.
+        :param load_fn: A function without arguments returning the game.
+        """
+        with self._lock:
+            game = self._games.get(key)
+            if game is not None:
+                self._games.move_to_end(key)
+                self.hits += 1
+                return game
+            self.misses += 1
+
+        game = load_fn()
+        nbytes = sum(array.nbytes for array in game.values())
+        for array in game.values():
+            array.flags.writeable = False
+        if nbytes > self.max_bytes:
+            return game
+
+        with self._lock:
+            if key not in self._games:
+                self._games[key] = game
+                self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._games.popitem(last=False)
+                self.nbytes -= sum(array.nbytes for array in evicted.values())
+                self.evictions += 1
+        return game
+
+    def clear(self):
+        """Drops all cached games, keeping the statistics."""
+        with self._lock:
+            self._games.clear()
+            self.nbytes = 0
+
+    def stats(self):
+        """Returns the cache's size and hit statistics as a dict."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return dict(
+                games=len(self._games),
+                nbytes=self.nbytes,
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hit_rate=self.hits / lookups if lookups else 0.0,
+            )
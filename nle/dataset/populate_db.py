@@ -1,12 +1,15 @@
 import collections
+import concurrent.futures
 import datetime
 import glob
+import itertools
 import os
 import re
 import time
 from functools import partial
 
 from nle import dataset as nld
+from nle.dataset import sampling
 
 XLOGFILE_COLUMNS = [
     ("version", str),
@@ -37,6 +40,17 @@ XLOGFILE_COLUMNS = [
     ("flags", str),
 ]
 
+# Initial RNG seeds, only present in xlogfiles written by NLE.
+SEED_COLUMNS = [
+    ("coreseed", str),
+    ("dispseed", str),
+    ("reseed", int),
+    ("lgenseed", str),
+]
+
+# Number of rows per executemany when inserting games from xlogfiles.
+BATCH_SIZE = 10000
+
 FIVE_MINS = 5 * 60
 ALT_TIMEFMT = re.compile(r"(.*\.\d\d)_(\d\d)_(\d\d.*)")
 
@@ -100,7 +114,9 @@ def assign_ttyrecs_to_games(ttyrecs, games):
     return [(ttyrec, gameid) for ttyrec, _, gameid, _, _ in assigned if gameid != -1]
 
 
-def add_altorg_directory(path, name, filename=nld.db.DB):
+def add_altorg_directory(
+    path, name, filename=nld.db.DB, count_frames=False, max_workers=None
+):
     """This function can be used to add the `altorg` dataset to a database.
 
     Once the altorg dataset has been downloaded, this function will parse its
@@ -130,9 +146,18 @@ def add_altorg_directory(path, name, filename=nld.db.DB):
     This algorithm should be deterministic and always return the same dataset
     from an empty database, regardless of environment.
 
+    If `count_frames` is true, the frames of each ttyrec are counted (see
+    `add_frame_counts`), which lets `TtyrecDataset` balance its batch entries.
+    This decodes every ttyrec, once the games are committed.
+
+    The xlogfiles are parsed and the ttyrecs' sizes read on a pool of
+    `max_workers` processes.
     """
 
-    with nld.db.db(filename=filename, rw=True) as conn:
+    with (
+        nld.db.db(filename=filename, rw=True) as conn,
+        concurrent.futures.ProcessPoolExecutor(max_workers) as executor,
+    ):
         print("Adding dataset '%s' ('%s') to '%s' " % (name, path, filename))
 
         root = os.path.abspath(path)
@@ -144,20 +169,27 @@ def add_altorg_directory(path, name, filename=nld.db.DB):
         nld.db.create_dataset(name, root, ttyrec_version=1, conn=c, commit=False)
 
         # 2. Add games from xlogfile to `games` table, then `datasets` table.
-        for xlogfile in sorted(
+        xlogfiles = sorted(
             glob.iglob(str(os.path.join(path, "xlogfile.*"))), reverse=True
-        ):
+        )
+        for xlogfile in xlogfiles:
             sep = ":" if xlogfile.endswith(".txt") else "\t"
-            game_gen = game_data_generator(xlogfile, separator=sep)
             insert_sql = f"""
                 INSERT INTO games
                 VALUES (NULL, {','.join('?' for _ in XLOGFILE_COLUMNS)} )
             """
-            c.executemany(insert_sql, game_gen)
+            start = time.time()
+            count = executemany_batched(
+                c, insert_sql, game_data_generator(xlogfile, separator=sep)
+            )
+            rate = count / max(time.time() - start, 1e-6)
 
-            gameids = nld.db.get_most_recent_games(c.rowcount, conn=c)
+            gameids = nld.db.get_most_recent_games(count, conn=c)
             nld.db.add_games(name, *gameids, conn=c, commit=False)
-            print("Found %i games in '%s'" % (len(gameids), xlogfile))
+            print(
+                "Found %i games in '%s' (%.0f games/sec)"
+                % (len(gameids), xlogfile, rate)
+            )
 
         # 3. Find all the (unblacklisted) ttyrecs belonging to each player
         #    and all the games belonging to each player.
@@ -169,6 +201,8 @@ def add_altorg_directory(path, name, filename=nld.db.DB):
             if ttyrec in blacklisted_ttyrecs:
                 continue
             ttyrecs_dict[ttyrec.split("/")[-2].lower()].append(ttyrec)
+        paths = [t for ttyrecs in ttyrecs_dict.values() for t in ttyrecs]
+        stats = dict(zip(paths, executor.map(_stat_file, paths, chunksize=1024)))
 
         games_dict = collections.defaultdict(list)
         for pname, gameid, start, end in nld.db.get_games(name, conn=c):
@@ -182,7 +216,7 @@ def add_altorg_directory(path, name, filename=nld.db.DB):
             assigned = assign_ttyrecs_to_games(ttyrecs_dict[pname], games_dict[pname])
             if assigned:
                 ttyrecs, gameids = zip(*assigned)
-                ttyrec_gen = ttyrec_data_generator(ttyrecs, gameids, root)
+                ttyrec_gen = ttyrec_data_generator(ttyrecs, gameids, root, stats)
                 c.executemany("INSERT INTO ttyrecs VALUES (?,?,?,?,?)", ttyrec_gen)
             elif games_dict[pname]:
                 empty_games.extend(gid for gid, _, _ in games_dict[pname])
@@ -209,11 +243,15 @@ def add_altorg_directory(path, name, filename=nld.db.DB):
            WHERE (turns <=10 AND (death = "escaped" OR death ="quit")) OR turns<=0"""
         nld.db.delete_games_with_select(start_scummed_games, conn=conn, commit=False)
 
+        nld.db.create_indexes(c)  # For databases created before indexes.
         mtime = time.time()
         c.execute("UPDATE meta SET mtime = ?", (mtime,))
 
-        # 7. Commit and wrap up (optimize the db).
+        # 7. Commit and wrap up (count frames, optimize the db).
         conn.commit()
+        if count_frames:
+            _add_frame_counts(c, name, max_workers)
+            conn.commit()
         print("Optimizing DB...")
         nld.db.vacuum(conn=conn)
         games_added = nld.db.count_games(name, conn=conn)
@@ -224,7 +262,14 @@ def add_altorg_directory(path, name, filename=nld.db.DB):
     )
 
 
-def add_nledata_directory(path, name, filename=nld.db.DB):
+def add_nledata_directory(
+    path,
+    name,
+    filename=nld.db.DB,
+    count_frames=False,
+    update=False,
+    max_workers=None,
+):
     """This function can be used to add any `nle_data` dataset to a database.
 
     Full games that are generated by an env such as:
@@ -237,9 +282,9 @@ def add_nledata_directory(path, name, filename=nld.db.DB):
 
         nle_data/
         ├── 20220414-112633_sdfd83ns/
-        │   ├── nle.3968599.0.ttyrec.bz2
-        │   ├── nle.3968599.k.ttyrec.bz2
-        │   └── nle.3968599.xlogfile
+        │   ├── nle.3968599.0.ttyrec.bz2
+        │   ├── nle.3968599.k.ttyrec.bz2
+        │   └── nle.3968599.xlogfile
         └── <date>-<time>_<random>/
             ├── nle.<process-id>.0.ttyrec.bz2
             ├── nle.<process-id>.k.ttyrec.bz2
@@ -247,6 +292,18 @@ def add_nledata_directory(path, name, filename=nld.db.DB):
 
     This algorithm should be deterministic and always return the same dataset
     from an empty database, regardless of environment.
+
+    If `count_frames` is true, the frames of each ttyrec are counted (see
+    `add_frame_counts`), which lets `TtyrecDataset` balance its batch entries.
+    This decodes every ttyrec, once the games are committed.
+
+    If `update` is true, an existing dataset is updated instead: Only games
+    with new ttyrecs are added. Ttyrecs whose size or mtime changed are
+    updated, dropping their frame counts, statistics and stored frames so
+    these are computed again.
+
+    The xlogfiles are parsed and the ttyrecs' sizes read on a pool of
+    `max_workers` processes.
     """
     with nld.db.db(filename=filename, rw=True) as conn:
         print("Adding dataset '%s' ('%s') to '%s' " % (name, path, filename))
@@ -256,59 +313,88 @@ def add_nledata_directory(path, name, filename=nld.db.DB):
         c = conn.cursor()
 
         # 1. Check if the dataset name exists, and add the root.
-        nld.db.create_dataset(name, root, conn=c, commit=False)
+        exists = (
+            c.execute("SELECT root FROM roots WHERE dataset_name=?", (name,)).fetchone()
+            is not None
+        )
+        if not (update and exists):
+            nld.db.create_dataset(name, root, conn=c, commit=False)
+        nld.db.create_seeds_table(c)  # For databases created before seeds.
+
+        # The ttyrecs already in the dataset, {path: (size, mtime, gameid, part)}.
+        known = {}
+        if update and exists:
+            root = nld.db.get_root(name, conn=c)
+            for relpath, size, mtime, gameid, part in c.execute(
+                """SELECT ttyrecs.path, ttyrecs.size, ttyrecs.mtime,
+                ttyrecs.gameid, ttyrecs.part FROM ttyrecs
+                INNER JOIN datasets ON ttyrecs.gameid=datasets.gameid
+                WHERE datasets.dataset_name=?""",
+                (name,),
+            ):
+                known[relpath] = (size, mtime, gameid, part)
 
         # 2. For each xlogfile, read the games and take only the games that
         #   correspond to the ttyrecs that exist in the enclosing directory.
-        for xlogfile in sorted(glob.iglob(path + "/*/*.xlogfile")):
-            stem = xlogfile.replace(".xlogfile", ".*.ttyrec*.bz2")
-
-            files = set(glob.iglob(stem))
-            ttyrecnames = {f.split("/")[-1] for f in files}
-            versions = {f.split("ttyrec")[-1].replace(".bz2", "") for f in files}
-            assert len(versions) == 1, "Cannot add ttyrecs with different versions"
-            version = versions.pop()
-
-            if version == "":
-                raise AssertionError(
-                    "Ttyrec version (* in ttyrec*.bz2) must be > 1 for NLE data."
+        xlogfiles = sorted(glob.iglob(path + "/*/*.xlogfile"))
+        changed = []
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            for version, games, ttyrecs in executor.map(
+                _read_nledata_xlogfile, xlogfiles
+            ):
+                c.execute(
+                    "UPDATE roots SET ttyrec_version = ? WHERE dataset_name = ?",
+                    (version, name),
                 )
 
-            c.execute(
-                "UPDATE roots SET ttyrec_version = ? WHERE dataset_name = ?",
-                (int(version), name),
-            )
-
-            ttyrecs = []
-            ttydir = str(os.path.dirname(xlogfile))
-
-            _filter = partial(
-                xlogfile_gen_filter,
-                ttyrecs=ttyrecs,
-                ttyrecnames=ttyrecnames,
-                ttydir=ttydir,
-            )
+                new = []
+                for game, (ttyrec, size, mtime) in zip(games, ttyrecs):
+                    relpath = os.path.relpath(ttyrec, root)
+                    if relpath not in known:
+                        new.append((game, (relpath, 0, size, mtime)))
+                    elif known[relpath][:2] != (size, mtime):
+                        changed.append((size, mtime) + known[relpath][2:])
+                if not new:
+                    continue
+                games, ttyrecs = zip(*new)
+
+                # 3. Add games to `games` and `datasets` table.
+                insert_sql = f"""
+                    INSERT INTO games
+                    VALUES (NULL, {','.join('?' for _ in XLOGFILE_COLUMNS)} )
+                """
+                c.executemany(insert_sql, (g[: len(XLOGFILE_COLUMNS)] for g in games))
+                gameids = nld.db.get_most_recent_games(c.rowcount, conn=c)
+                nld.db.add_games(name, *gameids, conn=conn, commit=False)
+
+                # Add the initial seeds of each game (if recorded) to `seeds` table.
+                c.executemany(
+                    "INSERT INTO seeds VALUES (?,?,?,?,?)",
+                    seed_data_generator(games, reversed(gameids)),
+                )
 
-            # 3. Add games to `games` and `datasets` table.
-            game_gen = game_data_generator(xlogfile, filter=_filter)
-            insert_sql = f"""
-                INSERT INTO games
-                VALUES (NULL, {','.join('?' for _ in XLOGFILE_COLUMNS)} )
-            """
-            c.executemany(insert_sql, game_gen)
-            gameids = nld.db.get_most_recent_games(c.rowcount, conn=c)
-            nld.db.add_games(name, *gameids, conn=conn, commit=False)
+                # 4. Add ttyrecs to `ttyrecs` table.
+                # Note gameids are "most recently added" so must be reversed.
+                c.executemany(
+                    "INSERT INTO ttyrecs VALUES (?,?,?,?,?)",
+                    (t + (g,) for t, g in zip(ttyrecs, reversed(gameids))),
+                )
 
-            # 4. Add ttyrecs to `ttyrecs` table.
-            # Note gameids are "most recently added" so must be reversed.
-            ttyrec_gen = ttyrec_data_generator(ttyrecs, reversed(gameids), root)
-            c.executemany("INSERT INTO ttyrecs VALUES (?,?,?,?,?)", ttyrec_gen)
+        if changed:
+            print("Updating %i changed ttyrecs..." % len(changed))
+            _update_ttyrecs(c, changed)
 
+        nld.db.create_indexes(c)  # For databases created before indexes.
         mtime = time.time()
         c.execute("UPDATE meta SET mtime = ?", (mtime,))
 
         conn.commit()
-        nld.db.vacuum(conn=conn)
+        # 5. Count the frames of the ttyrecs.
+        if count_frames:
+            _add_frame_counts(c, name, max_workers)
+            conn.commit()
+        if not update:
+            nld.db.vacuum(conn=conn)
         games_added = nld.db.count_games(name, conn=conn)
 
     print(
@@ -317,35 +403,191 @@ def add_nledata_directory(path, name, filename=nld.db.DB):
     )
 
 
-def ttyrec_data_generator(ttyrecs, gameids, root):
+def _read_nledata_xlogfile(xlogfile):
+    """Reads the games of one xlogfile of an `nle_data` directory that have a
+    ttyrec, and the size and mtime of these ttyrecs.
+
+    :returns: The ttyrec version, the games (with SEED_COLUMNS) and a list of
+        `(path, size, mtime)` of their ttyrecs, in the same order.
+    """
+    stem = xlogfile.replace(".xlogfile", ".*.ttyrec*.bz2")
+
+    files = set(glob.iglob(stem))
+    ttyrecnames = {f.split("/")[-1] for f in files}
+    versions = {f.split("ttyrec")[-1].replace(".bz2", "") for f in files}
+    assert len(versions) == 1, "Cannot add ttyrecs with different versions"
+    version = versions.pop()
+
+    if version == "":
+        raise AssertionError(
+            "Ttyrec version (* in ttyrec*.bz2) must be > 1 for NLE data."
+        )
+
+    ttyrecs = []
+    ttydir = str(os.path.dirname(xlogfile))
+
+    _filter = partial(
+        xlogfile_gen_filter,
+        ttyrecs=ttyrecs,
+        ttyrecnames=ttyrecnames,
+        ttydir=ttydir,
+    )
+    columns = XLOGFILE_COLUMNS + SEED_COLUMNS
+    games = list(game_data_generator(xlogfile, _filter, columns=columns))
+    ttyrecs = [(t, os.path.getsize(t), os.path.getmtime(t)) for t in ttyrecs]
+    return int(version), games, ttyrecs
+
+
+def _update_ttyrecs(c, changed):
+    """Updates the sizes and mtimes of changed ttyrecs and drops everything
+    computed from them.
+
+    :param changed: A list of `(size, mtime, gameid, part)`.
+    """
+    nld.db.create_frame_counts_table(c)  # For databases created before these.
+    nld.db.create_game_stats_table(c)
+    nld.db.create_framestore_tables(c)
+    c.executemany(
+        "UPDATE ttyrecs SET size=?, mtime=? WHERE gameid=? AND part=?", changed
+    )
+    c.executemany(
+        "DELETE FROM frame_counts WHERE gameid=? AND part=?",
+        ((gameid, part) for _, _, gameid, part in changed),
+    )
+    gameids = sorted({(gameid,) for _, _, gameid, _ in changed})
+    c.executemany("DELETE FROM game_stats WHERE gameid=?", gameids)
+    c.executemany("DELETE FROM frames WHERE gameid=?", gameids)
+
+
+def add_frame_counts(name, filename=nld.db.DB, max_workers=None):
+    """Counts the frames of the dataset's ttyrecs that haven't been counted yet.
+
+    `add_altorg_directory` and `add_nledata_directory` only do this if asked
+    to; use this function for datasets added without counting, or before
+    frame counts existed. Counting builds the index of each ttyrec, so takes
+    about as long as converting it. The database is only written to once all
+    ttyrecs are counted.
+
+    :param name: Name of the dataset in the database.
+    :param filename: Path to the database file.
+    :param max_workers: Number of threads counting ttyrecs.
+    """
+    with nld.db.db(filename=filename, rw=True) as conn:
+        c = conn.cursor()
+        _add_frame_counts(c, name, max_workers)
+        conn.commit()
+
+
+def _count_frames(path, ttyrec_version):
+    try:
+        # Don't leave index files next to the dataset's ttyrecs.
+        return sampling.count_frames(path, ttyrec_version, index_cache=False)
+    except (OSError, RuntimeError) as e:
+        print("Could not count frames of '%s': %s" % (path, e))
+        return None
+
+
+def _add_frame_counts(c, name, max_workers=None):
+    nld.db.create_frame_counts_table(c)  # For databases created before counts.
+    root = nld.db.get_root(name, conn=c)
+    ttyrec_version = nld.db.get_ttyrec_version(name, conn=c)
+    rows = c.execute(
+        """SELECT ttyrecs.gameid, ttyrecs.part, ttyrecs.path FROM ttyrecs
+        INNER JOIN datasets ON ttyrecs.gameid=datasets.gameid
+        LEFT JOIN frame_counts ON frame_counts.gameid=ttyrecs.gameid
+        AND frame_counts.part=ttyrecs.part
+        WHERE datasets.dataset_name=? AND frame_counts.frames IS NULL""",
+        (name,),
+    ).fetchall()
+
+    print("Counting frames of %i ttyrecs..." % len(rows))
+    with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+        # Count all before writing, not to hold the write lock meanwhile.
+        counts = list(
+            executor.map(
+                _count_frames,
+                [os.path.join(root, path) for _, _, path in rows],
+                [ttyrec_version] * len(rows),
+            )
+        )
+    c.executemany(
+        "INSERT OR REPLACE INTO frame_counts VALUES (?,?,?)",
+        (
+            (gameid, part, frames)
+            for (gameid, part, _), frames in zip(rows, counts)
+            if frames is not None
+        ),
+    )
+
+
+def _stat_file(path):
+    return os.path.getsize(path), os.path.getmtime(path)
+
+
+def ttyrec_data_generator(ttyrecs, gameids, root, stats=None):
+    """Yields `ttyrecs` rows, taking sizes and mtimes from `stats`, a dict
+    {path: (size, mtime)}, if given."""
     last_gameid = None
     for path, gameid in zip(ttyrecs, gameids):
         if gameid != last_gameid:
             part = 0
         relpath = os.path.relpath(path, root)
-        yield (
-            relpath,
-            part,
-            os.path.getsize(path),
-            os.path.getmtime(path),
-            gameid,
-        )
+        size, mtime = stats[path] if stats is not None else _stat_file(path)
+        yield (relpath, part, size, mtime, gameid)
         part += 1
         last_gameid = gameid
 
 
-def game_data_generator(xlogfile, filter=lambda x: x, separator="\t"):
+def seed_data_generator(games, gameids):
+    """Yields `seeds` rows for the games (from `game_data_generator` with
+    SEED_COLUMNS) that recorded their seeds."""
+    offset = len(XLOGFILE_COLUMNS)
+    for game, gameid in zip(games, gameids):
+        core, disp, reseed, lgen = game[offset : offset + len(SEED_COLUMNS)]
+        if core == "-1":
+            continue
+        yield (gameid, core, disp, reseed, None if lgen == "-1" else lgen)
+
+
+def game_data_generator(
+    xlogfile, filter=lambda x: x, separator="\t", columns=XLOGFILE_COLUMNS
+):
+    """Yields the `columns` of each game of an xlogfile as a tuple, converting
+    missing fields from -1.
+
+    Reads the file line by line, so its size doesn't matter. `filter` is
+    applied to the iterator of (undecoded) lines.
+    """
     with open(xlogfile, "rb") as f:
-        for line in filter(f.readlines()):
-            game_data = collections.defaultdict(lambda: -1)
-            for words in line.decode("latin-1").strip().split(separator):
-                key, *var = words.split("=")
-                game_data[key] = "=".join(var)
+        for line in filter(f):
+            fields = {}
+            for word in line.decode("latin-1").strip().split(separator):
+                key, _, value = word.partition("=")
+                fields[key] = value
+
+            if "while" in fields:
+                fields["death"] = "%s while %s" % (
+                    fields.get("death", -1),
+                    fields["while"],
+                )
+
+            yield tuple(ctype(fields.get(key, -1)) for key, ctype in columns)
 
-            if "while" in game_data:
-                game_data["death"] += " while " + game_data["while"]
 
-            yield tuple(ctype(game_data[key]) for key, ctype in XLOGFILE_COLUMNS)
+def executemany_batched(c, sql, rows, batch_size=BATCH_SIZE):
+    """Runs `executemany` on consecutive batches of `batch_size` rows, so that
+    `rows` can be a generator over more rows than fit into memory.
+
+    :returns: The number of rows.
+    """
+    count = 0
+    rows = iter(rows)
+    while True:
+        batch = list(itertools.islice(rows, batch_size))
+        if not batch:
+            return count
+        c.executemany(sql, batch)
+        count += len(batch)
 
 
 def xlogfile_gen_filter(gen, ttyrecnames, ttyrecs, ttydir):
@@ -355,7 +597,7 @@ def xlogfile_gen_filter(gen, ttyrecnames, ttyrecs, ttydir):
     # due to 'save_ttyrec_every' option in env.py, so filter these out.
     # If we do find a file, we will save it to be added later.
     for line in gen:
-        ttyrecname = line.decode("ascii").split("ttyrecname=")[-1].strip()
+        ttyrecname = line.rpartition(b"ttyrecname=")[2].strip().decode("latin-1")
         if ttyrecname in ttyrecnames:
             ttyrecs.append(ttydir + "/" + ttyrecname)
             yield line
@@ -0,0 +1,264 @@
+"""Re-simulates recorded NLE games to recover full observations.
+
+NLE ttyrecs only store the terminal output and the keypresses of a game. For
+games whose initial seeds were logged (see the `seeds` table populated by
+`add_nledata_directory`) and that were played without reseeding (ie after
+`env.seed(..., reseed=False)`), NetHack can replay the keypresses
+deterministically and produce every observation in
+`nle.nethack.OBSERVATION_DESC`.
+
+Example
+-------
+    ```
+    import nle.dataset as nld
+
+    for gameid, obs in nld.resimulate_dataset("data1", ("glyphs", "blstats")):
+        print(gameid, obs["glyphs"].shape, obs["keypresses"].shape)
+    ```
+"""
+
+import concurrent.futures
+import os
+
+import numpy as np
+
+from nle import _pyconverter as converter
+from nle import dataset as nld
+from nle.nethack import nethack
+
+TTY_KEYS = ("tty_chars", "tty_colors", "tty_cursor")
+READ_KEYS = TTY_KEYS + ("timestamps", "keypresses", "scores")
+
+
+def read_ttyrec(
+    paths, ttyrec_version, rows=24, cols=80, chunk_size=4096, decode_threads=1
+):
+    """Converts all parts of a ttyrec into arrays of frames.
+
+    :param paths: Paths to the parts of one game, in order.
+    :param ttyrec_version: Version of the ttyrecs (>= 2 to record keypresses).
+    :param chunk_size: Number of frames converted per call to the converter.
+    :param decode_threads: Number of threads decompressing large ttyrecs.
+    :returns: A dict with keys "tty_chars", "tty_colors", "tty_cursor",
+        "timestamps", "keypresses" and "scores", each an array with one entry
+        per frame (ie per keypress for ttyrec versions >= 2).
+    """
+    conv = converter.Converter(
+        rows, cols, ttyrec_version, decode_threads=decode_threads
+    )
+    chunks = []
+    for part, path in enumerate(paths):
+        conv.load_ttyrec(path, part=part)
+        remaining = 0
+        while remaining == 0:
+            chunk = dict(
+                tty_chars=np.zeros((chunk_size, rows, cols), dtype=np.uint8),
+                tty_colors=np.zeros((chunk_size, rows, cols), dtype=np.int8),
+                tty_cursor=np.zeros((chunk_size, 2), dtype=np.int16),
+                timestamps=np.zeros((chunk_size,), dtype=np.int64),
+                keypresses=np.zeros((chunk_size,), dtype=np.uint8),
+                scores=np.zeros((chunk_size,), dtype=np.int32),
+            )
+            remaining = conv.convert(*chunk.values())
+            chunks.append({k: v[: chunk_size - remaining] for k, v in chunk.items()})
+    return {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+
+
+def read_ttyrec_into(paths, ttyrec_version, out, decode_threads=1):
+    """Converts all parts of a ttyrec into preallocated arrays.
+
+    Unlike `read_ttyrec`, writes the frames straight into their final place,
+    so a game takes no memory besides `out`. Size `out` with the game's
+    number of frames, eg from `TtyrecDataset.get_frame_count`.
+
+    :param paths: Paths to the parts of one game, in order.
+    :param ttyrec_version: Version of the ttyrecs.
+    :param out: A dict of arrays `[T, ...]` with the keys of `read_ttyrec`.
+    :param decode_threads: Number of threads decompressing large ttyrecs.
+    :returns: The number of frames written to the start of the arrays.
+    :raises ValueError: If the game has more than `T` frames.
+    """
+    arrays = [out[key] for key in READ_KEYS]
+    rows, cols = arrays[0].shape[1:]
+    length = len(arrays[0])
+    conv = converter.Converter(
+        rows, cols, ttyrec_version, decode_threads=decode_threads
+    )
+    probe = None
+    n = 0
+    for part, path in enumerate(paths):
+        conv.load_ttyrec(path, part=part)
+        if n < length:
+            n = length - conv.convert(*(array[n:] for array in arrays))
+        if n == length:
+            # Check for frames beyond the end of the arrays.
+            if probe is None:
+                probe = [np.zeros((1,) + a.shape[1:], dtype=a.dtype) for a in arrays]
+            if conv.convert(*probe) == 0:
+                raise ValueError("Game has more than %i frames" % length)
+    if ttyrec_version < 2:  # The converter doesn't write these.
+        out["keypresses"][:n] = 0
+        out["scores"][:n] = 0
+    return n
+
+
+def resimulate(
+    paths,
+    seeds,
+    character="mon-hum-neu-mal",
+    observation_keys=("glyphs", "blstats"),
+    ttyrec_version=nethack.TTYREC_VERSION,
+    options=None,
+    spawn_monsters=True,
+    check_tty=True,
+):
+    """Replays the keypresses of a recorded game through NetHack.
+
+    :param paths: Paths to the ttyrec parts of the game, in order.
+    :param seeds: The initial (core, disp, reseed, lgen) seeds of the game, as
+        returned by `nld.db.get_seeds`.
+    :param character: The character of the game, eg "val-hum-fem-law".
+    :param observation_keys: Keys of `OBSERVATION_DESC` to return.
+    :param ttyrec_version: Version of the ttyrecs.
+    :param options: NetHack options the game was recorded with. If None,
+        `nle.nethack.NETHACKOPTIONS` are used.
+    :param spawn_monsters: Whether the game was recorded with monster spawning.
+    :param check_tty: If true, check that the replayed terminal matches the
+        recorded one before every keypress and raise a RuntimeError if not.
+    :returns: A dict of arrays `[T, ...]` for each observation key and
+        "keypresses", where entry `t` holds the observation keypress `t` was
+        made in response to.
+    """
+    if ttyrec_version < 2:
+        raise ValueError("Ttyrecs of version < 2 do not record keypresses")
+    core, disp, reseed, lgen = seeds
+    if reseed:
+        raise ValueError("Games played with reseeding can't be re-simulated")
+    recorded = read_ttyrec(paths, ttyrec_version)
+    keypresses = recorded["keypresses"]
+
+    keys = tuple(observation_keys)
+    if check_tty:
+        keys += tuple(k for k in TTY_KEYS if k not in keys)
+
+    result = {
+        key: np.zeros(
+            (len(keypresses),) + nethack.OBSERVATION_DESC[key]["shape"],
+            dtype=nethack.OBSERVATION_DESC[key]["dtype"],
+        )
+        for key in keys
+    }
+    game = nethack.Nethack(
+        observation_keys=keys,
+        playername="Agent-" + character,
+        ttyrec=None,
+        options=options,
+        spawn_monsters=spawn_monsters,
+    )
+    try:
+        game.set_initial_seeds(core, disp, reseed, lgen)
+        obs = game.reset()
+        n = 0  # Steps taken, the game may have no keypresses.
+        for t, keypress in enumerate(keypresses):
+            for key, o in zip(keys, obs):
+                result[key][t] = o
+            if check_tty:
+                for key in TTY_KEYS:
+                    if not np.array_equal(result[key][t], recorded[key][t]):
+                        raise RuntimeError(
+                            "Re-simulation of '%s' diverged at keypress %i (%s)"
+                            % (paths[0], t, key)
+                        )
+            obs, done = game.step(keypress)
+            n = t + 1
+            if done:
+                break
+    finally:
+        game.close()
+
+    result = {key: result[key][:n] for key in observation_keys}
+    result["keypresses"] = keypresses[:n]
+    return result
+
+
+def _resimulate_game(kwargs):
+    return resimulate(**kwargs)
+
+
+def resimulate_dataset(
+    dataset_name,
+    observation_keys=("glyphs", "blstats"),
+    dbfilename=nld.db.DB,
+    gameids=None,
+    character=None,
+    max_workers=None,
+    **kwargs,
+):
+    """Re-simulates the games of a dataset in a pool of processes.
+
+    Only games with recorded seeds (see `nld.db.get_seeds`) that were played
+    without reseeding can be re-simulated; other games are skipped.
+
+    :param dataset_name: Name of the dataset in the database.
+    :param observation_keys: Keys of `OBSERVATION_DESC` to return.
+    :param dbfilename: Path to the database file.
+    :param gameids: Re-simulate these games only. Defaults to all games.
+    :param character: Override the character of all games, eg
+        "mon-hum-neu-mal". If None, the character is read from the games'
+        metadata.
+    :param max_workers: Number of processes to use.
+    :param kwargs: Further arguments to `resimulate`.
+    :returns: A generator of `(gameid, observations)` in the order of `gameids`.
+    """
+    with nld.db.db(filename=dbfilename) as conn:
+        root = nld.db.get_root(dataset_name, conn)
+        ttyrec_version = nld.db.get_ttyrec_version(dataset_name, conn)
+        if gameids is None:
+            gameids = [
+                row[0]
+                for row in conn.execute(
+                    """SELECT seeds.gameid FROM seeds
+                    INNER JOIN datasets ON seeds.gameid=datasets.gameid
+                    WHERE datasets.dataset_name=? AND seeds.reseed=0
+                    ORDER BY seeds.gameid""",
+                    (dataset_name,),
+                )
+            ]
+
+        games = []
+        for gameid in gameids:
+            seeds = nld.db.get_seeds(gameid, conn=conn)
+            if seeds is None or seeds[2]:
+                continue
+            paths = [
+                os.path.join(root, row[0])
+                for row in conn.execute(
+                    "SELECT path FROM ttyrecs WHERE gameid=? ORDER BY part",
+                    (gameid,),
+                )
+            ]
+            game_character = character
+            if game_character is None:
+                row = conn.execute(
+                    "SELECT role, race, gender0, align0 FROM games WHERE gameid=?",
+                    (gameid,),
+                ).fetchone()
+                game_character = "-".join(row).lower()
+            games.append(
+                (
+                    gameid,
+                    dict(
+                        paths=paths,
+                        seeds=seeds,
+                        character=game_character,
+                        observation_keys=observation_keys,
+                        ttyrec_version=ttyrec_version,
+                        **kwargs,
+                    ),
+                )
+            )
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        results = executor.map(_resimulate_game, [g[1] for g in games])
+        for (gameid, _), result in zip(games, results):
+            yield gameid, result
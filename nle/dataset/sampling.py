@@ -0,0 +1,380 @@
+"""Samples random windows of consecutive frames from the games of a dataset.
+
+Iterating over a `TtyrecDataset` normally streams each game from its first to
+its last frame, so consecutive minibatches are highly correlated. With
+`random_windows=True`, every batch entry instead reads a sequence of
+independent windows, each starting at a uniformly random frame of a random
+game. Windows are read either from the dataset's frame store (see
+`nld.materialize`) or from the ttyrecs, seeking to the screen clear before the
+window's start rather than converting the game from its beginning.
+
+Example
+-------
+    ```
+    import nle.dataset as nld
+
+    dataset = nld.TtyrecDataset("data1", random_windows=True, loop_forever=True)
+    for mb in dataset:
+        # mb["done"] marks the first frame of each window.
+        print(mb["gameids"][:, 0], mb["tty_chars"].shape)
+    ```
+
+Games can also be drawn with given weights, eg to oversample high scores or
+rare roles, both for windows and for streaming whole games (see the
+`weights` arguments of `TtyrecDataset`). Draws use `AliasSampler`, which takes
+constant time per sample.
+"""
+
+import numpy as np
+
+from nle import _pyconverter as converter
+
+
+def count_frames(path, ttyrec_version, index_cache=True):
+    """Returns the number of frames the converter produces from one ttyrec.
+
+    Builds the ttyrec's index (or loads it, see `TtyrecReader`), but doesn't
+    convert any frames.
+    """
+    reader = converter.TtyrecReader(path, ttyrec_version, index_cache=index_cache)
+    channels = reader.channels
+    if not reader.zero_header:
+        # bzip2 reports the end of the stream along with the last record, which
+        # the converter therefore drops. A zero-length header ends the ttyrec
+        # after its last record, which is kept.
+        channels = channels[:-1]
+    if ttyrec_version < 2:
+        return len(channels)
+    return int(np.count_nonzero(channels == 1))
+
+
+def read_window(paths, part_counts, ttyrec_version, start, out, index_cache=True):
+    """Converts consecutive frames of a game, beginning with frame `start`.
+
+    Each part is read with a fresh terminal, seeking to the last screen clear
+    before `start`. Frames only differ from converting the whole game if a part
+    writes to the screen before clearing it.
+
+    :param paths: Paths to the parts of the game, in order.
+    :param part_counts: Number of frames of each part (see `count_frames`).
+    :param ttyrec_version: Version of the ttyrecs.
+    :param start: Frame of the game to start at.
+    :param out: Arrays `[T, ...]` to fill, in the order of `BatchConverter.convert`
+        (chars, colors, cursors, timestamps, inputs, scores).
+    :returns: The number of frames written, less than `T` at the end of the game.
+    """
+    chars, colors, cursors, timestamps, inputs, scores = out
+    rows, cols = chars.shape[1:]
+    length = len(timestamps)
+    n = 0
+    for path, count in zip(paths, part_counts):
+        if start >= count:
+            start -= count
+            continue
+        reader = converter.TtyrecReader(path, ttyrec_version, rows, cols, index_cache)
+        score = 0  # The converter starts every part with a score of 0.
+        if ttyrec_version < 2:
+            reader.seek(start)
+        else:
+            channels = reader.channels
+            record = np.flatnonzero(channels == 1)[start]
+            previous = np.flatnonzero(channels[:record] == 2)
+            if len(previous):
+                reader.seek(previous[-1])
+                score = np.frombuffer(reader.read()[2][:4], dtype=np.int32)[0]
+            reader.seek(record)
+
+        stop = min(length, n + count - start)  # Skip the dropped last record.
+        while n < stop:
+            record = reader.read()
+            if record is None:
+                break
+            usec, channel, data = record
+            if ttyrec_version > 1:
+                if channel == 2:
+                    score = np.frombuffer(data[:4], dtype=np.int32)[0]
+                if channel != 1:
+                    continue
+                inputs[n] = data[0]
+                scores[n] = score
+            reader.screen(chars[n], colors[n], cursors[n])
+            timestamps[n] = usec
+            n += 1
+        if n == length:
+            break
+        start = 0
+    return n
+
+
+class AliasSampler:
+    """Draws indices `i` with probabilities proportional to `weights[i]`.
+
+    Uses Walker's alias method: After building two tables in linear time,
+    every sample takes one uniform index and one uniform number, so arrays of
+    samples are drawn without any Python loop.
+    """
+
+    def __init__(self, weights):
+        """
+        :param weights: Non-negative weights, not all zero.
+        """
+        weights = np.asarray(weights, dtype=np.float64)
+        if weights.ndim != 1 or not np.all(np.isfinite(weights) & (weights >= 0)):
+            raise ValueError("Weights must be finite and non-negative")
+        total = weights.sum()
+        if not total > 0:
+            raise ValueError("No positive weights")
+
+        n = len(weights)
+        prob = weights * (n / total)
+        alias = np.arange(n, dtype=np.int64)
+        small = np.flatnonzero(prob < 1).tolist()
+        large = np.flatnonzero(prob >= 1).tolist()
+        while small and large:
+            less, more = small.pop(), large.pop()
+            alias[less] = more
+            prob[more] -= 1 - prob[less]
+            (small if prob[more] < 1 else large).append(more)
+        prob[small + large] = 1  # Only off by rounding errors.
+        self._prob = prob
+        self._alias = alias
+
+    def __len__(self):
+        return len(self._prob)
+
+    def sample(self, size=None, random_state=np.random):
+        """Returns random indices, as an array if `size` is given.
+
+        :param random_state: A `np.random.RandomState`, or the `np.random`
+            module.
+        """
+        index = random_state.randint(len(self._prob), size=size)
+        keep = random_state.random_sample(size) < self._prob[index]
+        return np.where(keep, index, self._alias[index])
+
+
+def stratify(strata, weights=None):
+    """Rescales weights so that all strata have the same total weight.
+
+    Drawing with the result picks each stratum equally often, and games within
+    a stratum in proportion to their `weights`.
+
+    :param strata: The stratum of each game, eg its role (see
+        `TtyrecDataset.get_meta_arrays`).
+    :param weights: The weight of each game. Defaults to equal weights.
+    :returns: An array of new weights. Strata of zero weight stay at zero.
+    """
+    _, inverse = np.unique(np.asarray(strata), return_inverse=True)
+    inverse = inverse.reshape(-1)
+    if weights is None:
+        weights = np.ones(len(inverse))
+    weights = np.asarray(weights, dtype=np.float64)
+    totals = np.bincount(inverse, weights)
+    totals[totals == 0] = 1
+    return weights / totals[inverse]
+
+
+class WindowSampler:
+    """Draws uniformly random windows of `seq_length` frames from a set of games.
+
+    Every window lies within one game, so a game with `n` frames holds
+    `n - seq_length + 1` of them. Games shorter than `seq_length` hold one
+    (shorter) window starting at their first frame.
+
+    Given weights, the windows of each game are drawn in proportion to its
+    weight instead: A window of a game of weight 2 is drawn twice as often as
+    one of a game of weight 1.
+    """
+
+    def __init__(self, frame_counts, seq_length, weights=None, random_state=np.random):
+        """
+        :param frame_counts: A dict {gameid: number of frames}.
+        :param seq_length: Number of frames per window.
+        :param weights: A dict {gameid: weight}. Games without a weight are
+            never drawn. If None, all windows are equally likely.
+        :param random_state: A `np.random.RandomState` to draw windows with, or
+            the `np.random` module.
+        """
+        self.seq_length = seq_length
+        self.random_state = random_state
+        self.gameids = np.array(list(frame_counts.keys()), dtype=np.int64)
+        self.frame_counts = np.array(list(frame_counts.values()), dtype=np.int64)
+        starts = np.maximum(self.frame_counts - seq_length + 1, 1)
+        starts[self.frame_counts == 0] = 0
+        self._starts = starts
+        self._cumulative_starts = np.cumsum(starts)
+        if not len(starts) or not self._cumulative_starts[-1]:
+            raise ValueError("No frames to sample windows from")
+        self._games = None
+        if weights is not None:
+            game_weights = [weights.get(gameid, 0) for gameid in frame_counts]
+            self._games = AliasSampler(starts * np.array(game_weights, dtype=float))
+
+    def __len__(self):
+        """Number of distinct windows."""
+        return int(self._cumulative_starts[-1])
+
+    def sample(self, size=None):
+        """Returns random `(gameid, start, length)` windows, as arrays if `size`
+        is given.
+
+        Uses `random_state`, like shuffling a `TtyrecDataset`.
+        """
+        random_state = self.random_state
+        if self._games is not None:
+            index = self._games.sample(size, random_state)
+            counts = self.frame_counts[index]
+            start = (random_state.random_sample(size) * self._starts[index]).astype(
+                np.int64
+            )
+            length = np.minimum(counts - start, self.seq_length)
+            return self.gameids[index], start, length
+        window = random_state.randint(len(self), size=size)
+        index = np.searchsorted(self._cumulative_starts, window, side="right")
+        counts = self.frame_counts[index]
+        first = self._cumulative_starts[index] - np.maximum(
+            counts - self.seq_length + 1, 1
+        )
+        start = window - first
+        length = np.minimum(counts - start, self.seq_length)
+        return self.gameids[index], start, length
+
+
+class WindowBatch:
+    """Fills minibatches with random windows drawn by a `WindowSampler`.
+
+    A drop-in replacement of `BatchConverter` for `TtyrecDataset`: Each batch
+    entry ("lane") reads one window after the other, marking the first frame
+    of each window as a reset. A window cut off by the end of a minibatch
+    continues in the next one.
+    """
+
+    def __init__(
+        self, sampler, read_fn, batch_size, frames_per_lane=None, executor=None
+    ):
+        """
+        :param sampler: The `WindowSampler` to draw windows from.
+        :param read_fn: A function `read_fn(gameid, start, length, out)` that
+            writes up to `length` consecutive frames of a game into the arrays
+            `out`, like `read_window`, and returns their number. `out` holds
+            the arrays of `convert` but `resets` and `gameids`, in its order,
+            with None for arrays passed to `convert` as None.
+        :param batch_size: Number of lanes.
+        :param frames_per_lane: Number of frames after which a lane runs out
+            and is zero-padded. If None, lanes never run out.
+        :param executor: If given, read the windows of a minibatch in parallel
+            on this `concurrent.futures.Executor`.
+        """
+        self.sampler = sampler
+        self.read_fn = read_fn
+        self.batch_size = batch_size
+        self.frames_per_lane = frames_per_lane
+        self.executor = executor
+        self._windows = [None] * batch_size  # [gameid, next frame, remaining]
+        self._frames = [0] * batch_size
+
+    def _plan(self, lane, seq_length):
+        """Draws the windows of the next minibatch of `lane`.
+
+        :returns: A list of `(gameid, start, reset, length)` segments to read.
+        """
+        segments = []
+        position = 0
+        budget = seq_length
+        if self.frames_per_lane is not None:
+            budget = min(budget, self.frames_per_lane - self._frames[lane])
+        while position < budget:
+            window = self._windows[lane]
+            reset = window is None
+            if reset:
+                window = [int(x) for x in self.sampler.sample()]
+            gameid, start, remaining = window
+            n = min(remaining, budget - position)
+            segments.append((gameid, start, reset, n))
+            window[1] += n
+            window[2] -= n
+            self._windows[lane] = window if window[2] else None
+            position += n
+        self._frames[lane] += position
+        return segments
+
+    def _fill(self, lane, segments, arrays, resets, gameids):
+        position = 0
+        for gameid, start, reset, length in segments:
+            end = position + length
+            out = tuple(None if a is None else a[lane, position:end] for a in arrays)
+            if self.read_fn(gameid, start, length, out) != length:
+                raise RuntimeError(
+                    "Game %i has fewer frames than expected (%i)"
+                    % (gameid, start + length)
+                )
+            resets[lane, position] = reset
+            resets[lane, position + 1 : end] = 0
+            gameids[lane, position:end] = gameid
+            position = end
+        for array in arrays + (resets, gameids):
+            if array is not None:
+                array[lane, position:] = 0
+
+    def convert(
+        self,
+        chars,
+        colors,
+        cursors,
+        timestamps,
+        inputs,
+        scores,
+        resets,
+        gameids,
+        blstats=None,
+        message=None,
+    ):
+        """Fills `[batch_size, seq_length, ...]` arrays, see `BatchConverter`.
+        All but `resets` and `gameids` may be None to not read them.
+
+        Returns the number of lanes that still have frames to read.
+        """
+        arrays = (chars, colors, cursors, timestamps, inputs, scores, blstats, message)
+        seq_length = resets.shape[1]
+        lanes = range(self.batch_size)
+        plans = [self._plan(lane, seq_length) for lane in lanes]
+
+        def fill(lane):
+            self._fill(lane, plans[lane], arrays, resets, gameids)
+
+        if self.executor is None:
+            for lane in lanes:
+                fill(lane)
+        else:
+            list(self.executor.map(fill, lanes))
+        if self.frames_per_lane is None:
+            return self.batch_size
+        return sum(f < self.frames_per_lane for f in self._frames)
+
+    def state(self):
+        """Returns the window being read and the number of frames read by each
+        lane, and the state of the sampler's `RandomState`, if it has one."""
+        random_state = self.sampler.random_state
+        return dict(
+            lanes=[
+                (list(window) if window else None, frames)
+                for window, frames in zip(self._windows, self._frames)
+            ],
+            random_state=random_state.get_state()
+            if isinstance(random_state, np.random.RandomState)
+            else None,
+        )
+
+    def restore(self, state):
+        """Restores the lanes' windows returned by `state`. Later windows are
+        drawn anew, continuing the sampler's `RandomState` if it has one."""
+        lanes = state["lanes"]
+        if len(lanes) != self.batch_size:
+            raise ValueError("Expected one state per lane")
+        self._windows = [list(window) if window else None for window, _ in lanes]
+        self._frames = [frames for _, frames in lanes]
+        random_state = self.sampler.random_state
+        if state["random_state"] is not None:
+            if not isinstance(random_state, np.random.RandomState):
+                raise ValueError("State of seeded windows, but the sampler isn't")
+            random_state.set_state(state["random_state"])
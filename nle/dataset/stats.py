@@ -0,0 +1,217 @@
+"""Computes per-game statistics of a dataset without emulating the terminal.
+
+Statistics like episode lengths, action histograms or score curves only need
+the headers of a ttyrec and its keypress and score channels. `scan_ttyrec`
+reads these with `Converter.scan`, which skips the terminal output instead of
+emulating it and copying the screen for every frame. `add_game_stats` scans
+all games of a dataset on a pool of threads and writes per-game aggregates to
+the `game_stats` table of the database.
+
+Example
+-------
+    ```
+    import nle.dataset as nld
+    from nle.dataset import stats
+
+    stats.add_game_stats("data1")
+    for gameid, game in stats.get_game_stats("data1").items():
+        print(gameid, game["frames"], game["actions"].argmax())
+    ```
+
+Or from the command line: `python -m nle.dataset.stats data1`.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import os
+
+import numpy as np
+
+from nle import _pyconverter as converter
+from nle import dataset as nld
+
+NUM_ACTIONS = 256  # Keypresses are single bytes.
+
+
+def scan_ttyrec(paths, ttyrec_version, chunk_size=4096, decode_threads=1):
+    """Reads the timestamps, keypresses and scores of all parts of a ttyrec.
+
+    Returns the same as `resim.read_ttyrec` without the terminal keys, and is
+    much faster.
+
+    :param paths: Paths to the parts of one game, in order.
+    :param ttyrec_version: Version of the ttyrecs. Keypresses and scores are
+        zero unless they're recorded (versions >= 2 and >= 3).
+    :param chunk_size: Number of frames read per call to the converter.
+    :param decode_threads: Number of threads decompressing large ttyrecs.
+    """
+    # The screen size doesn't matter, as no frames are rendered.
+    conv = converter.Converter(2, 2, ttyrec_version, decode_threads=decode_threads)
+    chunks = []
+    for part, path in enumerate(paths):
+        conv.load_ttyrec(path, part=part)
+        remaining = 0
+        while remaining == 0:
+            chunk = dict(
+                timestamps=np.zeros((chunk_size,), dtype=np.int64),
+                keypresses=np.zeros((chunk_size,), dtype=np.uint8),
+                scores=np.zeros((chunk_size,), dtype=np.int32),
+            )
+            remaining = conv.scan(*chunk.values())
+            chunks.append({k: v[: chunk_size - remaining] for k, v in chunk.items()})
+    return {key: np.concatenate([c[key] for c in chunks]) for key in chunks[0]}
+
+
+def game_stats(paths, ttyrec_version):
+    """Returns the aggregates of one game stored by `add_game_stats`.
+
+    :returns: A dict with the number of "frames", the "starttime" of the first
+        frame and the "duration" until the last (in microseconds), the
+        "final_score" and "max_score" (None for ttyrec versions < 3) and a
+        histogram of the keypresses, "actions" (None for versions < 2).
+    """
+    frames = scan_ttyrec(paths, ttyrec_version)
+    timestamps, scores = frames["timestamps"], frames["scores"]
+    result = dict(
+        frames=len(timestamps),
+        starttime=int(timestamps[0]) if len(timestamps) else None,
+        duration=int(timestamps[-1] - timestamps[0]) if len(timestamps) else 0,
+        final_score=None,
+        max_score=None,
+        actions=None,
+    )
+    if ttyrec_version >= 2:
+        result["actions"] = np.bincount(frames["keypresses"], minlength=NUM_ACTIONS)
+    if ttyrec_version >= 3 and len(scores):
+        result["final_score"] = int(scores[-1])
+        result["max_score"] = int(scores.max())
+    return result
+
+
+def _game_stats(paths, ttyrec_version):
+    try:
+        return game_stats(paths, ttyrec_version)
+    except (OSError, RuntimeError) as e:
+        print("Could not scan '%s': %s" % (paths[0], e))
+        return None
+
+
+def add_game_stats(
+    dataset_name, filename=nld.db.DB, max_workers=None, commit_every=1000
+):
+    """Computes the statistics of the dataset's games that don't have them yet.
+
+    :param dataset_name: Name of the dataset in the database.
+    :param filename: Path to the database file.
+    :param max_workers: Number of threads scanning games.
+    :param commit_every: Number of games between database commits.
+    :returns: The number of games added.
+    """
+    with nld.db.db(filename=filename, rw=True) as conn:
+        nld.db.create_game_stats_table(conn)  # For databases created before.
+        root = nld.db.get_root(dataset_name, conn)
+        ttyrec_version = nld.db.get_ttyrec_version(dataset_name, conn)
+        games = collections.defaultdict(list)
+        for gameid, path in conn.execute(
+            """SELECT ttyrecs.gameid, ttyrecs.path FROM ttyrecs
+            INNER JOIN datasets ON ttyrecs.gameid=datasets.gameid
+            LEFT JOIN game_stats ON game_stats.gameid=ttyrecs.gameid
+            WHERE datasets.dataset_name=? AND game_stats.gameid IS NULL
+            ORDER BY ttyrecs.gameid, ttyrecs.part""",
+            (dataset_name,),
+        ):
+            games[gameid].append(os.path.join(root, path))
+
+        print("Scanning %i games..." % len(games))
+        added = 0
+        with concurrent.futures.ThreadPoolExecutor(max_workers) as executor:
+            results = executor.map(
+                _game_stats, games.values(), [ttyrec_version] * len(games)
+            )
+            for gameid, stats in zip(games, results):
+                if stats is None:
+                    continue
+                actions = stats["actions"]
+                conn.execute(
+                    "INSERT INTO game_stats VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        gameid,
+                        stats["frames"],
+                        stats["starttime"],
+                        stats["duration"],
+                        stats["final_score"],
+                        stats["max_score"],
+                        None if actions is None else actions.astype(np.int64).tobytes(),
+                    ),
+                )
+                added += 1
+                if added % commit_every == 0:
+                    conn.commit()
+        conn.commit()
+    return added
+
+
+def get_game_stats(dataset_name, dbfilename=nld.db.DB):
+    """Returns the statistics of the dataset's games, as {gameid: stats}.
+
+    Each entry is a dict like the result of `game_stats`. Games without
+    statistics (see `add_game_stats`) are left out.
+    """
+    with nld.db.db(filename=dbfilename) as conn:
+        rows = conn.execute(
+            """SELECT game_stats.* FROM game_stats
+            INNER JOIN datasets ON game_stats.gameid=datasets.gameid
+            WHERE datasets.dataset_name=?
+            ORDER BY game_stats.gameid""",
+            (dataset_name,),
+        ).fetchall()
+    result = {}
+    for gameid, frames, starttime, duration, final, max_score, actions in rows:
+        if actions is not None:
+            actions = np.frombuffer(actions, dtype=np.int64)
+        result[gameid] = dict(
+            frames=frames,
+            starttime=starttime,
+            duration=duration,
+            final_score=final,
+            max_score=max_score,
+            actions=actions,
+        )
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Writes per-game statistics of a dataset to its database."
+    )
+    parser.add_argument("dataset_name", help="Name of the dataset.")
+    parser.add_argument("--db", default=nld.db.DB, help="Path to the database.")
+    parser.add_argument(
+        "--max_workers", type=int, default=None, help="Number of threads."
+    )
+    flags = parser.parse_args()
+
+    print(
+        "Added statistics of %i games"
+        % add_game_stats(flags.dataset_name, flags.db, flags.max_workers)
+    )
+    stats = get_game_stats(flags.dataset_name, flags.db)
+    frames = np.array([s["frames"] for s in stats.values()])
+    print("Games: %i, frames: %i" % (len(frames), frames.sum()))
+    if len(frames):
+        print(
+            "Frames per game: mean %.1f, median %i, max %i"
+            % (frames.mean(), np.median(frames), frames.max())
+        )
+    actions = [s["actions"] for s in stats.values() if s["actions"] is not None]
+    if actions:
+        actions = np.sum(actions, axis=0)
+        print("Most frequent keypresses:")
+        for key in np.argsort(actions)[::-1][:10]:
+            if actions[key]:
+                print("  %r: %i" % (chr(key), actions[key]))
+
+
+if __name__ == "__main__":
+    main()
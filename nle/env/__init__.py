@@ -4,6 +4,8 @@ from gymnasium.envs import registration
 
 from nle.env.base import DUNGEON_SHAPE
 from nle.env.base import NLE
+from nle.env.recorder import ObservationRecorder
+from nle.env.recorder import ObservationShards
 
 _version = "v0"
 
@@ -32,4 +34,4 @@ for name in (
     )
 
 
-__all__ = ["NLE", "DUNGEON_SHAPE"]
+__all__ = ["NLE", "DUNGEON_SHAPE", "ObservationRecorder", "ObservationShards"]
@@ -198,6 +198,7 @@ class NLE(gym.Env):
         allow_all_modes=False,
         spawn_monsters=True,
         render_mode="human",
+        buffer_scores=False,
     ):
         """Constructs a new NLE environment.
 
@@ -232,6 +233,13 @@ class NLE(gym.Env):
             render_mode (str): mode used to render the screen. One of
                 "human" | "ansi" | "full".
                 Defaults to "human", i.e. what a human would see playing the game.
+            buffer_scores (bool): If True, NetHack hands the end-of-game
+                entries of its logfile and xlogfile to the env instead of
+                locking and appending to these files, which avoids contention
+                between many envs sharing a savedir. The env then appends them
+                to the files in savedir itself. NetHack's `record` (high score
+                list) isn't written, and the top ten list isn't shown at the
+                end of the game, so is missing from ttyrecs. Defaults to False.
         """
         self.character = character
         self._max_episode_steps = max_episode_steps
@@ -308,6 +316,8 @@ class NLE(gym.Env):
         else:
             ttyrec = None
             scoreprefix = None
+        # Where to write the entries NetHack hands us, if any.
+        self._scoreprefix = scoreprefix if buffer_scores else None
 
         self.nethack = nethack.Nethack(
             observation_keys=self._observation_keys,
@@ -317,6 +327,7 @@ class NLE(gym.Env):
             wizard=wizard,
             spawn_monsters=spawn_monsters,
             scoreprefix=scoreprefix,
+            buffer_scores=buffer_scores,
         )
         self._close_nethack = weakref.finalize(self, self.nethack.close)
 
@@ -409,6 +420,9 @@ class NLE(gym.Env):
             self._quit_game(observation, done)
             done = True
 
+        if done:
+            self._write_score_entries()
+
         return (
             self._get_observation(observation),
             reward,
@@ -621,6 +635,21 @@ class NLE(gym.Env):
 
         return observation, done
 
+    def _write_score_entries(self):
+        """Appends the logfile and xlogfile entries of the game that just ended,
+        if NetHack buffered them."""
+        if self._scoreprefix is None:
+            return
+        entry = self.nethack.xlogfile_entry()
+        if entry:
+            line = "\t".join("%s=%s" % field for field in entry.items())
+            with open(self._scoreprefix + "xlogfile", "a", encoding="latin-1") as f:
+                f.write(line + "\n")
+        line = self.nethack.logfile_entry()
+        if line:
+            with open(self._scoreprefix + "logfile", "a", encoding="latin-1") as f:
+                f.write(line)
+
     def _quit_game(self, observation, done):
         """Smoothly quit a game."""
         # Get out of menus and windows.
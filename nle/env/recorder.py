@@ -0,0 +1,265 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+import json
+import logging
+import os
+import queue
+import threading
+
+import gymnasium as gym
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SHARD_PATTERN = "shard_%06i"
+META_FILENAME = "meta.json"
+
+# Per-step data recorded alongside the observations.
+STEP_DESC = {
+    "actions": dict(shape=(), dtype=np.int64),
+    "rewards": dict(shape=(), dtype=np.float32),
+    "done": dict(shape=(), dtype=np.uint8),
+}
+
+
+def _new_shard(desc, shard_size):
+    return {
+        key: np.zeros((shard_size,) + tuple(d["shape"]), dtype=d["dtype"])
+        for key, d in desc.items()
+    }
+
+
+def _write_shard(path, shard, length):
+    """Writes one shard as a directory of .npy files, one per key.
+
+    The shard is written to a temporary directory first and then renamed, so
+    readers never see partially written shards.
+    """
+    tmppath = path + ".tmp"
+    os.makedirs(tmppath, exist_ok=True)
+    for key, array in shard.items():
+        np.save(os.path.join(tmppath, key + ".npy"), array)
+    with open(os.path.join(tmppath, META_FILENAME), "w") as f:
+        json.dump({"length": length, "keys": sorted(shard.keys())}, f)
+    os.rename(tmppath, path)
+
+
+class ObservationRecorder(gym.Wrapper):
+    """Records observations, actions and rewards of an NLE environment to disk.
+
+    Every step is written as one row into fixed-size, columnar shards. Each
+    shard is a directory holding one `.npy` file per key with shape
+    `[shard_size, ...]`, so they can be opened with `np.load(mmap_mode="r")`
+    and sliced without copying. Full shards are handed to a background thread
+    for writing, so the environment loop never waits on disk I/O unless more
+    than `max_pending` shards are queued.
+
+    Row `t` holds the observation the agent acted on, the action taken, the
+    reward received and whether the episode ended with this step. Terminal
+    observations are not recorded. Resetting before an episode ended (eg at
+    an outer time limit) marks its last recorded step as done, so episodes
+    never run into each other.
+
+    Note that the arrays are stored uncompressed: delta-encoding would break
+    zero-copy reads via `np.memmap`.
+
+    Example:
+        >>> env = ObservationRecorder(
+        ...     gym.make("NetHackScore-v0"), "path/to/shards", ("glyphs", "blstats")
+        ... )
+        >>> obs, info = env.reset()
+        >>> obs, reward, done, truncated, info = env.step(0)
+        >>> env.close()  # Flushes the last (partial) shard.
+        >>> for mb in ObservationShards("path/to/shards").minibatches(32):
+        ...     print(mb["glyphs"].shape, mb["actions"])
+    """
+
+    def __init__(
+        self, env, savedir, observation_keys=None, shard_size=4096, max_pending=2
+    ):
+        """Constructs a new recorder around `env`.
+
+        Args:
+            env (gym.Env): The environment to record. Its observation space must
+                be a `gym.spaces.Dict`.
+            savedir (str): Directory to write shards into. Existing shards are
+                kept and new shards are numbered after them.
+            observation_keys (list or None): Observation keys to record. If None,
+                all keys of the observation space are recorded.
+            shard_size (int): Number of steps per shard.
+            max_pending (int): Maximum number of full shards waiting to be
+                written before `step` blocks.
+        """
+        super().__init__(env)
+        if observation_keys is None:
+            observation_keys = list(env.observation_space.keys())
+        for key in observation_keys:
+            if key not in env.observation_space.spaces:
+                raise ValueError("Unknown observation '%s'" % key)
+
+        self.savedir = os.path.abspath(savedir)
+        os.makedirs(self.savedir, exist_ok=True)
+        self.shard_size = shard_size
+        self._observation_keys = tuple(observation_keys)
+
+        self._desc = {
+            key: dict(
+                shape=env.observation_space[key].shape,
+                dtype=env.observation_space[key].dtype,
+            )
+            for key in self._observation_keys
+        }
+        self._desc.update(STEP_DESC)
+
+        self._shard_index = len(list_shards(self.savedir))
+        self._shard = None
+        self._row = 0
+        self._held = None  # A full shard and its length, see `_record`.
+        self._staged = False
+
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._writer = threading.Thread(target=self._write_loop, daemon=True)
+        self._writer.start()
+
+    def _write_loop(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                _write_shard(*item)
+            except Exception as e:  # Re-raised in the main thread.
+                logger.exception("Failed to write shard")
+                self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, shard, length):
+        if self._error is not None:
+            raise self._error
+        path = os.path.join(self.savedir, SHARD_PATTERN % self._shard_index)
+        self._queue.put((path, shard, length))
+        self._shard_index += 1
+
+    def _release(self):
+        """Hands the held full shard, if any, to the writer thread."""
+        if self._held is not None:
+            self._write(*self._held)
+            self._held = None
+
+    def _flush(self):
+        """Hands the held and the current shard to the writer thread."""
+        self._release()
+        if self._shard is None or self._row == 0:
+            return
+        self._write(self._shard, self._row)
+        self._shard = None
+        self._row = 0
+
+    def _stage(self, observation):
+        """Copies `observation` into the next row of the current shard.
+
+        NLE reuses its observation arrays, so they need copying before the next
+        step. The row only counts as recorded once `_record` completes it.
+        """
+        if self._shard is None:
+            self._shard = _new_shard(self._desc, self.shard_size)
+        for key in self._observation_keys:
+            self._shard[key][self._row] = observation[key]
+        self._staged = True
+
+    def _record(self, action, reward, done):
+        self._release()
+        row = self._row
+        self._shard["actions"][row] = action
+        self._shard["rewards"][row] = reward
+        self._shard["done"][row] = done
+        self._row += 1
+        if self._row == self.shard_size:
+            # Held back until the next step or reset, which may mark its last
+            # row as done.
+            self._held = (self._shard, self._row)
+            self._shard = None
+            self._row = 0
+
+    def reset(self, **kwargs):
+        observation, info = self.env.reset(**kwargs)
+        # End the previous episode, in case it was abandoned.
+        if self._row > 0:
+            self._shard["done"][self._row - 1] = 1
+        elif self._held is not None:
+            shard, length = self._held
+            shard["done"][length - 1] = 1
+        self._release()
+        self._stage(observation)
+        return observation, info
+
+    def step(self, action):
+        if not self._staged:
+            raise RuntimeError("step called without reset()")
+        observation, reward, terminated, truncated, info = self.env.step(action)
+        self._record(action, reward, terminated or truncated)
+        self._stage(observation)
+        return observation, reward, terminated, truncated, info
+
+    def close(self):
+        """Writes the last (partial) shard and waits for the writer thread."""
+        if self._writer.is_alive():
+            self._flush()
+            self._queue.put(None)
+            self._writer.join()
+        if self._error is not None:
+            raise self._error
+        super().close()
+
+
+def list_shards(savedir):
+    """Returns the sorted paths of all completely written shards in `savedir`."""
+    if not os.path.isdir(savedir):
+        return []
+    return [
+        os.path.join(savedir, name)
+        for name in sorted(os.listdir(savedir))
+        if name.startswith("shard_") and not name.endswith(".tmp")
+    ]
+
+
+class ObservationShards:
+    """Reads shards written by `ObservationRecorder` as memory-mapped arrays."""
+
+    def __init__(self, savedir, keys=None):
+        """Opens all shards in `savedir`.
+
+        Args:
+            savedir (str): Directory the shards were written to.
+            keys (list or None): Keys to load (observation keys, "actions",
+                "rewards", "done"). If None, all recorded keys are loaded.
+        """
+        self.savedir = savedir
+        self.shards = []
+        for path in list_shards(savedir):
+            with open(os.path.join(path, META_FILENAME)) as f:
+                meta = json.load(f)
+            shard_keys = meta["keys"] if keys is None else keys
+            arrays = {
+                key: np.load(os.path.join(path, key + ".npy"), mmap_mode="r")
+                for key in shard_keys
+            }
+            # Only the first `length` rows of the last shard may be filled.
+            self.shards.append({key: a[: meta["length"]] for key, a in arrays.items()})
+
+    def __len__(self):
+        """Total number of recorded steps."""
+        return sum(len(next(iter(shard.values()))) for shard in self.shards)
+
+    def minibatches(self, batch_size):
+        """Yields dicts of consecutive `[batch_size, ...]` steps.
+
+        The arrays are slices of the memory-mapped shards, ie no data is copied.
+        Minibatches do not cross shard boundaries, so the last minibatch of each
+        shard may be shorter than `batch_size`.
+        """
+        for shard in self.shards:
+            length = len(next(iter(shard.values())))
+            for start in range(0, length, batch_size):
+                yield {k: a[start : start + batch_size] for k, a in shard.items()}
@@ -172,6 +172,7 @@ class Nethack:
         hackdir=HACKDIR,
         spawn_monsters=True,
         scoreprefix="",
+        buffer_scores=False,
     ):
         self._copy = copy
 
@@ -236,6 +237,7 @@ class Nethack:
                 scoreprefix,
             )
         self._ttyrec = ttyrec
+        self._pynethack.set_buffer_scores(buffer_scores)
 
         self._finalizer.detach()
         self._finalizer = weakref.finalize(
@@ -329,6 +331,27 @@ class Nethack:
     def how_done(self):
         return self._pynethack.how_done()
 
+    def logfile_entry(self):
+        """Returns the logfile entry of the game that just ended, or "".
+
+        Only set if constructed with `buffer_scores=True`, in which case
+        NetHack doesn't write its logfile, xlogfile and record files. The entry
+        is available until the next reset.
+        """
+        return self._pynethack.logfile_entry().decode("latin-1")
+
+    def xlogfile_entry(self):
+        """Returns the xlogfile entry of the game that just ended as a dict.
+
+        The dict maps the xlogfile fields (eg "points", "death", "turns") to
+        their string values, in the order NetHack writes them. It is empty
+        unless the game has ended. See also `logfile_entry`.
+        """
+        line = self._pynethack.xlogfile_entry().decode("latin-1").rstrip("\n")
+        if not line:
+            return {}
+        return dict(field.split("=", 1) for field in line.split("\t"))
+
     def setup_tiles(self, tile_paths=None):
         if tile_paths is None:
             tile_paths = [
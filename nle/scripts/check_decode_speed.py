@@ -0,0 +1,65 @@
+# Copyright (c) Facebook, Inc. and its affiliates.
+"""Times converting the largest ttyrecs of a dataset with parallel bz2 decoding.
+
+Usage: `python -m nle.scripts.check_decode_speed data1 --threads 1 2 4`.
+"""
+
+import argparse
+import os
+import time
+
+import nle.dataset as nld
+from nle.dataset import resim
+from nle.dataset import stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("dataset_name", help="Name of the dataset.")
+    parser.add_argument("--db", default=nld.db.DB, help="Path to the database.")
+    parser.add_argument(
+        "--num_files", type=int, default=5, help="Number of ttyrecs to read."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        nargs="+",
+        default=[1, 2, 4],
+        help="Numbers of decode threads to compare.",
+    )
+    parser.add_argument(
+        "--scan",
+        action="store_true",
+        help="Only scan the ttyrecs, without emulating the terminal.",
+    )
+    flags = parser.parse_args()
+
+    with nld.db.db(filename=flags.db) as conn:
+        root = nld.db.get_root(flags.dataset_name, conn)
+        ttyrec_version = nld.db.get_ttyrec_version(flags.dataset_name, conn)
+        files = conn.execute(
+            """SELECT ttyrecs.path, ttyrecs.size FROM ttyrecs
+            INNER JOIN datasets ON ttyrecs.gameid=datasets.gameid
+            WHERE datasets.dataset_name=?
+            ORDER BY ttyrecs.size DESC LIMIT ?""",
+            (flags.dataset_name, flags.num_files),
+        ).fetchall()
+
+    read = stats.scan_ttyrec if flags.scan else resim.read_ttyrec
+    for path, size in files:
+        path = os.path.join(root, path)
+        print("%s (%.1f MB)" % (path, size / 2**20))
+        baseline = None
+        for threads in flags.threads:
+            start = time.perf_counter()
+            frames = read([path], ttyrec_version, decode_threads=threads)
+            elapsed = time.perf_counter() - start
+            baseline = baseline or elapsed
+            print(
+                "  %2i threads: %i frames in %.2fs (%.2fx)"
+                % (threads, len(frames["timestamps"]), elapsed, baseline / elapsed)
+            )
+
+
+if __name__ == "__main__":
+    main()
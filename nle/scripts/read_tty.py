@@ -9,6 +9,10 @@ import struct
 import subprocess
 import sys
 
+import numpy as np
+
+from nle.scripts import ttyplay
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-1",
@@ -38,50 +42,6 @@ parser.add_argument(
 )
 
 
-def ttyframes(f, tty2=True):
-    while True:
-        if tty2:
-            header = f.read(13)
-        else:
-            header = f.read(12)
-
-        if not isinstance(header, bytes):
-            raise IOError("File must be opened in binary mode.")
-
-        if not header:
-            return
-
-        if tty2:
-            sec, usec, length, channel = struct.unpack("<iiiB", header)
-        else:
-            sec, usec, length = struct.unpack("<iii", header)
-            channel = 0
-
-        if sec < 0 or usec < 0 or length < 0 or channel not in (0, 1, 2):
-            raise IOError("Illegal header %s in %s" % ((sec, usec, length, channel), f))
-        timestamp = sec + usec * 1e-6
-
-        data = f.read(length)
-
-        yield timestamp, channel, data
-
-
-def getfile(filename):
-    if filename == "-":
-        f = os.fdopen(os.dup(0), "rb")
-        os.dup2(1, 0)
-        return f
-    if os.path.splitext(filename)[1] in (".bz2", ".bzip2"):
-        import bz2
-
-        return bz2.BZ2File(filename)
-    if os.path.splitext(filename)[1] in (".gz", ".gzip"):
-        import gzip
-
-        return gzip.GzipFile(filename)
-    return open(filename, "rb")
-
-
 def color(s, value):
     return "\033[%d;3%dm%s\033[0m" % (bool(value & 8), value & ~8, s)
 
@@ -164,13 +124,20 @@ def main():
         setup_pager()
 
     frames = [0, 0, 0]
-    with getfile(FLAGS.filename) as f:
-        for timestamp, channel, data in ttyframes(f, tty2=not FLAGS.no_input):
+    with ttyplay.open_reader(FLAGS.filename, FLAGS.no_input) as reader:
+        if FLAGS.start > 1:
+            outputs = np.flatnonzero(reader.channels == 0)
+            if FLAGS.start <= len(outputs):
+                record = int(outputs[FLAGS.start - 1])
+            else:
+                record = reader.num_records()
+            reader.seek(record)
+            frames = ttyplay.frame_counts(reader, record)
+
+        for timestamp, channel, data in reader:
+            timestamp *= 1e-6
             frames[channel] += 1
 
-            if frames[0] < FLAGS.start:
-                continue
-
             if frames[0] > FLAGS.end:
                 return
 
@@ -2,15 +2,19 @@
 #
 # Copyright (c) Facebook, Inc. and its affiliates.
 import argparse
-import bz2
+import contextlib
 import gzip
 import os
-import re
 import select
-import struct
+import shutil
+import tempfile
 import termios
 import time
 
+import numpy as np
+
+from nle import _pyconverter as converter
+
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "-1",
@@ -40,7 +44,12 @@ parser.add_argument(
 parser.add_argument(
     "filename", default="", type=str, nargs="?", help="tty record file, or - for stdin"
 )
-parser.add_argument("--start", default=0, type=int, help="Start at a specific frame")
+parser.add_argument(
+    "--start",
+    default=0,
+    type=int,
+    help="Start at a specific frame, rendering from the last screen clear before it",
+)
 parser.add_argument(
     "--end", default=float("inf"), type=int, help="Quit after a specific frame count"
 )
@@ -83,93 +92,97 @@ def wait(diff, speed, drift=0.0):
     return speed, drift, jump
 
 
-def read_header(f, peek=False, no_input=False):
-    while True:
-        if no_input:
-            header = f.read(12)
-        else:
-            header = f.read(13)
+@contextlib.contextmanager
+def open_reader(filename, no_input=False):
+    """Opens a ttyrec file, or - for stdin, as a `TtyrecReader`.
 
-        if not header:
-            if peek:
-                # Never return, just wait for more data.
-                time.sleep(0.25)
-                continue
-            return
-
-        if no_input:
-            sec, usec, length = struct.unpack("<iii", header)
-            channel = 0
-        else:
-            sec, usec, length, channel = struct.unpack("<iiiB", header)
-
-        if sec < 0 or usec < 0 or length < 1 or channel not in (0, 1):
-            raise IOError("Illegal header %s" % ((sec, usec, length, channel),))
-        timestamp = sec + usec * 1e-6
-        yield timestamp, length, channel
+    The reader handles plain and bzip2-compressed files. Other inputs are
+    copied to a temporary file first, as the reader needs to seek in them.
+    """
+    ttyrec_version = 1 if no_input else 2
+    if filename == "-":
+        src = os.fdopen(os.dup(0), "rb")
+        os.dup2(1, 0)
+    elif os.path.splitext(filename)[1] in (".gz", ".gzip"):
+        src = gzip.GzipFile(filename)
+    else:
+        yield converter.TtyrecReader(filename, ttyrec_version)
+        return
+    with src, tempfile.NamedTemporaryFile(suffix=".ttyrec") as tmp:
+        shutil.copyfileobj(src, tmp)
+        tmp.flush()
+        yield converter.TtyrecReader(tmp.name, ttyrec_version, index_cache=False)
 
 
-CLRCODE = re.compile(rb"\033\[2?J")  # https://stackoverflow.com/a/37778152/1136208
 INPUTS = ["Input %s (%i)" % (repr(chr(i)), i) for i in range(255)]
 
 
-def process(f):
-    speed = FLAGS.speed
-    drift = 0.0
-    prev = None
-    jump = 0
+def frame_counts(reader, record):
+    """Number of records per channel before `record`."""
+    return np.bincount(reader.channels[:record], minlength=3).tolist()
 
-    # Store the header positions, timestamps, and frame numbers before
-    # clear screen commands.
-    clrscreen = []
 
-    lastpos = 0
-    frame = [0, 0]  # Input and output frame.
-    for timestamp, length, channel in read_header(
-        f, peek=FLAGS.peek, no_input=FLAGS.no_input
-    ):
-        data = f.read(length)
-        frame[channel] += 1
+def jump_target(reader, jump):
+    """Returns the record of the next or previous key frame (screen clear)."""
+    record = reader.tell()
+    keyframes = np.flatnonzero(reader.keyframes)
+    if jump > 0:
+        after = keyframes[keyframes >= record]
+        return int(after[0]) if len(after) else reader.num_records()
 
-        # Wait for delta between frame timestamps, unless we are jumping
-        # ahead or we are at the start. Also don't wait when we want to
-        # skip some frames via --start. Note that we still render them.
-        # We could also only start rendering from the last CLRSCREEN
-        # before FLAGS.start, which would be potentially faster.
-        if jump == 0 and prev is not None and frame[0] >= FLAGS.start:
-            speed, drift, jump = wait(timestamp - prev, speed, drift)
+    # If we can jump, jump at least some amount.
+    timestamps = reader.timestamps
+    before = keyframes[timestamps[keyframes] < timestamps[record - 1] - 5000]
+    return int(before[-1]) if len(before) else 0
 
-        if channel == 0 and CLRCODE.search(data):
-            clrscreen.append((lastpos, prev, [frame[0] - 1, frame[1]]))
-            if jump > 0:
-                jump = 0
 
-        lastpos = f.seek(0, os.SEEK_CUR)
-        prev = timestamp
+def seek(reader, record):
+    """Seeks to `record` and draws the screen at that point."""
+    reader.seek(record)
+    os.write(1, reader.render_ansi())
+    return frame_counts(reader, record)
 
-        if jump > 0:
-            continue
-        if jump < 0:
-            jump = 0
 
-            if not clrscreen:
-                clrscreen.append((0, None, [0, 0]))
+def process(reader):
+    speed = FLAGS.speed
+    drift = 0.0
+    prev = None
 
-            while clrscreen and timestamp - prev <= 0.005:
-                # If we can jump, jump at least some amount.
-                lastpos, prev, frame = clrscreen.pop()
+    frame = [0, 0, 0]  # Output, input and score frames.
+    if FLAGS.start > 1:
+        # Render up to the frame before FLAGS.start, starting from the last
+        # screen clear.
+        outputs = np.flatnonzero(reader.channels == 0)
+        if FLAGS.start <= len(outputs):
+            frame = seek(reader, int(outputs[FLAGS.start - 1]))
+        else:
+            frame = seek(reader, reader.num_records())
 
-            if lastpos:
-                prev = timestamp  # Don't wait in next iteration
+    while True:
+        record = reader.read()
+        if record is None:
+            if FLAGS.peek:
+                # Never return, just wait for more data.
+                time.sleep(0.25)
+                continue
+            return
+        timestamp, channel, data = record
+        timestamp *= 1e-6
+        frame[channel] += 1
 
-            f.seek(lastpos, os.SEEK_SET)
-            continue
+        if prev is not None:
+            speed, drift, jump = wait(timestamp - prev, speed, drift)
+            if jump:
+                frame = seek(reader, jump_target(reader, jump))
+                prev = None  # Don't wait in next iteration
+                continue
+        prev = timestamp
 
         if channel == 0:  # Output.
             os.write(1, data)
         elif channel == 1 and FLAGS.print_inputs:  # Input.
             os.write(
-                1, b"\033[s\033[26;0f\033[37;1mFrame %d+%d:\033[0m " % tuple(frame)
+                1, b"\033[s\033[26;0f\033[37;1mFrame %d+%d:\033[0m " % tuple(frame[:2])
             )  # Save Cursor & Jump to L26
             os.write(1, INPUTS[ord(data)].encode("ascii", "backslashreplace"))
             os.write(1, b" " * 32)
@@ -187,34 +200,25 @@ def main():
         parser.print_help()
         return
 
-    if FLAGS.filename == "-":
-        f = os.fdopen(os.dup(0), "rb")
-        os.dup2(1, 0)
-    elif os.path.splitext(FLAGS.filename)[1] in (".bz2", ".bzip2"):
-        f = bz2.BZ2File(FLAGS.filename)
-    elif os.path.splitext(FLAGS.filename)[1] in (".gz", ".gzip"):
-        f = gzip.GzipFile(FLAGS.filename)
-    else:
-        f = open(FLAGS.filename, "rb")
-
-    old = termios.tcgetattr(0)
-    new = termios.tcgetattr(0)
-
-    # Set to unbuffered, no echo.
-    new[3] &= ~(termios.ICANON | termios.ECHO | termios.ECHONL)  # lflags
-    termios.tcsetattr(0, termios.TCSANOW, new)
-    try:
-        if FLAGS.peek:
-            # Skip all previous data.
-            for _, length, _ in read_header(f, peek=False):
-                f.seek(length, os.SEEK_CUR)
-            FLAGS.no_wait = True
-        process(f)
-    except KeyboardInterrupt:
-        pass
-    finally:
-        termios.tcsetattr(0, termios.TCSANOW, old)
-        f.close()
+    with open_reader(FLAGS.filename, FLAGS.no_input) as reader:
+        old = termios.tcgetattr(0)
+        new = termios.tcgetattr(0)
+
+        # Set to unbuffered, no echo.
+        new[3] &= ~(termios.ICANON | termios.ECHO | termios.ECHONL)  # lflags
+        termios.tcsetattr(0, termios.TCSANOW, new)
+        try:
+            if FLAGS.peek:
+                # Skip all previous data, showing only the current screen.
+                for _ in reader:
+                    pass
+                os.write(1, reader.render_ansi())
+                FLAGS.no_wait = True
+            process(reader)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            termios.tcsetattr(0, termios.TCSANOW, old)
 
 
 if __name__ == "__main__":
@@ -1,12 +1,19 @@
 import bz2
+import gzip
 import os
 import re
+import struct
 
 import numpy as np
 import pytest
 from memory_profiler import memory_usage
 
+from nle import nethack
+from nle._pyconverter import BatchConverter
+from nle._pyconverter import parse_status
 from nle.dataset import Converter
+from nle.dataset import TtyrecReader
+from nle.dataset import sampling
 
 # From
 #   https://alt.org/nethack/trd/?file=https://s3.amazonaws.com/altorg/ttyrec/Anarchos/2020-10-03.17:27:10.ttyrec.bz2  # noqa: B950
@@ -401,6 +408,24 @@ class TestConverter:
         with open(getfilename(TTYREC_NLE_V2_ACTIONS)) as f:
             assert " ".join("%i" % a for a in actions) == f.readlines()[0]
 
+    def test_nle_v2_conversion_without_scores(self):
+        # Version 2 ttyrecs have no scores, so they needn't be passed.
+        seq_length = 150
+        COLUMNS = 120
+        converter = Converter(ROWS, COLUMNS, TTYREC_V2)
+
+        chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+        colors = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.int8)
+        cursors = np.zeros((seq_length, 2), dtype=np.int16)
+        actions = np.zeros((seq_length), dtype=np.uint8)
+        timestamps = np.zeros((seq_length,), dtype=np.int64)
+
+        converter.load_ttyrec(getfilename(TTYREC_NLE_V2))
+        assert converter.convert(chars, colors, cursors, timestamps, actions, None) == 0
+
+        with open(getfilename(TTYREC_NLE_V2_ACTIONS)) as f:
+            assert " ".join("%i" % a for a in actions) == f.readlines()[0]
+
     def test_nle_v3_conversion(self):
         seq_length = 70
         COLUMNS = 120
@@ -427,3 +452,798 @@ class TestConverter:
             lines = f.readlines()
             assert " ".join("%i" % a for a in actions) == lines[0].rstrip()
             assert " ".join("%i" % s for s in scores) == lines[1].rstrip()
+
+    def test_nle_v3_status(self):
+        seq_length = 70
+        COLUMNS = 120
+        converter = Converter(ROWS, COLUMNS, TTYREC_V3)
+
+        chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+        cursors = np.zeros((seq_length, 2), dtype=np.int16)
+        blstats = np.zeros((seq_length, nethack.NLE_BLSTATS_SIZE), dtype=np.int64)
+        message = np.zeros((seq_length, nethack.NLE_MESSAGE_SIZE), dtype=np.uint8)
+
+        converter.load_ttyrec(getfilename(TTYREC_NLE_V3))
+        remaining = converter.convert(
+            chars, None, cursors, None, None, None, blstats, message
+        )
+        assert remaining == 1
+        n = seq_length - remaining
+
+        assert message[0].tobytes().rstrip(b"\0") == (
+            b"Hello Agent, welcome to NetHack!  You are a chaotic female human Rogue."
+        )
+        # Frame 44 has "--More--" after the message, with the cursor on it.
+        assert message[43].tobytes().rstrip(b"\0") == (
+            b"$ - 4 gold pieces.  There's some graffiti on the floor here."
+        )
+        expected = {
+            nethack.NLE_BL_STR25: 14,
+            nethack.NLE_BL_STR125: 14,
+            nethack.NLE_BL_DEX: 18,
+            nethack.NLE_BL_CON: 18,
+            nethack.NLE_BL_INT: 10,
+            nethack.NLE_BL_WIS: 8,
+            nethack.NLE_BL_CHA: 7,
+            nethack.NLE_BL_SCORE: 24,
+            nethack.NLE_BL_HP: 12,
+            nethack.NLE_BL_HPMAX: 12,
+            nethack.NLE_BL_DEPTH: 1,
+            nethack.NLE_BL_GOLD: 4,
+            nethack.NLE_BL_ENE: 2,
+            nethack.NLE_BL_ENEMAX: 2,
+            nethack.NLE_BL_AC: 7,
+            nethack.NLE_BL_XP: 1,
+            nethack.NLE_BL_EXP: 5,
+            nethack.NLE_BL_TIME: 54,
+            nethack.NLE_BL_HUNGER: 1,
+            nethack.NLE_BL_ALIGN: -1,
+        }
+        for index, value in expected.items():
+            assert blstats[43, index] == value
+        # The position is carried forward from the last frame with the cursor
+        # on the hero.
+        previous = 42
+        while tuple(cursors[previous]) == (0, 68):
+            previous -= 1
+        row, col = cursors[previous]
+        assert chars[previous, row, col] == ord("@")
+        assert blstats[43, nethack.NLE_BL_X] == col
+        assert blstats[43, nethack.NLE_BL_Y] == row - 1
+
+        # Parsing converted frames gives the same.
+        parsed_blstats = np.zeros_like(blstats[:n])
+        parsed_message = np.zeros_like(message[:n])
+        parse_status(chars[:n], cursors[:n], parsed_blstats, parsed_message)
+        np.testing.assert_array_equal(parsed_blstats, blstats[:n])
+        np.testing.assert_array_equal(parsed_message, message[:n])
+
+    def test_parse_status(self):
+        def frame(top, line1, line2, cursor=(0, 0), hero=None):
+            chars = np.full((ROWS, COLUMNS), ord(" "), dtype=np.uint8)
+            for row, text in ((0, top), (22, line1), (23, line2)):
+                chars[row, : len(text)] = np.frombuffer(text.encode(), np.uint8)
+            if hero is not None:
+                chars[cursor] = ord(hero)
+            return chars, cursor
+
+        line1 = "Agent the Stripling  St:18/** Dx:14 Co:17 In:7 Wi:9 Ch:8 Lawful"
+        frames = [
+            frame(
+                "You hear a door open.--More--",
+                line1,
+                "Dlvl:3 $:52 HP:5(20) Pw:1(3) AC:4 Xp:4/40 T:812 Weak Burdened "
+                "Blind Conf",
+                cursor=(10, 33),
+                hero="@",
+            ),
+            # A menu hides the status lines, and the cursor isn't on the hero.
+            frame("                    Pick an object", "", "", cursor=(5, 30)),
+            frame(
+                "",
+                line1.replace("18/**", "18/50"),
+                "Dlvl:3 *:3 HP:6(20) Pw:1(3) AC:4 HD:2 T:813 Satiated Ovld Hl",
+                cursor=(11, 34),
+                hero="d",
+            ),
+        ]
+        chars = np.stack([chars for chars, _ in frames])
+        cursors = np.array([cursor for _, cursor in frames], dtype=np.int16)
+        blstats = np.zeros((3, nethack.NLE_BLSTATS_SIZE), dtype=np.int64)
+        message = np.zeros((3, nethack.NLE_MESSAGE_SIZE), dtype=np.uint8)
+        parse_status(chars, cursors, blstats, message)
+
+        messages = [m.tobytes().rstrip(b"\0") for m in message]
+        assert messages == [b"You hear a door open.", b"", b""]
+
+        first = blstats[0]
+        assert (first[nethack.NLE_BL_X], first[nethack.NLE_BL_Y]) == (33, 9)
+        assert first[nethack.NLE_BL_STR125] == 118  # 18/100
+        assert first[nethack.NLE_BL_STR25] == 21
+        assert first[nethack.NLE_BL_ALIGN] == 1
+        assert first[nethack.NLE_BL_GOLD] == 52
+        assert first[nethack.NLE_BL_HUNGER] == 3  # Weak
+        assert first[nethack.NLE_BL_CAP] == 1  # Burdened
+        assert first[nethack.NLE_BL_CONDITION] == 0x20 | 0x100  # Blind, Conf
+        assert first[nethack.NLE_BL_TIME] == 812
+        np.testing.assert_array_equal(blstats[1], first)
+
+        third = blstats[2]
+        assert (third[nethack.NLE_BL_X], third[nethack.NLE_BL_Y]) == (34, 10)
+        assert third[nethack.NLE_BL_STR125] == 68
+        assert third[nethack.NLE_BL_STR25] == 20
+        assert third[nethack.NLE_BL_GOLD] == 3
+        assert third[nethack.NLE_BL_HD] == 2
+        assert third[nethack.NLE_BL_HUNGER] == 0  # Satiated
+        assert third[nethack.NLE_BL_CAP] == 5  # Overloaded, abbreviated
+        assert third[nethack.NLE_BL_CONDITION] == 0x200  # Hallu
+
+        # Without the previous frame, fields not shown are 0.
+        parse_status(chars[1:], cursors[1:], blstats[1:])
+        np.testing.assert_equal(blstats[1], 0)
+        parse_status(chars[1:], cursors[1:], blstats[1:], previous=first)
+        np.testing.assert_array_equal(blstats[1], first)
+
+    def test_status_indices(self):
+        from nle import _pyconverter
+
+        assert _pyconverter.BLSTATS_SIZE == nethack.NLE_BLSTATS_SIZE
+        assert _pyconverter.MESSAGE_SIZE == nethack.NLE_MESSAGE_SIZE
+        assert nethack.OBSERVATION_DESC["blstats"]["shape"] == (
+            _pyconverter.BLSTATS_SIZE,
+        )
+        assert nethack.OBSERVATION_DESC["message"]["shape"] == (
+            _pyconverter.MESSAGE_SIZE,
+        )
+
+    def test_nle_v3_sparse_scores(self, tmpdir):
+        # Version 3 ttyrecs only write the score (channel 2) when it changes.
+        # The converter carries the last score forward to every action.
+        def record(channel, data):
+            return struct.pack("<iiiB", 0, 0, len(data), channel) + data
+
+        records = [record(0, b"Hello"), record(2, struct.pack("<i", 5))]
+        for i, score in enumerate([None, None, 7, None, 9, None]):
+            if score is not None:
+                records.append(record(2, struct.pack("<i", score)))
+            records.append(record(1, bytes([ord("a") + i])))
+            records.append(record(0, b"."))
+
+        ttyrec = str(tmpdir.join("sparse.ttyrec3.bz2"))
+        with bz2.BZ2File(ttyrec, "wb") as f:
+            f.write(b"".join(records))
+
+        seq_length = 8
+        converter = Converter(ROWS, COLUMNS, TTYREC_V3)
+        chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+        colors = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.int8)
+        cursors = np.zeros((seq_length, 2), dtype=np.int16)
+        actions = np.zeros((seq_length), dtype=np.uint8)
+        timestamps = np.zeros((seq_length,), dtype=np.int64)
+        scores = np.zeros((seq_length), dtype=np.int32)
+
+        converter.load_ttyrec(ttyrec)
+        remaining = converter.convert(
+            chars, colors, cursors, timestamps, actions, scores
+        )
+        assert remaining == 2
+        np.testing.assert_array_equal(scores[:6], [5, 5, 7, 7, 9, 9])
+        assert actions[:6].tobytes() == b"abcdef"
+
+    @pytest.mark.parametrize("version", [TTYREC_V1, TTYREC_V3])
+    def test_long_lines(self, tmpdir, version):
+        # Lines longer than the terminal wrap, except in version 1 ttyrecs,
+        # which keep overwriting the last column. Both scroll at the bottom.
+        def frame(data):
+            if version == TTYREC_V1:
+                return struct.pack("<iii", 0, 0, len(data)) + data
+            # Output, then an action to write the frame.
+            return (
+                struct.pack("<iiiB", 0, 0, len(data), 0)
+                + data
+                + struct.pack("<iiiB", 0, 0, 1, 1)
+                + b"a"
+            )
+
+        lines = [b"%02i" % i + b"abcdefghij" * 9 for i in range(30)]
+        ttyrec = str(tmpdir.join("long.ttyrec.bz2"))
+        with bz2.BZ2File(ttyrec, "wb") as f:
+            f.write(frame(lines[0] + b"\r\n!"))
+            f.write(frame(b"\r\n".join(lines[1:])))
+            f.write(frame(b"."))  # The last record isn't converted.
+
+        converter = Converter(ROWS, COLUMNS, version)
+        chars = np.zeros((2, ROWS, COLUMNS), dtype=np.uint8)
+        cursors = np.zeros((2, 2), dtype=np.int16)
+        converter.load_ttyrec(ttyrec)
+        converter.convert(chars, None, cursors, None, None, None)
+        screens = [[row.tobytes().rstrip() for row in screen] for screen in chars]
+
+        if version == TTYREC_V1:
+            assert screens[0][:3] == [lines[0][:COLUMNS], b"!", b""]
+            assert screens[1] == [line[:COLUMNS] for line in lines[5:]]
+            assert tuple(cursors[0]) == (1, 1)
+            assert tuple(cursors[1]) == (ROWS - 1, COLUMNS)
+        else:
+            assert screens[0][:4] == [lines[0][:COLUMNS], lines[0][COLUMNS:], b"!", b""]
+            wrapped = [
+                part for line in lines for part in (line[:COLUMNS], line[COLUMNS:])
+            ]
+            assert screens[1] == wrapped[-ROWS:]
+            assert tuple(cursors[0]) == (2, 1)
+            assert tuple(cursors[1]) == (ROWS - 1, len(lines[-1]) - COLUMNS)
+
+    @pytest.mark.parametrize(
+        "ttyrec,version",
+        [
+            (TTYREC_2020, TTYREC_V1),
+            (TTYREC_NLE_V2, TTYREC_V2),
+            (TTYREC_NLE_V3, TTYREC_V3),
+        ],
+    )
+    def test_scan(self, ttyrec, version, seq_length=30):
+        def read(method, *arrays):
+            converter = Converter(ROWS, 120, version)
+            converter.load_ttyrec(getfilename(ttyrec))
+            frames = []
+            remaining = 0
+            while remaining == 0:
+                timestamps = np.zeros((seq_length,), dtype=np.int64)
+                actions = np.zeros((seq_length), dtype=np.uint8)
+                scores = np.zeros((seq_length), dtype=np.int32)
+                buffers = [a[:seq_length] for a in arrays]
+                remaining = getattr(converter, method)(
+                    *buffers, timestamps, actions, scores
+                )
+                frames.append(np.stack([timestamps, actions, scores], axis=1))
+                frames[-1] = frames[-1][: seq_length - remaining]
+            return np.concatenate(frames)
+
+        chars = np.zeros((seq_length, ROWS, 120), dtype=np.uint8)
+        colors = np.zeros((seq_length, ROWS, 120), dtype=np.int8)
+        cursors = np.zeros((seq_length, 2), dtype=np.int16)
+        expected = read("convert", chars, colors, cursors)
+        assert len(expected) > seq_length
+        np.testing.assert_array_equal(read("scan"), expected)
+
+    @pytest.mark.parametrize(
+        "ttyrec,version,cols",
+        [(TTYREC_2020, TTYREC_V1, COLUMNS), (TTYREC_NLE_V3, TTYREC_V3, 120)],
+    )
+    def test_window_and_mask(self, ttyrec, version, cols, seq_length=40):
+        def read(converter, rows, cols, skip=()):
+            converter.load_ttyrec(getfilename(ttyrec))
+            frames = []
+            remaining = 0
+            while remaining == 0:
+                arrays = dict(
+                    chars=np.zeros((seq_length, rows, cols), dtype=np.uint8),
+                    colors=np.zeros((seq_length, rows, cols), dtype=np.int8),
+                    cursors=np.zeros((seq_length, 2), dtype=np.int16),
+                    timestamps=np.zeros((seq_length,), dtype=np.int64),
+                    inputs=np.zeros((seq_length), dtype=np.uint8),
+                    scores=np.zeros((seq_length), dtype=np.int32),
+                )
+                for key in skip:
+                    arrays[key] = None
+                remaining = converter.convert(**arrays)
+                frames.append(
+                    {
+                        k: v[: seq_length - remaining]
+                        for k, v in arrays.items()
+                        if k not in skip
+                    }
+                )
+            return {k: np.concatenate([f[k] for f in frames]) for k in frames[0]}
+
+        full = read(Converter(ROWS, cols, version), ROWS, cols)
+        assert len(full["timestamps"]) > seq_length
+
+        # The map of NetHack's 24 x 80 screen.
+        window = read(
+            Converter(21, 79, version, ROWS, cols, row_offset=1, col_offset=0), 21, 79
+        )
+        np.testing.assert_array_equal(window["chars"], full["chars"][:, 1:22, :79])
+        np.testing.assert_array_equal(window["colors"], full["colors"][:, 1:22, :79])
+        for key in ("cursors", "timestamps", "inputs", "scores"):
+            np.testing.assert_array_equal(window[key], full[key])
+
+        converter = Converter(
+            3, 5, version, ROWS, cols, row_offset=ROWS - 3, col_offset=2
+        )
+        window = read(converter, 3, 5, skip=("colors", "cursors", "timestamps"))
+        assert list(window) == ["chars", "inputs", "scores"]
+        np.testing.assert_array_equal(window["chars"], full["chars"][:, -3:, 2:7])
+        np.testing.assert_array_equal(window["scores"], full["scores"])
+
+        window = read(Converter(ROWS, cols, version), ROWS, cols, skip=("chars",))
+        np.testing.assert_array_equal(window["colors"], full["colors"])
+
+        with pytest.raises(ValueError, match="Window invalid"):
+            Converter(21, 79, version, ROWS, cols, row_offset=ROWS - 20)
+        with pytest.raises(ValueError, match="Window invalid"):
+            Converter(ROWS, cols, version, col_offset=1)
+        converter = Converter(ROWS, cols, version)
+        converter.load_ttyrec(getfilename(ttyrec))
+        with pytest.raises(ValueError, match="At least one array required"):
+            converter.convert(None, None, None, None, None, None)
+
+    @pytest.mark.parametrize("truncate", [False, True])
+    def test_decode_threads(self, tmpdir, truncate, seq_length=64):
+        # Compressing with 100 kB blocks splits a few MB of output into many
+        # blocks, which are decompressed in parallel.
+        def record(channel, data):
+            return struct.pack("<iiiB", 0, 0, len(data), channel) + data
+
+        rng = np.random.RandomState(0)
+        letters = np.frombuffer(b"abcdefghijklmnopqrstuvwxyz .#@\n", dtype=np.uint8)
+        records = []
+        for i in range(2500):
+            text = letters[rng.randint(len(letters), size=2000)].tobytes()
+            records.append(record(0, b"\033[H" + text))
+            records.append(record(2, struct.pack("<i", i)))
+            records.append(record(1, bytes([i % 256])))
+        data = bz2.compress(b"".join(records), compresslevel=1)
+        assert len(data) > 2 << 20
+        if truncate:
+            data = data[: len(data) // 2]
+        ttyrec = str(tmpdir.join("large.ttyrec3.bz2"))
+        with open(ttyrec, "wb") as f:
+            f.write(data)
+
+        def read(decode_threads):
+            converter = Converter(
+                ROWS, COLUMNS, TTYREC_V3, decode_threads=decode_threads
+            )
+            converter.load_ttyrec(ttyrec)
+            frames = []
+            remaining = 0
+            while remaining == 0:
+                chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+                colors = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.int8)
+                cursors = np.zeros((seq_length, 2), dtype=np.int16)
+                timestamps = np.zeros((seq_length,), dtype=np.int64)
+                actions = np.zeros((seq_length), dtype=np.uint8)
+                scores = np.zeros((seq_length), dtype=np.int32)
+                try:
+                    remaining = converter.convert(
+                        chars, colors, cursors, timestamps, actions, scores
+                    )
+                except RuntimeError as e:
+                    frames.append(str(e))
+                    break
+                frames.append((chars, colors, cursors, actions, scores))
+            return frames
+
+        expected = read(1)
+        result = read(4)
+        assert len(result) == len(expected)
+        if not truncate:
+            assert len(expected) * seq_length > 2000
+        for mb, expected_mb in zip(result, expected):
+            if isinstance(expected_mb, str):
+                assert mb == expected_mb
+                continue
+            for array, expected_array in zip(mb, expected_mb):
+                np.testing.assert_array_equal(array, expected_array)
+
+    @pytest.mark.parametrize("compresslevel", [0, 6])
+    @pytest.mark.parametrize(
+        "ttyrec,version",
+        [
+            (TTYREC_2020, TTYREC_V1),
+            (TTYREC_NLE_V2, TTYREC_V2),
+            (TTYREC_NLE_V3, TTYREC_V3),
+        ],
+    )
+    def test_gzip(self, tmpdir, ttyrec, version, compresslevel, seq_length=50):
+        # gzip-compressed ttyrecs convert to the same frames, including
+        # dropping the last record.
+        gz = str(tmpdir.join("ttyrec.gz"))
+        with (
+            bz2.open(getfilename(ttyrec)) as f,
+            gzip.open(gz, "wb", compresslevel) as out,
+        ):
+            out.write(f.read())
+
+        def read(filename):
+            converter = Converter(ROWS, COLUMNS, version)
+            converter.load_ttyrec(filename)
+            frames = []
+            remaining = 0
+            while remaining == 0:
+                chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+                colors = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.int8)
+                cursors = np.zeros((seq_length, 2), dtype=np.int16)
+                timestamps = np.zeros((seq_length,), dtype=np.int64)
+                actions = np.zeros((seq_length), dtype=np.uint8)
+                scores = np.zeros((seq_length), dtype=np.int32)
+                remaining = converter.convert(
+                    chars, colors, cursors, timestamps, actions, scores
+                )
+                frames.append((chars, colors, cursors, timestamps, actions, scores))
+            return frames
+
+        expected = read(getfilename(ttyrec))
+        result = read(gz)
+        assert len(result) == len(expected)
+        for mb, expected_mb in zip(result, expected):
+            for array, expected_array in zip(mb, expected_mb):
+                np.testing.assert_array_equal(array, expected_array)
+
+        reader = TtyrecReader(gz, version, ROWS, COLUMNS, index_cache=False)
+        expected_reader = TtyrecReader(
+            getfilename(ttyrec), version, ROWS, COLUMNS, index_cache=False
+        )
+        np.testing.assert_array_equal(reader.channels, expected_reader.channels)
+        reader.seek(20)
+        expected_reader.seek(20)
+        for array, expected_array in zip(
+            read_screen(reader), read_screen(expected_reader)
+        ):
+            np.testing.assert_array_equal(array, expected_array)
+
+
+def read_screen(reader):
+    chars = np.zeros((reader.rows, reader.cols), dtype=np.uint8)
+    colors = np.zeros((reader.rows, reader.cols), dtype=np.int8)
+    cursor = np.zeros((2,), dtype=np.int16)
+    reader.screen(chars, colors, cursor)
+    return chars, colors, cursor
+
+
+class TestTtyrecReader:
+    def test_matches_converter(self, seq_length=500):
+        ttyrec = getfilename(TTYREC_2020)
+        converter = Converter(ROWS, COLUMNS, TTYREC_V1)
+        chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+        colors = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.int8)
+        cursors = np.zeros((seq_length, 2), dtype=np.int16)
+        timestamps = np.zeros((seq_length,), dtype=np.int64)
+        actions = np.zeros((seq_length), dtype=np.uint8)
+        scores = np.zeros((seq_length), dtype=np.int32)
+        converter.load_ttyrec(ttyrec)
+        converter.convert(chars, colors, cursors, timestamps, actions, scores)
+
+        reader = TtyrecReader(ttyrec, TTYREC_V1, ROWS, COLUMNS, index_cache=False)
+        for i in range(seq_length):
+            timestamp, channel, data = reader.read()
+            assert timestamp == timestamps[i]
+            assert channel == 0
+            assert len(data) > 0
+            screen = read_screen(reader)
+            np.testing.assert_array_equal(screen[0], chars[i])
+            np.testing.assert_array_equal(screen[1], colors[i])
+            np.testing.assert_array_equal(screen[2], cursors[i])
+        assert reader.tell() == seq_length
+
+    @pytest.mark.parametrize(
+        "ttyrec,version",
+        [
+            (TTYREC_2020, TTYREC_V1),
+            (TTYREC_DECGRAPHICS, TTYREC_V1),
+            (TTYREC_SHIFTIN, TTYREC_V1),
+            (TTYREC_NLE_V2, TTYREC_V2),
+            (TTYREC_NLE_V3, TTYREC_V3),
+        ],
+    )
+    def test_seek(self, ttyrec, version):
+        reader = TtyrecReader(getfilename(ttyrec), version, index_cache=False)
+        records = []
+        screens = []
+        for record in reader:
+            records.append(record)
+            screens.append(read_screen(reader))
+        assert reader.num_records() == len(records)
+        assert reader.read() is None
+
+        np.testing.assert_array_equal(reader.timestamps, [r[0] for r in records])
+        np.testing.assert_array_equal(reader.channels, [r[1] for r in records])
+        assert reader.keyframes.sum() > 0
+
+        rng = np.random.default_rng(0)
+        for record in list(rng.integers(1, len(records), 30)) + [len(records), 1]:
+            reader.seek(record)
+            assert reader.tell() == record
+            for actual, expected in zip(read_screen(reader), screens[record - 1]):
+                np.testing.assert_array_equal(actual, expected)
+            if record < len(records):
+                assert reader.read() == records[record]
+
+        reader.seek(0)
+        assert reader.read() == records[0]
+
+    def test_seek_step(self):
+        ttyrec = getfilename(TTYREC_NLE_V3)
+        seq_length = 70
+        converter = Converter(ROWS, COLUMNS, TTYREC_V3)
+        chars = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.uint8)
+        colors = np.zeros((seq_length, ROWS, COLUMNS), dtype=np.int8)
+        cursors = np.zeros((seq_length, 2), dtype=np.int16)
+        timestamps = np.zeros((seq_length,), dtype=np.int64)
+        actions = np.zeros((seq_length), dtype=np.uint8)
+        scores = np.zeros((seq_length), dtype=np.int32)
+        converter.load_ttyrec(ttyrec)
+        remaining = converter.convert(
+            chars, colors, cursors, timestamps, actions, scores
+        )
+        steps = seq_length - remaining
+
+        reader = TtyrecReader(ttyrec, TTYREC_V3, ROWS, COLUMNS, index_cache=False)
+        for step in [steps - 1, 10, 0, 44]:
+            reader.seek_step(step)
+            chars_, colors_, cursor_ = read_screen(reader)
+            np.testing.assert_array_equal(chars_, chars[step])
+            np.testing.assert_array_equal(colors_, colors[step])
+            np.testing.assert_array_equal(cursor_, cursors[step])
+            timestamp, channel, data = reader.read()
+            assert (timestamp, channel, data) == (
+                timestamps[step],
+                1,
+                actions[step : step + 1].tobytes(),
+            )
+
+        reader.seek_step(steps)
+        assert reader.read() is None
+
+    def test_seek_time(self):
+        reader = TtyrecReader(getfilename(TTYREC_2018), TTYREC_V1, index_cache=False)
+        timestamps = reader.timestamps
+        reader.seek_time(timestamps[100])
+        assert reader.tell() == np.searchsorted(timestamps, timestamps[100])
+        reader.seek_time(timestamps[100] + 1)
+        assert reader.tell() == np.searchsorted(timestamps, timestamps[100] + 1)
+        reader.seek_time(0)
+        assert reader.tell() == 0
+        reader.seek_time(timestamps[-1] + 1)
+        assert reader.tell() == reader.num_records()
+
+    def test_index_cache(self, tmpdir):
+        ttyrec = str(tmpdir.join(TTYREC_NLE_V2))
+        with open(getfilename(TTYREC_NLE_V2), "rb") as src, open(ttyrec, "wb") as f:
+            f.write(src.read())
+
+        reader = TtyrecReader(ttyrec, TTYREC_V2)
+        assert not os.path.exists(ttyrec + ".idx")
+        length = reader.num_records()
+        assert os.path.exists(ttyrec + ".idx")
+
+        # Only a valid index is read.
+        for version in (TTYREC_V1, TTYREC_V2):
+            reader = TtyrecReader(ttyrec, version)
+            assert (reader.num_records() == length) == (version == TTYREC_V2)
+            assert reader.read() is not None
+
+        reader.seek(length // 2)
+        screen = read_screen(reader)
+        reader = TtyrecReader(ttyrec, TTYREC_V2)
+        reader.seek(length // 2)
+        for actual, expected in zip(read_screen(reader), screen):
+            np.testing.assert_array_equal(actual, expected)
+
+    @pytest.mark.parametrize("zero_header", [False, True])
+    def test_count_frames(self, tmpdir, zero_header):
+        # The converter keeps the last record of ttyrecs ending in a zero-length
+        # header, but not of those ending at the end of the bzip2 stream.
+        ttyrec = str(tmpdir.join("game.ttyrec.bz2"))
+        with bz2.BZ2File(ttyrec, "wb") as f:
+            for i in range(5):
+                f.write(struct.pack("<iii", i, 0, 1) + b"abcde"[i : i + 1])
+            if zero_header:
+                f.write(struct.pack("<iii", 0, 0, 0))
+
+        converter = Converter(ROWS, COLUMNS, TTYREC_V1)
+        chars = np.zeros((10, ROWS, COLUMNS), dtype=np.uint8)
+        converter.load_ttyrec(ttyrec)
+        remaining = converter.convert(chars, None, None, None, None, None)
+        expected = 5 if zero_header else 4
+        assert chars.shape[0] - remaining == expected
+
+        for index_cache in (True, True, False):  # Writes, then reads the index.
+            reader = TtyrecReader(ttyrec, TTYREC_V1, index_cache=index_cache)
+            assert reader.zero_header == zero_header
+            assert sampling.count_frames(ttyrec, TTYREC_V1, index_cache) == expected
+
+    def test_uncompressed_peek(self, tmpdir):
+        with bz2.BZ2File(getfilename(TTYREC_NLE_V3)) as f:
+            data = f.read()
+        ttyrec = str(tmpdir.join("game.ttyrec3"))
+        with open(ttyrec, "wb") as f:
+            f.write(data[:1000])
+
+        expected = list(TtyrecReader(getfilename(TTYREC_NLE_V3), TTYREC_V3))
+        reader = TtyrecReader(ttyrec, TTYREC_V3, index_cache=False)
+        records = list(reader)
+        assert records == expected[: len(records)]
+
+        # Reading continues once the truncated record was written.
+        with open(ttyrec, "ab") as f:
+            f.write(data[1000:])
+        records.extend(reader)
+        assert records == expected
+
+    def test_render_ansi(self):
+        reader = TtyrecReader(getfilename(TTYREC_NLE_V3), TTYREC_V3, index_cache=False)
+        reader.seek(reader.num_records())
+        chars, _, cursor = read_screen(reader)
+        ansi = reader.render_ansi()
+        assert ansi.startswith(b"\033[0m\033[H\033[2J")
+        assert ansi.endswith(b"\033[%i;%iH" % (cursor[0] + 1, cursor[1] + 1))
+        text = re.sub(rb"\033\[[0-9;]*[mHJ]", b"", ansi)
+        assert text == chars.tobytes()
+
+    def test_noexist(self):
+        fn = "i_dont_exist.ttyrec.bz2"
+        with pytest.raises(FileNotFoundError, match=fn):
+            TtyrecReader(fn, TTYREC_V3)
+
+
+class TestBatchConverter:
+    def make_buffers(self, batch_size, seq_length):
+        return dict(
+            chars=np.zeros((batch_size, seq_length, ROWS, COLUMNS), dtype=np.uint8),
+            colors=np.zeros((batch_size, seq_length, ROWS, COLUMNS), dtype=np.int8),
+            cursors=np.zeros((batch_size, seq_length, 2), dtype=np.int16),
+            timestamps=np.zeros((batch_size, seq_length), dtype=np.int64),
+            inputs=np.zeros((batch_size, seq_length), dtype=np.uint8),
+            scores=np.zeros((batch_size, seq_length), dtype=np.int32),
+            resets=np.zeros((batch_size, seq_length), dtype=np.uint8),
+            gameids=np.zeros((batch_size, seq_length), dtype=np.int32),
+        )
+
+    def convert_all(self, ttyrecs, seq_length=10000):
+        """Converts `ttyrecs` one after the other with a single Converter."""
+        converter = Converter(ROWS, COLUMNS, TTYREC_V1)
+        games = []
+        for ttyrec in ttyrecs:
+            buffers = self.make_buffers(1, seq_length)
+            del buffers["resets"], buffers["gameids"]
+            buffers = {k: v[0] for k, v in buffers.items()}
+            converter.load_ttyrec(getfilename(ttyrec))
+            remaining = converter.convert(**buffers)
+            games.append({k: v[: seq_length - remaining] for k, v in buffers.items()})
+        return {k: np.concatenate([g[k] for g in games]) for k in games[0]}
+
+    @pytest.mark.parametrize("num_threads", [1, 3])
+    def test_matches_converter(self, num_threads, seq_length=300):
+        lanes = [
+            [(1, 0, TTYREC_2020)],
+            [(2, 0, TTYREC_2018), (3, 0, TTYREC_2020)],
+            [(4, 0, TTYREC_2018), (4, 1, TTYREC_2018)],
+        ]
+        batch = BatchConverter(3, ROWS, COLUMNS, TTYREC_V1, num_threads=num_threads)
+        assert batch.num_threads == num_threads
+        expected = []
+        for lane, items in enumerate(lanes):
+            gameids, resets = [], []
+            for gameid, part, ttyrec in items:
+                batch.add_ttyrec(lane, gameid, part, getfilename(ttyrec))
+                length = len(self.convert_all([ttyrec])["timestamps"])
+                gameids += [gameid] * length
+                resets += [int(part == 0 and bool(resets))] + [0] * (length - 1)
+            game = self.convert_all([ttyrec for _, _, ttyrec in items])
+            game["gameids"] = np.array(gameids)
+            game["resets"] = np.array(resets)
+            expected.append(game)
+
+        buffers = self.make_buffers(3, seq_length)
+        for i in range(len(expected[1]["gameids"]) // seq_length + 2):
+            active = batch.convert(**buffers)
+            frames = slice(i * seq_length, (i + 1) * seq_length)
+            for lane, game in enumerate(expected):
+                for key, value in game.items():
+                    value = value[frames]
+                    if key == "resets" and len(value):
+                        value = np.concatenate([[0], value[1:]])
+                    np.testing.assert_array_equal(
+                        buffers[key][lane, : len(value)], value, err_msg=key
+                    )
+                    np.testing.assert_equal(buffers[key][lane, len(value) :], 0)
+        assert active == 0
+
+    def test_window_and_mask(self, seq_length=300):
+        ttyrecs = [TTYREC_2020, TTYREC_2018, TTYREC_2020]
+        full = BatchConverter(3, ROWS, COLUMNS, TTYREC_V1)
+        window = BatchConverter(
+            3, 21, 79, TTYREC_V1, term_rows=ROWS, term_cols=COLUMNS, row_offset=1
+        )
+        for lane, ttyrec in enumerate(ttyrecs):
+            full.add_ttyrec(lane, lane + 1, 0, getfilename(ttyrec))
+            window.add_ttyrec(lane, lane + 1, 0, getfilename(ttyrec))
+
+        buffers = self.make_buffers(3, seq_length)
+        chars = np.zeros((3, seq_length, 21, 79), dtype=np.uint8)
+        resets = np.zeros((3, seq_length), dtype=np.uint8)
+        gameids = np.zeros((3, seq_length), dtype=np.int32)
+        while True:
+            active = full.convert(**buffers)
+            chars[:] = 1  # Padding is written, too.
+            assert (
+                window.convert(chars, None, None, None, None, None, resets, gameids)
+                == active
+            )
+            np.testing.assert_array_equal(chars, buffers["chars"][:, :, 1:22, :79])
+            np.testing.assert_array_equal(resets, buffers["resets"])
+            np.testing.assert_array_equal(gameids, buffers["gameids"])
+            if not active:
+                break
+
+        with pytest.raises(ValueError, match="Window invalid"):
+            BatchConverter(3, 21, 79, TTYREC_V1, term_rows=21, row_offset=1)
+
+    def test_loop_forever(self, seq_length=200):
+        batch = BatchConverter(1, ROWS, COLUMNS, TTYREC_V1, loop_forever=True)
+        batch.add_ttyrec(0, 7, 0, getfilename(TTYREC_2018))
+        game = self.convert_all([TTYREC_2018])
+        length = len(game["timestamps"])
+
+        buffers = self.make_buffers(1, seq_length)
+        chars = []
+        for _ in range(3 * length // seq_length):
+            assert batch.convert(**buffers) == 1
+            chars.append(buffers["chars"][0].copy())
+            np.testing.assert_equal(buffers["gameids"], 7)
+        chars = np.concatenate(chars)
+        for i in range(len(chars) // length):
+            np.testing.assert_array_equal(
+                chars[i * length : (i + 1) * length], game["chars"]
+            )
+
+    def test_errors(self):
+        buffers = self.make_buffers(2, 10)
+        batch = BatchConverter(2, ROWS, COLUMNS, TTYREC_V1)
+        batch.add_ttyrec(0, 1, 0, getfilename(TTYREC_2018))
+        with pytest.raises(RuntimeError, match="Not enough ttyrecs"):
+            batch.convert(**buffers)
+
+        fn = "i_dont_exist.ttyrec.bz2"
+        batch = BatchConverter(2, ROWS, COLUMNS, TTYREC_V1)
+        batch.add_ttyrec(1, 2, 0, getfilename(TTYREC_2018))
+        batch.add_ttyrec(0, 1, 0, fn)
+        with pytest.raises(FileNotFoundError, match=fn):
+            batch.convert(**buffers)
+
+        batch = BatchConverter(2, ROWS, COLUMNS, TTYREC_V1)
+        with pytest.raises(ValueError, match="shape"):
+            batch.convert(**self.make_buffers(3, 10))
+
+    @pytest.mark.parametrize("num_threads", [1, 3])
+    @pytest.mark.parametrize("skip", [0, 1, 4, 9])
+    def test_restore(self, num_threads, skip, seq_length=300):
+        lanes = [
+            [(1, 0, TTYREC_2020)],
+            [(2, 0, TTYREC_2018), (3, 0, TTYREC_2020)],
+            [(4, 0, TTYREC_2018), (4, 1, TTYREC_2018)],
+        ]
+
+        def make_batch():
+            batch = BatchConverter(3, ROWS, COLUMNS, TTYREC_V1, num_threads=num_threads)
+            for lane, items in enumerate(lanes):
+                for gameid, part, ttyrec in items:
+                    batch.add_ttyrec(lane, gameid, part, getfilename(ttyrec))
+            return batch
+
+        batch = make_batch()
+        assert batch.state() == [(-1, 0, False)] * 3
+        buffers = self.make_buffers(3, seq_length)
+        expected = []
+        while True:
+            active = batch.convert(**buffers)
+            if len(expected) == skip:
+                state = batch.state()
+            expected.append({k: v.copy() for k, v in buffers.items()})
+            if not active:
+                break
+
+        batch = make_batch()
+        batch.restore(state)
+        assert batch.state() == state
+        for mb in expected[skip + 1 :]:
+            batch.convert(**buffers)
+            for key, value in mb.items():
+                np.testing.assert_array_equal(buffers[key], value, err_msg=key)
+        assert batch.state()[0] == (
+            0,
+            len(self.convert_all([TTYREC_2020])["timestamps"]),
+            True,
+        )
@@ -1,6 +1,10 @@
 import bz2
+import collections
 import concurrent.futures as futures
 import contextlib
+import itertools
+import os
+import sqlite3
 
 import numpy as np
 import pytest
@@ -10,10 +14,81 @@ from test_converter import FINALFRAMECOLORS
 from test_converter import TIMESTAMPS
 from test_converter import getfilename
 from test_db import conn  # noqa: F401
+from test_db import dbfilename  # noqa: F401
 from test_db import mockdata  # noqa: F401
 
 from nle.dataset import dataset
 from nle.dataset import db
+from nle.dataset import populate_db
+from nle.dataset import resim
+from nle.dataset import sampling
+
+
+def check_windows(data, minibatches):
+    """Checks that the minibatches of a `random_windows` dataset consist of
+    windows of `data.seq_length` consecutive frames of its games.
+
+    Returns the number of frames in the minibatches.
+    """
+    games = {
+        gameid: resim.read_ttyrec(
+            [os.path.join(data._rootpath, path) for path in data.get_paths(gameid)],
+            data._ttyrec_version,
+        )
+        for gameid in data._gameids
+    }
+    lanes = {
+        k: np.concatenate([mb[k] for mb in minibatches], axis=1) for k in minibatches[0]
+    }
+    num_frames = 0
+    for lane, gameids in enumerate(lanes["gameids"]):
+        end = np.count_nonzero(gameids)
+        assert not gameids[end:].any()  # Padding only at the end.
+        starts = np.flatnonzero(lanes["done"][lane, :end])
+        assert starts[0] == 0
+        for start, stop in zip(starts, list(starts[1:]) + [end]):
+            game = games[gameids[start]]
+            assert (gameids[start:stop] == gameids[start]).all()
+            length = min(data.seq_length, len(game["timestamps"]))
+            # Only the last window may be cut short, by the end of the epoch.
+            assert stop - start == length or (stop == end and stop - start < length)
+            candidates = np.flatnonzero(
+                game["timestamps"] == lanes["timestamps"][lane, start]
+            )
+            assert any(
+                all(
+                    np.array_equal(
+                        lanes[k][lane, start:stop], game[k][c : c + stop - start]
+                    )
+                    for k in game
+                    if k in lanes
+                )
+                for c in candidates
+            )
+        num_frames += end
+    return num_frames
+
+
+def parse_status(minibatches):
+    """Parses the `STATUS_KEYS` of the frames of `minibatches`, one game of a
+    lane after the other."""
+    lanes = {
+        k: np.concatenate([mb[k] for mb in minibatches], axis=1)
+        for k in ("tty_chars", "tty_cursor", "done", "gameids")
+    }
+    blstats = np.zeros(lanes["gameids"].shape + (27,), dtype=np.int64)
+    message = np.zeros(lanes["gameids"].shape + (256,), dtype=np.uint8)
+    for lane, gameids in enumerate(lanes["gameids"]):
+        end = np.count_nonzero(gameids)
+        starts = np.unique([0, *np.flatnonzero(lanes["done"][lane, :end])])
+        for start, stop in zip(starts, [*starts[1:], end]):
+            dataset.converter.parse_status(
+                lanes["tty_chars"][lane, start:stop],
+                lanes["tty_cursor"][lane, start:stop],
+                blstats[lane, start:stop],
+                message[lane, start:stop],
+            )
+    return blstats, message
 
 
 class TestDataset:
@@ -125,6 +200,172 @@ class TestDataset:
                 np.testing.assert_array_equal(c[0, :reset], m[:reset])
                 np.testing.assert_equal(c[0, reset:], 0)
 
+    def test_iter_ttyrecs(self, db_exists):
+        data = dataset.TtyrecDataset(
+            "basictest", seq_length=100, batch_size=2, loop_forever=True
+        )
+        for gameids in ([4], [7, 5, 1]):
+            expected = data.get_ttyrecs(gameids, chunk_size=13)
+            chunks = list(data.iter_ttyrecs(gameids, chunk_size=13))
+            assert len(chunks) == len(expected)
+            # The chunks share their arrays.
+            assert all(c["tty_chars"] is chunks[0]["tty_chars"] for c in chunks)
+            for chunk, expected_chunk in zip(data.iter_ttyrecs(gameids, 13), expected):
+                assert chunk.keys() == expected_chunk.keys()
+                for key in chunk:
+                    np.testing.assert_array_equal(chunk[key], expected_chunk[key])
+        assert len(list(data.iter_ttyrec(4))) == len(data.get_ttyrec(4))
+
+    def test_read_game(self, db_exists):
+        data = dataset.TtyrecDataset("basictest")
+        for gameid in (4, 7):  # Game 7 has three parts.
+            expected = data.get_game(gameid)
+            length = data.get_frame_count(gameid)
+            assert length == len(expected["timestamps"])
+
+            game = data.read_game(gameid)
+            assert game.keys() == expected.keys()
+            for key in game:
+                np.testing.assert_array_equal(game[key], expected[key])
+
+            out = {
+                k: np.full((length + 5,) + v.shape[1:], 7, v.dtype)
+                for k, v in game.items()
+            }
+            game = data.read_game(gameid, out)
+            for key in game:
+                assert np.shares_memory(game[key], out[key])
+                np.testing.assert_array_equal(game[key], expected[key])
+                np.testing.assert_equal(out[key][length:], 7)
+
+            small = {k: v[: length - 1] for k, v in out.items()}
+            with pytest.raises(ValueError, match="more than %i frames" % (length - 1)):
+                data.read_game(gameid, small)
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {},
+            dict(prefetch=2),
+            dict(random_windows=True),
+            dict(random_windows=True, cache=1 << 30),
+        ],
+    )
+    def test_crop_and_keys(self, db_exists, kwargs):
+        kwargs = dict(kwargs, batch_size=3, seq_length=50, shuffle=False)
+        crop = (1, 2, 21, 70)
+        keys = ("tty_chars", "tty_cursor")
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        cropped = dataset.TtyrecDataset("basictest", crop=crop, keys=keys, **kwargs)
+
+        def minibatches(data):
+            np.random.seed(0)  # For the same random windows.
+            result = []
+            for mb in data:
+                result.append({k: v.copy() for k, v in mb.items()})
+                if isinstance(mb, dataset.PrefetchedMinibatch):
+                    mb.release()
+            return result
+
+        expected = minibatches(data)
+        result = minibatches(cropped)
+        assert len(result) == len(expected) > 1
+        for mb, expected_mb in zip(result, expected):
+            assert list(mb) == ["tty_chars", "tty_cursor", "done", "gameids"]
+            np.testing.assert_array_equal(
+                mb["tty_chars"], expected_mb["tty_chars"][..., 1:22, 2:72]
+            )
+            for key in ("tty_cursor", "done", "gameids"):
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+
+        for gameids in ([4], [7, 5]):
+            expected = data.get_ttyrecs(gameids, chunk_size=13)
+            for chunks in (
+                cropped.get_ttyrecs(gameids, chunk_size=13),
+                [
+                    {k: v.copy() for k, v in chunk.items()}
+                    for chunk in cropped.iter_ttyrecs(gameids, chunk_size=13)
+                ],
+            ):
+                assert len(chunks) == len(expected)
+                for chunk, expected_chunk in zip(chunks, expected):
+                    assert chunk["tty_chars"].shape[2:] == (21, 70)
+                    np.testing.assert_array_equal(
+                        chunk["tty_chars"], expected_chunk["tty_chars"][..., 1:22, 2:72]
+                    )
+                    np.testing.assert_array_equal(
+                        chunk["tty_cursor"], expected_chunk["tty_cursor"]
+                    )
+        # Whole games are not cropped.
+        assert cropped.get_game(4)["tty_chars"].shape[1:] == (24, 80)
+
+        with pytest.raises(ValueError, match="not within 24 x 80"):
+            dataset.TtyrecDataset("basictest", crop=(1, 0, 24, 80))
+        with pytest.raises(ValueError, match="Unknown keys: done"):
+            dataset.TtyrecDataset("basictest", keys=("tty_chars", "done"))
+
+    @pytest.mark.parametrize(
+        "kwargs",
+        [
+            {},
+            dict(prefetch=2),
+            dict(random_windows=True),
+            dict(random_windows=True, cache=1 << 30),
+        ],
+    )
+    def test_status_keys(self, db_exists, kwargs):
+        kwargs = dict(kwargs, batch_size=3, seq_length=50, shuffle=False)
+        keys = ("tty_chars", "tty_cursor")
+        data = dataset.TtyrecDataset("basictest", keys=keys, **kwargs)
+        status = dataset.TtyrecDataset(
+            "basictest", crop=(1, 0, 21, 79), keys=dataset.STATUS_KEYS, **kwargs
+        )
+
+        def minibatches(data):
+            np.random.seed(0)  # For the same random windows.
+            result = []
+            for mb in data:
+                result.append({k: v.copy() for k, v in mb.items()})
+                if isinstance(mb, dataset.PrefetchedMinibatch):
+                    mb.release()
+            return result
+
+        expected = minibatches(data)
+        result = minibatches(status)
+        assert len(result) == len(expected) > 1
+        if kwargs.get("random_windows"):
+            # Windows are parsed one minibatch at a time.
+            parsed = [parse_status([mb]) for mb in expected]
+        else:
+            blstats, message = parse_status(expected)
+            parsed = [
+                (blstats[:, i : i + 50], message[:, i : i + 50])
+                for i in range(0, blstats.shape[1], 50)
+            ]
+        for mb, expected_mb, (blstats, message) in zip(result, expected, parsed):
+            assert list(mb) == ["done", "gameids", "blstats", "message"]
+            np.testing.assert_array_equal(mb["blstats"], blstats)
+            np.testing.assert_array_equal(mb["message"], message)
+            np.testing.assert_array_equal(mb["gameids"], expected_mb["gameids"])
+        hp = np.concatenate([mb["blstats"][..., 10] for mb in result])
+        assert (hp > 0).any()
+
+        for gameids in ([4], [7, 5]):
+            expected = data.get_ttyrecs(gameids, chunk_size=13)
+            blstats, message = parse_status(expected)
+            for chunks in (
+                status.get_ttyrecs(gameids, chunk_size=13),
+                [
+                    {k: v.copy() for k, v in chunk.items()}
+                    for chunk in status.iter_ttyrecs(gameids, chunk_size=13)
+                ],
+            ):
+                assert len(chunks) == len(expected)
+                for i, chunk in enumerate(chunks):
+                    frames = slice(i * 13, (i + 1) * 13)
+                    np.testing.assert_array_equal(chunk["blstats"], blstats[:, frames])
+                    np.testing.assert_array_equal(chunk["message"], message[:, frames])
+
     def test_char_frame(self, db_exists, pool):
         # gameids [1,2,3] are all the same tty_rec, rowid 4 is different
         gameids = [1, 2, 3, 4, 1, 2, 3, 4]
@@ -228,6 +469,44 @@ class TestDataset:
                 break
         assert done == 7 - batch_size
 
+    @pytest.mark.parametrize("loop_forever", [False, True])
+    def test_prefetch(self, db_exists, loop_forever):
+        kwargs = dict(
+            seq_length=200,
+            batch_size=3,
+            gameids=range(1, 8),
+            shuffle=False,
+            loop_forever=loop_forever,
+        )
+        expected = []
+        for mb in dataset.TtyrecDataset("basictest", **kwargs):
+            expected.append({k: v.copy() for k, v in mb.items()})
+            if len(expected) == 40:
+                break
+        assert len(expected) > 2
+
+        data = dataset.TtyrecDataset("basictest", prefetch=2, **kwargs)
+        held = None
+        for i, mb in enumerate(data):
+            assert isinstance(mb, dataset.PrefetchedMinibatch)
+            assert mb.keys() == expected[i].keys()
+            for k in mb:
+                np.testing.assert_array_equal(mb[k], expected[i][k])
+            if held is not None:
+                # Converting this minibatch did not overwrite the held one.
+                for k in held:
+                    np.testing.assert_array_equal(held[k], expected[i - 1][k])
+                held.release()
+                held = None
+            if i % 2 == 0:
+                held = mb  # Keep until after the next minibatch.
+            else:
+                with mb:
+                    pass
+            if i + 1 == len(expected):
+                break
+        assert i + 1 == len(expected)
+
     @pytest.mark.parametrize("batch_size", [1, 3, 6])
     def test_shuffle(self, db_exists, batch_size):
         data = dataset.TtyrecDataset(
@@ -300,6 +579,52 @@ class TestDataset:
             for k in mb1.keys():
                 np.testing.assert_array_equal(mb1[k], mb2[k])
 
+    def test_no_queries_when_iterating(self, dbfilename, monkeypatch):  # noqa: F811
+        data = dataset.TtyrecDataset(
+            "basictest",
+            dbfilename=dbfilename,
+            batch_size=3,
+            seq_length=500,
+            shuffle=False,
+        )
+        expected = [{k: v.copy() for k, v in mb.items()} for mb in data]
+
+        def fail(*args, **kwargs):
+            raise AssertionError("Database accessed")
+
+        # The dataset's games and paths are loaded up front, and the frame
+        # counts and frame store once.
+        monkeypatch.setattr(sqlite3, "connect", fail)
+        monkeypatch.setattr(db, "get_connection", fail)
+        for mb, expected_mb in zip(data, expected):
+            np.testing.assert_array_equal(mb["gameids"], expected_mb["gameids"])
+
+    def test_meta_arrays(self, db_exists):
+        data = dataset.TtyrecDataset("basictest", gameids=[7, 1, 5])
+        arrays = data.get_meta_arrays()
+        assert list(arrays) == ["gameid"] + data.get_meta_columns()[1:]
+        np.testing.assert_array_equal(arrays["gameid"], [7, 1, 5])
+        for i, gameid in enumerate(arrays["gameid"]):
+            meta = data.get_meta(gameid)
+            for column, values in arrays.items():
+                if meta[column] is None:
+                    assert values[i] in (-1, "")
+                else:
+                    assert values[i] == meta[column]
+        assert arrays["points"].dtype == np.int64
+        assert arrays["role"].dtype.kind == "U"
+
+        arrays = data.get_meta_arrays(["death", "turns"])
+        assert list(arrays) == ["gameid", "death", "turns"]
+        with pytest.raises(ValueError, match="Unknown columns: nope"):
+            data.get_meta_arrays(["turns", "nope"])
+
+        # Games without metadata.
+        data = dataset.TtyrecDataset("basictest", gameids=[1, 1000])
+        arrays = data.get_meta_arrays(["turns", "role"])
+        np.testing.assert_array_equal(arrays["turns"][1:], [-1])
+        np.testing.assert_array_equal(arrays["role"][1:], [""])
+
     def test_multipart_game(self, db_exists, pool):
         # This test selects a multipart game
 
@@ -365,3 +690,309 @@ class TestDataset:
             assert data1.get_meta(rowid)["death"] == "ascended"
             assert data1.get_meta(rowid)[2] == 999
             assert data1.get_meta(rowid)["points"] == 999
+
+    @pytest.mark.parametrize("num_threads", [1, 2])
+    @pytest.mark.parametrize(
+        "dataset_name,seq_length", [("basictest", 50), ("nletest", 4)]
+    )
+    def test_random_windows(self, db_exists, dataset_name, seq_length, num_threads):
+        data = dataset.TtyrecDataset(
+            dataset_name,
+            batch_size=4,
+            seq_length=seq_length,
+            random_windows=True,
+            num_threads=num_threads,
+        )
+        num_frames = sum(data.get_frame_counts().values())
+        mbs = [{k: v.copy() for k, v in mb.items()} for mb in data]
+        # Like for ttyrecs, lanes that end exactly with a minibatch are
+        # followed by one of padding.
+        assert len(mbs) == -(-num_frames // 4) // seq_length + 1
+        assert check_windows(data, mbs) == 4 * -(-num_frames // 4)
+
+    def test_random_windows_loop_forever(self, db_exists):
+        data = dataset.TtyrecDataset(
+            "basictest",
+            batch_size=3,
+            seq_length=40,
+            random_windows=True,
+            loop_forever=True,
+            prefetch=2,
+        )
+        mbs = []
+        for mb in data:
+            with mb:
+                mbs.append({k: v.copy() for k, v in mb.items()})
+            if len(mbs) == 200:
+                break
+        assert check_windows(data, mbs) == 3 * 40 * 200
+        assert set(np.unique([mb["gameids"] for mb in mbs])) <= set(range(1, 8))
+
+    def test_window_sampler(self):
+        sampler = sampling.WindowSampler({1: 10, 2: 3, 3: 0, 4: 5}, seq_length=5)
+        assert len(sampler) == 8
+        windows = collections.Counter(zip(*sampler.sample(8000)))
+        assert set(windows) == {(1, start, 5) for start in range(6)} | {
+            (2, 0, 3),
+            (4, 0, 5),
+        }
+        assert min(windows.values()) > 800  # 1000 expected.
+
+        with pytest.raises(ValueError, match="No frames"):
+            sampling.WindowSampler({1: 0}, seq_length=5)
+
+    def test_weighted_window_sampler(self):
+        sampler = sampling.WindowSampler(
+            {1: 10, 2: 3, 3: 0, 4: 5}, seq_length=5, weights={1: 1, 2: 6, 3: 5}
+        )
+        windows = collections.Counter(zip(*sampler.sample(12000)))
+        # Game 1's six windows have the same total weight as game 2's one.
+        assert set(windows) == {(1, start, 5) for start in range(6)} | {(2, 0, 3)}
+        assert 5500 < windows[(2, 0, 3)] < 6500
+        assert min(windows.values()) > 800  # 1000 expected.
+        gameid, start, length = sampler.sample()
+        assert gameid in (1, 2) and 0 <= start < 6 and length in (3, 5)
+
+    def test_alias_sampler(self):
+        weights = np.array([1, 0, 3, 6, 0.5])
+        sampler = sampling.AliasSampler(weights)
+        assert len(sampler) == 5
+        counts = np.bincount(sampler.sample(105000), minlength=5)
+        assert counts[1] == 0
+        np.testing.assert_allclose(counts / 105000, weights / 10.5, atol=0.01)
+
+        random_state = np.random.RandomState(3)
+        draws = sampler.sample(10, random_state)
+        np.testing.assert_array_equal(
+            draws, sampler.sample(10, np.random.RandomState(3))
+        )
+        assert 0 <= sampler.sample() < 5
+
+        for weights in ([0, 0], [1, -1], [1, np.nan], []):
+            with pytest.raises(ValueError):
+                sampling.AliasSampler(weights)
+
+    def test_stratify(self):
+        np.testing.assert_allclose(sampling.stratify(["a", "b", "a"]), [0.5, 1, 0.5])
+        np.testing.assert_allclose(
+            sampling.stratify([3, 3, 1, 2], [1, 3, 2, 0]), [0.25, 0.75, 1, 0]
+        )
+
+    def test_weights(self, db_exists):
+        def epoch_games(data):
+            gameids = np.concatenate([mb["gameids"].ravel() for mb in data])
+            return set(gameids[gameids != 0].tolist())
+
+        kwargs = dict(batch_size=2, seq_length=500, seed=5)
+        data = dataset.TtyrecDataset("basictest", weights={1: 1, 7: 3}, **kwargs)
+        assert epoch_games(data) <= {1, 7}
+        assert len(data.state_dict()) == 1  # Epoch done.
+        orders = [next(iter(data)) and data.state_dict()["gameids"] for _ in range(3)]
+        assert all(len(order) == 7 for order in orders)
+        assert all(set(order) <= {1, 7} for order in orders)
+
+        # Seeded draws only depend on the seed and the epoch.
+        data = dataset.TtyrecDataset("basictest", weights={1: 1, 7: 3}, **kwargs)
+        data.epoch = 1
+        next(iter(data))
+        assert data.state_dict()["gameids"] == orders[0]
+
+        data = dataset.TtyrecDataset(
+            "basictest",
+            weights_sql="SELECT gameid, 1 FROM games WHERE gameid IN (?, ?)",
+            weights_sql_args=(2, 3),
+            **kwargs,
+        )
+        assert epoch_games(data) <= {2, 3}
+
+        data = dataset.TtyrecDataset(
+            "basictest",
+            gameids=[3, 2, 1],
+            weights=[0, 1, 0],
+            random_windows=True,
+            **kwargs,
+        )
+        assert epoch_games(data) == {2}
+
+        with pytest.raises(ValueError, match="Expected 3 weights"):
+            dataset.TtyrecDataset("basictest", gameids=[3, 2, 1], weights=[1, 2])
+        with pytest.raises(ValueError, match="No positive weights"):
+            dataset.TtyrecDataset("basictest", weights={1000: 1})
+
+    def test_stratify_by(self, db_exists):
+        data = dataset.TtyrecDataset("basictest", stratify_by="name")
+        # Users "aaa" and "bbb" have three games, "ccc" has game 7.
+        assert data._weights[7] == 1
+        assert all(data._weights[gameid] == 1 / 3 for gameid in range(1, 7))
+
+        data = dataset.TtyrecDataset(
+            "basictest",
+            gameids=[1, 2, 4, 7],
+            weights=[1, 3, 0, 1],
+            stratify_by="name",
+        )
+        assert data._weights == {1: 0.25, 2: 0.75, 4: 0, 7: 1}
+
+    def test_balance_lanes(self):
+        counts = {1: 100, 2: 90, 3: 50, 4: 40, 5: 10}
+        lanes = dataset._balance_lanes([5, 4, 3, 2, 1], counts, batch_size=2)
+        assert lanes == [0, 0, 1, 1, 0]
+        assert dataset._balance_lanes([1, 2], counts, batch_size=3) == [0, 1]
+
+    def test_balanced_padding(self, dbfilename):  # noqa: F811
+        kwargs = dict(
+            dbfilename=dbfilename,
+            batch_size=3,
+            seq_length=100,
+            gameids=[1, 4, 5, 6, 7, 2, 3],
+            shuffle=False,
+        )
+        # Without frame counts, games are assigned to lanes round robin.
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        assert data.get_frame_counts(count_missing=False) == {}
+        assert len(list(data)) == 49  # Lane 0 reads games 1, 6 and 3.
+        assert 0.45 < data.padding_fraction < 0.5
+
+        populate_db.add_frame_counts("basictest", filename=dbfilename)
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        counts = data.get_frame_counts(count_missing=False)
+        frames = collections.Counter()
+        for mb in data:
+            frames.update(mb["gameids"][mb["gameids"] != 0].tolist())
+        assert frames == counts
+        assert data.padding_fraction == pytest.approx(
+            1 - sum(counts.values()) / (26 * 3 * 100)
+        )
+
+    @pytest.mark.parametrize("frame_counts", [False, True])
+    def test_sharding(self, dbfilename, frame_counts):  # noqa: F811
+        if frame_counts:
+            populate_db.add_frame_counts("basictest", filename=dbfilename)
+        kwargs = dict(dbfilename=dbfilename, batch_size=2, seq_length=500, seed=3)
+        full = dataset.TtyrecDataset("basictest", **kwargs)
+        counts = full.get_frame_counts()
+
+        shards = []
+        for rank in range(3):
+            data = dataset.TtyrecDataset("basictest", rank=rank, world_size=3, **kwargs)
+            assert sorted(data._games) == sorted(data._gameids)
+            data.populate_metadata()
+            assert sorted(data._meta) == sorted(data._gameids)
+            frames = collections.Counter()
+            for mb in data:
+                frames.update(mb["gameids"][mb["gameids"] != 0].tolist())
+            assert frames == {gameid: counts[gameid] for gameid in data._gameids}
+            shards.append(frames)
+
+        # Every game is in exactly one shard.
+        assert sum(shards, collections.Counter()) == counts
+        if frame_counts:  # Shards have similar numbers of frames.
+            totals = sorted(sum(shard.values()) for shard in shards)
+            assert totals[-1] - totals[0] <= max(counts.values())
+        else:  # Shards have similar numbers of games.
+            assert sorted(len(shard) for shard in shards) == [2, 2, 3]
+
+        # Shards are deterministic.
+        data = dataset.TtyrecDataset("basictest", rank=1, world_size=3, **kwargs)
+        assert sorted(data._gameids) == sorted(shards[1])
+
+        # Given games are split into shards, too.
+        gameids = [1, 4, 7]
+        sharded = [
+            dataset.TtyrecDataset(
+                "basictest", rank=rank, world_size=2, gameids=gameids, **kwargs
+            )._gameids
+            for rank in range(2)
+        ]
+        assert sorted(sharded[0] + sharded[1]) == gameids
+
+        with pytest.raises(ValueError, match="Rank 3"):
+            dataset.TtyrecDataset("basictest", rank=3, world_size=3, **kwargs)
+
+    def test_seeded_shuffle(self, db_exists):
+        def epochs(data, n=3):
+            return [next(iter(data))["gameids"][:, 0].tolist() for _ in range(n)]
+
+        kwargs = dict(batch_size=3, seq_length=10, seed=7)
+        orders = epochs(dataset.TtyrecDataset("basictest", **kwargs))
+        assert orders == epochs(dataset.TtyrecDataset("basictest", **kwargs))
+        assert len(set(map(str, orders))) > 1  # Epochs are shuffled differently.
+
+        # A restarted dataset continues with the same order.
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        data.epoch = 2
+        assert epochs(data, 1) == orders[2:]
+
+    @pytest.mark.parametrize("prefetch", [0, 2])
+    @pytest.mark.parametrize("skip", [0, 5, 20])
+    def test_state_dict(self, db_exists, prefetch, skip):
+        kwargs = dict(batch_size=3, seq_length=97, prefetch=prefetch)
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        assert data.state_dict() == {"epoch": 0}
+        expected = []
+        for i, mb in enumerate(data):
+            expected.append({k: v.copy() for k, v in mb.items()})
+            if isinstance(mb, dataset.PrefetchedMinibatch):
+                mb.release()
+            if i == skip:
+                state = data.state_dict()
+        assert data.state_dict() == {"epoch": 1}
+        assert state["epoch"] == 0
+        assert sorted(state["gameids"]) == sorted(data._gameids)
+
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        data.load_state_dict(state)
+        result = []
+        for mb in data:
+            result.append({k: v.copy() for k, v in mb.items()})
+            if isinstance(mb, dataset.PrefetchedMinibatch):
+                mb.release()
+        assert len(result) == len(expected) - skip - 1
+        for mb, expected_mb in zip(result, expected[skip + 1 :]):
+            for key in mb:
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+        assert data.state_dict() == {"epoch": 1}
+
+    def test_state_dict_random_windows(self, db_exists):
+        kwargs = dict(batch_size=4, seq_length=50, random_windows=True)
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        for i, _ in enumerate(data):
+            if i == 3:
+                break
+        state = data.state_dict()
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        data.load_state_dict(state)
+        mb = next(iter(data))
+        for lane, (window, _) in enumerate(state["batch"]["lanes"]):
+            if window is not None:  # The lane continues its window.
+                assert mb["gameids"][lane, 0] == window[0]
+                assert mb["done"][lane, 0] == 0
+
+    def test_seeded_random_windows(self, db_exists):
+        def minibatches(data, n=6):
+            return [
+                {k: v.copy() for k, v in mb.items()} for mb in itertools.islice(data, n)
+            ]
+
+        kwargs = dict(batch_size=4, seq_length=50, random_windows=True, seed=3)
+        expected = minibatches(dataset.TtyrecDataset("basictest", **kwargs))
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        result = minibatches(data, 3)
+        state = data.state_dict()
+        assert state["batch"]["random_state"] is not None
+
+        # A restored dataset continues with the same windows.
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        data.load_state_dict(state)
+        result += minibatches(data, 3)
+        assert len(result) == len(expected) == 6
+        for mb, expected_mb in zip(result, expected):
+            for key in mb:
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+
+        # Other epochs draw other windows.
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        data.epoch = 1
+        assert not np.array_equal(
+            minibatches(data, 1)[0]["gameids"], expected[0]["gameids"]
+        )
@@ -1,4 +1,7 @@
 import os
+import shutil
+import sqlite3
+import threading
 
 import pytest
 import test_converter
@@ -110,7 +113,7 @@ def mockdata(tmpdir_factory):  # Create mock data.
 
             # 2. Add "altorgtest" datase
             populate_db.add_altorg_directory(
-                test_converter.getfilename("altorg"), "altorgtest"
+                test_converter.getfilename("altorg"), "altorgtest", count_frames=True
             )
             db.set_root("altorgtest", "/path/to/altorg/")
 
@@ -118,7 +121,7 @@ def mockdata(tmpdir_factory):  # Create mock data.
             # NB: Uncomment when adding nledata tests
             gen_ttyrecs("")
             populate_db.add_nledata_directory(
-                str(os.path.join(root, "nle_data")), "nletest"
+                str(os.path.join(root, "nle_data")), "nletest", count_frames=True
             )
 
         yield tmpdir_factory.getbasetemp()
@@ -133,6 +136,15 @@ def conn(mockdata):
         yield conn
 
 
+@pytest.fixture
+def dbfilename(mockdata, tmpdir):
+    """This fixture needs to be imported to receive a path to a copy of the db,
+    for tests that modify it."""
+    filename = str(tmpdir.join("ttyrecs.db"))
+    shutil.copy(str(mockdata.join("ttyrecs.db")), filename)
+    return filename
+
+
 class TestDB:
     def test_conn(self, conn):
         assert conn
@@ -196,6 +208,63 @@ class TestDB:
             for i, ttyrec in enumerate(conn.execute(cmd, (gameid,)).fetchall()):
                 assert ttyrec[1] == i
 
+    def test_indexes(self, conn):
+        for column in db.INDEXED_GAMES_COLUMNS:
+            plan = conn.execute(
+                "EXPLAIN QUERY PLAN SELECT gameid FROM games WHERE %s=?" % column,
+                (1,),
+            ).fetchall()
+            assert "INDEX games_%s " % column in str(plan)
+
+    def test_get_connection(self, dbfilename):
+        conn = db.get_connection(dbfilename)
+        assert db.get_connection(dbfilename) is conn
+        # db() keeps opening connections of its own, which callers may close.
+        with db.db(filename=dbfilename) as c:
+            assert c is not conn
+            c.close()
+        with db.db(filename=dbfilename) as c:
+            assert c.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        assert conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        with pytest.raises(sqlite3.OperationalError, match="readonly"):
+            conn.execute("DELETE FROM games")
+
+        other = []
+        thread = threading.Thread(
+            target=lambda: other.append(db.get_connection(dbfilename))
+        )
+        thread.start()
+        thread.join()
+        assert other[0] is not conn
+
+        # Writers see readers' connections, and vice versa.
+        count = conn.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        with db.db(filename=dbfilename, rw=True) as c:
+            c.execute("DELETE FROM games WHERE gameid=1")
+            c.commit()
+        assert conn.execute("SELECT COUNT(*) FROM games").fetchone()[0] == count - 1
+
+        # A replaced file gets a new connection.
+        os.rename(dbfilename, dbfilename + ".old")
+        shutil.copy(dbfilename + ".old", dbfilename)
+        assert db.get_connection(dbfilename) is not conn
+
+        db.close_connections()
+        with pytest.raises(sqlite3.ProgrammingError):
+            conn.execute("SELECT 1")
+
+    def test_wal(self, dbfilename):
+        assert db.enable_wal(dbfilename) == "wal"
+        reader = db.get_connection(dbfilename)
+        count = reader.execute("SELECT COUNT(*) FROM games").fetchone()[0]
+        with db.db(filename=dbfilename, rw=True) as c:
+            c.execute("DELETE FROM games WHERE gameid=1")
+            # An uncommitted write doesn't block readers.
+            assert reader.execute("SELECT COUNT(*) FROM games").fetchone()[0] == count
+            c.commit()
+        assert reader.execute("SELECT COUNT(*) FROM games").fetchone()[0] == count - 1
+        db.close_connections()
+
     def test_version(self):
         # Expect adding nledata to provide latest ttyrec_version
         ttyrec_version = db.get_ttyrec_version("nletest")
@@ -463,6 +463,28 @@ class TestGymDynamics:
 
         assert len(entries) == 10
 
+    def test_buffer_scores(self):
+        env = gym.make(
+            "NetHackChallenge-v0", savedir=".", save_ttyrec_every=1, buffer_scores=True
+        )
+        pid = os.getpid()
+        for _ in range(3):
+            env.reset()
+            for c in [ord(" "), ord(" "), ord("<"), ord("y")]:
+                _, _, terminated, *_ = env.step(env.unwrapped.actions.index(c))
+            assert terminated
+        env.close()
+
+        # The env writes the entries NetHack hands it.
+        with open("nle.%i.xlogfile" % pid) as f:
+            entries = f.readlines()
+        assert len(entries) == 3
+        assert all("death=escaped" in entry for entry in entries)
+        with open("nle.%i.logfile" % pid) as f:
+            entries = f.readlines()
+        assert len(entries) == 3
+        assert all(entry.rstrip().endswith(",escaped") for entry in entries)
+
     def test_env_truncation(self):
         test_horizon = 10
 
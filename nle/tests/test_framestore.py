@@ -0,0 +1,279 @@
+import os
+
+import numpy as np
+import pytest
+from test_dataset import check_windows
+from test_db import dbfilename  # noqa: F401
+from test_db import mockdata  # noqa: F401
+
+from nle.dataset import dataset
+from nle.dataset import db
+from nle.dataset import framestore
+from nle.dataset import resim
+
+
+def minibatches(**kwargs):
+    result = []
+    for mb in dataset.TtyrecDataset(**kwargs):
+        result.append({k: v.copy() for k, v in mb.items()})
+        if isinstance(mb, dataset.PrefetchedMinibatch):
+            mb.release()
+    return result
+
+
+class TestFrameStore:
+    def test_append(self, tmpdir):
+        path = str(tmpdir.join("frames"))
+        store = framestore.FrameStore(path, rows=3, cols=4, mode="a")
+        games = []
+        for length in (5, 0, 2):
+            frames = {
+                key: np.random.randint(0, 100, (length,) + d["shape"]).astype(
+                    d["dtype"]
+                )
+                for key, d in framestore.frame_desc(3, 4).items()
+            }
+            games.append((store.append(frames), length, frames))
+        store.close()
+
+        store = framestore.FrameStore(path)
+        assert (store.rows, store.cols) == (3, 4)
+        assert len(store) == 7
+        assert store["tty_chars"].shape == (7, 3, 4)
+        for offset, length, frames in games:
+            game = store.game(offset, length)
+            for key in frames:
+                np.testing.assert_array_equal(game[key], frames[key])
+
+        with pytest.raises(ValueError, match="3 x 4"):
+            framestore.FrameStore(path, mode="a")
+
+    def test_truncated(self, tmpdir):
+        path = str(tmpdir.join("frames"))
+        store = framestore.FrameStore(path, rows=2, cols=2, mode="a")
+        store.append({key: np.ones((3,) + d["shape"]) for key, d in store.desc.items()})
+        store.close()
+        with open(str(tmpdir.join("frames", "tty_chars.bin")), "ab") as f:
+            f.write(b"\0\0")  # Half a frame.
+        with open(str(tmpdir.join("frames", "scores.bin")), "r+b") as f:
+            f.truncate(4 * 2)  # Only two scores.
+
+        assert len(framestore.FrameStore(path)) == 2
+        store = framestore.FrameStore(path, rows=2, cols=2, mode="a")
+        assert len(store) == 2
+        assert (
+            store.append(
+                {key: np.ones((1,) + d["shape"]) for key, d in store.desc.items()}
+            )
+            == 2
+        )
+        store.close()
+        assert len(framestore.FrameStore(path)) == 3
+
+    @pytest.mark.parametrize("dataset_name", ["basictest", "nletest"])
+    def test_materialize(self, dbfilename, tmpdir, dataset_name):  # noqa: F811
+        path = str(tmpdir.join("frames"))
+        num_games = framestore.materialize(
+            dataset_name, path, dbfilename=dbfilename, max_workers=2, commit_every=2
+        )
+        with db.db(filename=dbfilename) as conn:
+            gameids = [row[1] for row in db.get_games(dataset_name, conn)]
+            assert db.get_framestore(dataset_name, conn) == path
+            frames = db.get_frames(dataset_name, conn)
+        assert num_games == len(gameids)
+        assert sorted(frames) == sorted(gameids)
+
+        store = framestore.FrameStore(path)
+        assert len(store) == sum(length for _, length in frames.values())
+        data = dataset.TtyrecDataset(dataset_name, dbfilename=dbfilename)
+        for gameid in gameids:
+            expected = resim.read_ttyrec(
+                [os.path.join(data._rootpath, p) for p in data.get_paths(gameid)],
+                data._ttyrec_version,
+            )
+            game = data.get_frames(gameid)
+            assert game.keys() == expected.keys()
+            for key in game:
+                np.testing.assert_array_equal(game[key], expected[key])
+
+        # Rerunning only adds new games.
+        assert framestore.materialize(dataset_name, path, dbfilename=dbfilename) == 0
+        assert len(framestore.FrameStore(path)) == len(store)
+
+        with pytest.raises(ValueError, match="already has a frame store"):
+            framestore.materialize(
+                dataset_name, str(tmpdir.join("other")), dbfilename=dbfilename
+            )
+
+    @pytest.mark.parametrize("prefetch", [0, 2])
+    @pytest.mark.parametrize(
+        "dataset_name,seq_length", [("basictest", 97), ("nletest", 4)]
+    )
+    def test_dataset(self, dbfilename, tmpdir, dataset_name, seq_length, prefetch):  # noqa: F811
+        framestore.materialize(dataset_name, str(tmpdir.join("frames")), dbfilename)
+        data = dataset.TtyrecDataset(dataset_name, dbfilename=dbfilename)
+        num_games = len(data._gameids)
+        # One game per batch entry: Frames only match if each game starts with
+        # a fresh terminal, as in the frame store.
+        kwargs = dict(
+            dataset_name=dataset_name,
+            dbfilename=dbfilename,
+            batch_size=num_games,
+            seq_length=seq_length,
+            shuffle=False,
+            prefetch=prefetch,
+        )
+        expected = minibatches(use_framestore=False, **kwargs)
+        result = minibatches(**kwargs)
+        assert len(result) == len(expected) > 1
+        for mb, expected_mb in zip(result, expected):
+            assert mb.keys() == expected_mb.keys()
+            for key in mb:
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+
+        data = dataset.TtyrecDataset(use_framestore=False, **kwargs)
+        assert data.get_frames(data._gameids[0]) is None
+
+    def test_dataset_loop_forever(self, dbfilename, tmpdir):  # noqa: F811
+        framestore.materialize("basictest", str(tmpdir.join("frames")), dbfilename)
+        kwargs = dict(
+            dataset_name="basictest",
+            dbfilename=dbfilename,
+            batch_size=7,
+            seq_length=300,
+            shuffle=False,
+            loop_forever=True,
+        )
+        data = dataset.TtyrecDataset(**kwargs)
+        assert isinstance(
+            data._make_batch_converter(data._gameids, 7), framestore.FrameStoreBatch
+        )
+        for i, mb in enumerate(data):
+            assert (mb["gameids"] != 0).all()
+            if i == 20:
+                break
+
+    @pytest.mark.parametrize("random_windows", [False, True])
+    def test_crop_and_keys(self, dbfilename, tmpdir, random_windows):  # noqa: F811
+        framestore.materialize("basictest", str(tmpdir.join("frames")), dbfilename)
+        kwargs = dict(
+            dataset_name="basictest",
+            dbfilename=dbfilename,
+            batch_size=7,
+            seq_length=50,
+            shuffle=False,
+            random_windows=random_windows,
+        )
+        np.random.seed(0)
+        expected = minibatches(**kwargs)
+        np.random.seed(0)
+        result = minibatches(crop=(1, 0, 21, 79), keys=("tty_colors",), **kwargs)
+        assert len(result) == len(expected) > 1
+        for mb, expected_mb in zip(result, expected):
+            assert list(mb) == ["tty_colors", "done", "gameids"]
+            np.testing.assert_array_equal(
+                mb["tty_colors"], expected_mb["tty_colors"][..., 1:22, :79]
+            )
+            np.testing.assert_array_equal(mb["gameids"], expected_mb["gameids"])
+
+    @pytest.mark.parametrize("random_windows", [False, True])
+    def test_status_keys(self, dbfilename, tmpdir, random_windows):  # noqa: F811
+        framestore.materialize("basictest", str(tmpdir.join("frames")), dbfilename)
+        kwargs = dict(
+            dataset_name="basictest",
+            dbfilename=dbfilename,
+            batch_size=7,
+            seq_length=50,
+            shuffle=False,
+            random_windows=random_windows,
+            keys=("tty_cursor",) + dataset.STATUS_KEYS,
+        )
+        np.random.seed(0)
+        expected = minibatches(use_framestore=False, **kwargs)
+        np.random.seed(0)
+        result = minibatches(crop=(1, 0, 21, 79), **kwargs)
+        assert len(result) == len(expected) > 1
+        for mb, expected_mb in zip(result, expected):
+            for key in expected_mb:
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+
+    def test_read_game(self, dbfilename, tmpdir):  # noqa: F811
+        framestore.materialize("nletest", str(tmpdir.join("frames")), dbfilename)
+        data = dataset.TtyrecDataset("nletest", dbfilename=dbfilename)
+        converted = dataset.TtyrecDataset(
+            "nletest", dbfilename=dbfilename, use_framestore=False
+        )
+        for gameid in data._gameids:
+            assert data.get_frame_count(gameid) == converted.get_frame_count(gameid)
+            game = data.read_game(gameid)
+            expected = converted.read_game(gameid)
+            for key in expected:
+                np.testing.assert_array_equal(game[key], expected[key])
+            with pytest.raises(ValueError, match="more than 1 frames"):
+                data.read_game(gameid, {k: v[:1] for k, v in game.items()})
+
+    def test_random_windows(self, dbfilename, tmpdir):  # noqa: F811
+        framestore.materialize("basictest", str(tmpdir.join("frames")), dbfilename)
+        with db.db(filename=dbfilename) as conn:
+            frames = db.get_frames("basictest", conn)
+        data = dataset.TtyrecDataset(
+            "basictest",
+            dbfilename=dbfilename,
+            batch_size=4,
+            seq_length=50,
+            random_windows=True,
+        )
+        counts = data.get_frame_counts()
+        assert counts == {gameid: length for gameid, (_, length) in frames.items()}
+        mbs = [{k: v.copy() for k, v in mb.items()} for mb in data]
+        assert check_windows(data, mbs) == 4 * -(-sum(counts.values()) // 4)
+        assert not data._part_frame_counts  # No ttyrecs were read.
+
+    def test_dataset_fallback(self, dbfilename, tmpdir):  # noqa: F811
+        framestore.materialize("basictest", str(tmpdir.join("frames")), dbfilename)
+        # Frames of a different size are not used.
+        data = dataset.TtyrecDataset("basictest", dbfilename=dbfilename, rows=10)
+        assert data.get_frames(1) is None
+        # Neither is a store missing games.
+        with db.db(filename=dbfilename, rw=True) as conn:
+            conn.execute("DELETE FROM frames WHERE gameid=1")
+            conn.commit()
+        data = dataset.TtyrecDataset("basictest", dbfilename=dbfilename)
+        assert data.get_frames(1) is None
+        assert data.get_frames(2) is not None
+        batch = data._make_batch_converter(data._gameids, 7)
+        assert not isinstance(batch, framestore.FrameStoreBatch)
+
+    def test_state_dict(self, dbfilename, tmpdir):  # noqa: F811
+        framestore.materialize("basictest", str(tmpdir.join("frames")), dbfilename)
+        kwargs = dict(
+            dataset_name="basictest", dbfilename=dbfilename, batch_size=3, seq_length=97
+        )
+        data = dataset.TtyrecDataset(**kwargs)
+        expected = []
+        for i, mb in enumerate(data):
+            expected.append({k: v.copy() for k, v in mb.items()})
+            if i == 20:
+                state = data.state_dict()
+        data = dataset.TtyrecDataset(**kwargs)
+        data.load_state_dict(state)
+        result = [{k: v.copy() for k, v in mb.items()} for mb in data]
+        assert len(result) == len(expected) - 21
+        for mb, expected_mb in zip(result, expected[21:]):
+            for key in mb:
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+
+        # States only apply to the source of frames they were saved with.
+        assert state["backend"] == "framestore"
+        data = dataset.TtyrecDataset(use_framestore=False, **kwargs)
+        data.load_state_dict(state)
+        with pytest.raises(ValueError, match="from framestore when reading from"):
+            iter(data)
+        data = dataset.TtyrecDataset(use_framestore=False, **kwargs)
+        next(iter(data))
+        ttyrec_state = data.state_dict()
+        assert ttyrec_state["backend"] == "ttyrecs"
+        data = dataset.TtyrecDataset(**kwargs)
+        data.load_state_dict(ttyrec_state)
+        with pytest.raises(ValueError, match="from ttyrecs when reading from"):
+            iter(data)
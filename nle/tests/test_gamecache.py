@@ -0,0 +1,127 @@
+import threading
+
+import numpy as np
+import pytest
+from test_db import conn  # noqa: F401
+from test_db import mockdata  # noqa: F401
+
+from nle.dataset import dataset
+from nle.dataset import gamecache
+
+
+@pytest.fixture
+def db_exists(conn):  # noqa: F811
+    return True
+
+
+def game(n):
+    return dict(a=np.zeros(n, dtype=np.uint8), b=np.ones(n, dtype=np.uint8))
+
+
+class TestGameCache:
+    def test_lru(self):
+        cache = gamecache.GameCache(max_bytes=50)
+        loads = []
+
+        def load(n):
+            def fn():
+                loads.append(n)
+                return game(n)
+
+            return fn
+
+        first = cache.get(10, load(10))
+        assert cache.get(10, load(10)) is first
+        assert not first["a"].flags.writeable
+        cache.get(5, load(5))
+        cache.get(10, load(10))  # Most recently used.
+        cache.get(7, load(7))  # 20 + 10 + 14 bytes.
+        assert len(cache) == 3 and cache.nbytes == 44
+        cache.get(4, load(4))  # Evicts 5.
+        assert 5 not in cache and 10 in cache
+        assert loads == [10, 5, 7, 4]
+
+        cache.get(30, load(30))  # Larger than the cache, not cached.
+        assert 30 not in cache
+        assert cache.stats() == dict(
+            games=3, nbytes=42, hits=2, misses=5, evictions=1, hit_rate=2 / 7
+        )
+        cache.clear()
+        assert len(cache) == 0 and cache.nbytes == 0
+        assert cache.stats()["hits"] == 2
+
+    def test_threads(self):
+        cache = gamecache.GameCache(max_bytes=1000)
+
+        def worker():
+            for i in range(200):
+                cache.get(i % 30, lambda n=i % 30 + 1: game(n))
+
+        threads = [threading.Thread(target=worker) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert cache.hits + cache.misses == 800
+        assert cache.nbytes == sum(2 * (key + 1) for key in range(30) if key in cache)
+        assert cache.nbytes <= 1000
+
+    def test_dataset(self, db_exists):
+        kwargs = dict(batch_size=2, seq_length=50, shuffle=False)
+        data = dataset.TtyrecDataset("basictest", **kwargs)
+        cached = dataset.TtyrecDataset("basictest", cache=1 << 30, **kwargs)
+        assert isinstance(cached.cache, gamecache.GameCache)
+
+        for gameids in ([4], [7], [5, 7, 1]):
+            expected = [
+                {k: v.copy() for k, v in mb.items()}
+                for mb in dataset._ttyrec_generator(
+                    len(gameids),
+                    13,
+                    data.rows,
+                    data.cols,
+                    data._make_batch_converter(gameids, len(gameids)),
+                    data._ttyrec_version,
+                )
+            ]
+            for _ in range(2):
+                result = cached.get_ttyrecs(gameids, chunk_size=13)
+                assert len(result) == len(expected)
+                for mb, expected_mb in zip(result, expected):
+                    assert list(mb) == list(expected_mb)
+                    for key in mb:
+                        np.testing.assert_array_equal(mb[key], expected_mb[key])
+        assert cached.cache.stats()["misses"] == 4
+        assert cached.cache.stats()["hits"] == 6
+
+        # Full chunks of a single game are views of the cached frames.
+        frames = cached.get_game(4)
+        chunks = cached.get_ttyrec(4, chunk_size=13)
+        assert np.shares_memory(chunks[0]["tty_chars"], frames["tty_chars"])
+        assert not np.shares_memory(chunks[-1]["tty_chars"], frames["tty_chars"])
+
+        # Datasets share caches.
+        other = dataset.TtyrecDataset("basictest", cache=cached.cache, **kwargs)
+        assert other.get_game(4) is frames
+
+    def test_random_windows(self, db_exists):
+        cache = gamecache.GameCache(1 << 30)
+        data = dataset.TtyrecDataset(
+            "basictest",
+            batch_size=2,
+            seq_length=20,
+            random_windows=True,
+            loop_forever=True,
+            cache=cache,
+        )
+        for i, mb in enumerate(data):
+            for lane in range(2):
+                gameid = mb["gameids"][lane, 0]
+                frames = data.get_game(gameid)
+                timestamps = frames["timestamps"]
+                start = np.flatnonzero(timestamps == mb["timestamps"][lane, 0])
+                assert len(start)
+            if i == 20:
+                break
+        assert len(cache) <= 7
+        assert cache.hits > cache.misses
@@ -132,6 +132,42 @@ class TestNetHack:
         finally:
             game.close()
 
+    @pytest.mark.parametrize("buffer_scores", [False, True])
+    def test_buffer_scores(self, buffer_scores):
+        game = nethack.Nethack(
+            buffer_scores=buffer_scores, observation_keys=("program_state",)
+        )
+        try:
+            (program_state,) = game.reset()
+            while not program_state[3]:  # in_moveloop, eg after "--More--".
+                (program_state,), _ = game.step(nethack.MiscAction.MORE)
+            assert game.xlogfile_entry() == {}
+            for ch in (0x80 | ord("q"), ord("y")):  # M-q y
+                _, done = game.step(ch)
+            while not done:
+                _, done = game.step(ord(" "))
+            assert game.how_done() == nethack.QUIT
+
+            with open(os.path.join(game._vardir, "xlogfile")) as f:
+                xlogfile = f.read()
+            entry = game.xlogfile_entry()
+            if buffer_scores:
+                assert xlogfile == ""
+                assert entry["death"] == "quit"
+                assert entry["name"] == "Agent"
+                assert int(entry["turns"]) == 1
+                assert game.logfile_entry().endswith(",quit\n")
+            else:
+                assert "death=quit" in xlogfile
+                assert entry == {}
+                assert game.logfile_entry() == ""
+
+            game.reset()
+            assert game.xlogfile_entry() == {}
+            assert game.logfile_entry() == ""
+        finally:
+            game.close()
+
     def test_set_seed_after_reset(self, game):
         game.reset()
         # Could fail on a system without a good source of randomness:
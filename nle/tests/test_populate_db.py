@@ -1,11 +1,19 @@
+import functools
 import json
+import os
+import shutil
+import sqlite3
 
 import pytest  # NOQA: F401
 from test_converter import getfilename
 from test_db import conn  # NOQA: F401
+from test_db import dbfilename  # NOQA: F401
 from test_db import mockdata  # NOQA: F401
 
 from nle import nethack
+from nle.dataset import db
+from nle.dataset import populate_db
+from nle.dataset import resim
 
 TTYRECS_TABLE_OFFSET = 0
 GAMES_TABLE_OFFSET = 5
@@ -104,3 +112,141 @@ class TestPopulateDB:
             assert actual[TTYREC_VERSION_IDX] == nethack.TTYREC_VERSION
 
         assert paths == sorted(paths)
+
+    def test_frame_counts(self, conn):  # NOQA: F811
+        roots = {"altorgtest": getfilename("altorg"), "nletest": None}
+        for dataset_name, root in roots.items():
+            counts = db.get_frame_counts(dataset_name, conn)
+            assert sorted(counts) == sorted(
+                g for _, g, _, _ in db.get_games(dataset_name, conn)
+            )
+            root = root or db.get_root(dataset_name, conn)
+            version = db.get_ttyrec_version(dataset_name, conn)
+            for gameid, parts in counts.items():
+                paths = conn.execute(
+                    "SELECT path FROM ttyrecs WHERE gameid=? ORDER BY part",
+                    (gameid,),
+                ).fetchall()
+                assert len(parts) == len(paths)
+                for (path,), frames in zip(paths, parts):
+                    ttyrec = resim.read_ttyrec([os.path.join(root, path)], version)
+                    assert frames == len(ttyrec["timestamps"])
+
+    def test_add_frame_counts(self, dbfilename):  # NOQA: F811
+        def get_frame_counts():
+            with db.db(filename=dbfilename) as c:
+                return db.get_frame_counts("basictest", c)
+
+        assert get_frame_counts() == {}
+        populate_db.add_frame_counts("basictest", filename=dbfilename)
+        counts = get_frame_counts()
+        assert counts == {
+            1: [2431],
+            2: [2431],
+            3: [2431],
+            4: [31],
+            5: [31],
+            6: [31],
+            7: [31, 31, 31],
+        }
+
+        # Only uncounted ttyrecs are counted.
+        with db.db(filename=dbfilename, rw=True) as c:
+            c.execute("UPDATE frame_counts SET frames=0 WHERE gameid=1")
+            c.execute("DELETE FROM frame_counts WHERE gameid=2")
+            c.commit()
+        assert 2 not in get_frame_counts()
+        populate_db.add_frame_counts("basictest", filename=dbfilename)
+        assert get_frame_counts() == {**counts, 1: [0]}
+
+    def test_update_nledata(self, dbfilename, tmpdir):  # NOQA: F811
+        def get_ttyrecs():
+            with db.db(filename=dbfilename) as c:
+                return {
+                    path: (gameid, size, mtime)
+                    for path, _, size, mtime, gameid in c.execute(
+                        """SELECT ttyrecs.* FROM ttyrecs INNER JOIN datasets
+                        ON ttyrecs.gameid=datasets.gameid
+                        WHERE datasets.dataset_name='nleupdate'"""
+                    )
+                }
+
+        with db.db(filename=dbfilename) as c:
+            src = db.get_root("nletest", c)
+        dirs = sorted(os.listdir(src))
+        assert len(dirs) == 2
+        path = str(tmpdir.join("nle_data"))
+        shutil.copytree(os.path.join(src, dirs[0]), os.path.join(path, dirs[0]))
+        populate_db.add_nledata_directory(
+            path, "nleupdate", filename=dbfilename, update=True, max_workers=2
+        )
+        first = get_ttyrecs()
+        assert len(first) == 3
+        with db.db(filename=dbfilename) as c:
+            assert db.get_frame_counts("nleupdate", c) == {}  # Not by default.
+
+        with pytest.raises(sqlite3.IntegrityError):
+            populate_db.add_nledata_directory(path, "nleupdate", filename=dbfilename)
+
+        # Only new games are added.
+        shutil.copytree(os.path.join(src, dirs[1]), os.path.join(path, dirs[1]))
+        populate_db.add_nledata_directory(
+            path, "nleupdate", filename=dbfilename, count_frames=True, update=True
+        )
+        second = get_ttyrecs()
+        assert len(second) == 6
+        assert {p: second[p] for p in first} == first
+        with db.db(filename=dbfilename) as c:
+            assert len(db.get_frame_counts("nleupdate", c)) == 6
+            seeds = c.execute("SELECT COUNT(*) FROM seeds").fetchone()[0]
+
+        # Changed ttyrecs are updated and counted again.
+        changed = sorted(second)[0]
+        gameid = second[changed][0]
+        with db.db(filename=dbfilename, rw=True) as c:
+            counts = db.get_frame_counts("nleupdate", c)[gameid]
+            c.execute("UPDATE frame_counts SET frames=0 WHERE gameid=?", (gameid,))
+            c.commit()
+        os.utime(os.path.join(path, changed), (0, 12345))
+        populate_db.add_nledata_directory(
+            path, "nleupdate", filename=dbfilename, count_frames=True, update=True
+        )
+        third = get_ttyrecs()
+        assert third == {**second, changed: second[changed][:2] + (12345.0,)}
+        with db.db(filename=dbfilename) as c:
+            assert db.get_frame_counts("nleupdate", c)[gameid] == counts
+            assert c.execute("SELECT COUNT(*) FROM seeds").fetchone()[0] == seeds
+
+    def test_game_data_generator(self, tmpdir):
+        xlogfile = tmpdir.join("xlogfile")
+        xlogfile.write_binary(
+            b"version=3.6.6\tpoints=12\tname=a=b\tdeath=killed by a jackal\t"
+            b"while=helpless\tttyrecname=x.ttyrec\n"
+            b"version=3.6.6\tpoints=7\tname=\xe9\tdeath=quit\tttyrecname=y.ttyrec\n"
+        )
+        columns = [("version", str), ("points", int), ("name", str)]
+        columns += [("death", str), ("turns", int), ("role", str)]
+        games = list(populate_db.game_data_generator(str(xlogfile), columns=columns))
+        assert games == [
+            ("3.6.6", 12, "a=b", "killed by a jackal while helpless", -1, "-1"),
+            ("3.6.6", 7, "\xe9", "quit", -1, "-1"),
+        ]
+
+        ttyrecs = []
+        _filter = functools.partial(
+            populate_db.xlogfile_gen_filter,
+            ttyrecnames={"y.ttyrec"},
+            ttyrecs=ttyrecs,
+            ttydir="dir",
+        )
+        games = populate_db.game_data_generator(str(xlogfile), _filter, columns=columns)
+        assert [g[1] for g in games] == [7]
+        assert ttyrecs == ["dir/y.ttyrec"]
+
+    def test_executemany_batched(self):
+        c = sqlite3.connect(":memory:")
+        c.execute("CREATE TABLE t (x INTEGER)")
+        rows = ((i,) for i in range(25))
+        sql = "INSERT INTO t VALUES (?)"
+        assert populate_db.executemany_batched(c, sql, rows, batch_size=10) == 25
+        assert c.execute("SELECT SUM(x) FROM t").fetchone()[0] == sum(range(25))
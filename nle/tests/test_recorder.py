@@ -0,0 +1,77 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+
+import nle  # noqa: F401
+from nle.env import ObservationRecorder
+from nle.env import ObservationShards
+
+KEYS = ("glyphs", "blstats", "message")
+
+
+class TestObservationRecorder:
+    @pytest.fixture
+    def recorded(self, tmpdir):
+        env = ObservationRecorder(
+            gym.make("NetHackScore-v0", max_episode_steps=25),
+            str(tmpdir),
+            observation_keys=KEYS,
+            shard_size=16,
+        )
+        expected = {k: [] for k in KEYS + ("actions", "rewards", "done")}
+        obs, _ = env.reset(seed=0)
+        for _ in range(40):
+            action = env.action_space.sample()
+            for k in KEYS:
+                expected[k].append(obs[k].copy())
+            obs, reward, terminated, truncated, _ = env.step(action)
+            expected["actions"].append(action)
+            expected["rewards"].append(reward)
+            expected["done"].append(terminated or truncated)
+            if terminated or truncated:
+                obs, _ = env.reset()
+        env.close()
+        yield str(tmpdir), {k: np.array(v) for k, v in expected.items()}
+
+    def test_roundtrip(self, recorded):
+        savedir, expected = recorded
+        shards = ObservationShards(savedir)
+        assert len(shards.shards) == 3  # 16 + 16 + 8 steps.
+        assert len(shards) == 40
+
+        mbs = list(shards.minibatches(5))
+        assert [len(mb["actions"]) for mb in mbs] == [5, 5, 5, 1] * 2 + [5, 3]
+        for k, v in expected.items():
+            np.testing.assert_array_equal(
+                np.concatenate([mb[k] for mb in mbs]), v.astype(mbs[0][k].dtype)
+            )
+        assert isinstance(mbs[0]["glyphs"], np.memmap)
+        assert expected["done"].sum() >= 1
+
+    def test_keys_subset(self, recorded):
+        savedir, expected = recorded
+        shards = ObservationShards(savedir, keys=("blstats", "actions"))
+        mb = next(shards.minibatches(40))
+        assert set(mb.keys()) == {"blstats", "actions"}
+        np.testing.assert_array_equal(mb["blstats"], expected["blstats"][:16])
+
+    def test_unknown_key(self, tmpdir):
+        with pytest.raises(ValueError, match="Unknown observation 'foo'"):
+            ObservationRecorder(
+                gym.make("NetHackScore-v0"), str(tmpdir), observation_keys=("foo",)
+            )
+
+    def test_reset_mid_episode(self, tmpdir):
+        env = ObservationRecorder(
+            gym.make("NetHackScore-v0"), str(tmpdir), ("blstats",), shard_size=4
+        )
+        env.reset(seed=0)
+        for steps in (3, 1, 2):  # The second episode ends a full shard.
+            for _ in range(steps):
+                env.step(0)
+            env.reset()
+        env.close()
+        shards = ObservationShards(str(tmpdir), keys=("done",))
+        assert len(shards.shards) == 2
+        done = np.concatenate([mb["done"] for mb in shards.minibatches(4)])
+        np.testing.assert_array_equal(done, [0, 0, 1, 1, 0, 1])
@@ -0,0 +1,124 @@
+import bz2
+import os
+import struct
+
+import numpy as np
+import pytest
+from test_db import conn  # noqa: F401
+from test_db import mockdata  # noqa: F401
+
+import nle.env.tasks
+from nle.dataset import db
+from nle.dataset import populate_db
+from nle.dataset import resim
+
+QUIT = [ord(" "), ord(" "), ord("<"), ord("y")]
+
+
+@pytest.fixture(scope="module")
+def seededdata(tmpdir_factory):
+    """Generates a db with a dataset "seeded" of 4 games played without reseeding."""
+    root = tmpdir_factory.mktemp("seeded")
+    for core in (1, 2):
+        env = nle.env.tasks.NetHackScore(
+            savedir=str(root.join("nle_data", "core%i" % core)),
+            character="val-hum-fem-law",
+            save_ttyrec_every=1,
+            actions=nle.nethack.ACTIONS,
+            allow_all_yn_questions=True,
+        )
+        for _ in range(2):
+            # Seeds only apply to the next reset.
+            env.unwrapped.seed(core, 42, reseed=False)
+            env.reset()
+            for c in QUIT:
+                _, _, done, *_ = env.step(env.unwrapped.actions.index(c))
+            assert done
+        env.close()
+
+    dbfilename = str(root.join("ttyrecs.db"))
+    db.create(dbfilename)
+    populate_db.add_nledata_directory(
+        str(root.join("nle_data")), "seeded", filename=dbfilename
+    )
+    return dbfilename
+
+
+class TestResim:
+    def test_seeds_reseeding(self, conn):  # noqa: F811
+        gameids = [gameid for _, gameid, *_ in db.get_games("nletest", conn)]
+        assert gameids
+        for gameid in gameids:
+            core, disp, reseed, lgen = db.get_seeds(gameid, conn)
+            assert reseed
+            assert lgen is None
+
+        # Games not recorded by NLE have no seeds.
+        assert db.get_seeds(1, conn) is None
+
+        # Games played with reseeding aren't deterministic.
+        assert not list(resim.resimulate_dataset("nletest"))
+
+    def test_seeds(self, seededdata):
+        with db.db(filename=seededdata) as c:
+            seeds = [db.get_seeds(g, c) for _, g, *_ in db.get_games("seeded", c)]
+        assert sorted(seeds) == [(1, 42, False, None)] * 2 + [(2, 42, False, None)] * 2
+
+    def test_resimulate_dataset(self, seededdata):
+        keys = ("glyphs", "blstats", "inv_letters")
+        results = dict(
+            resim.resimulate_dataset(
+                "seeded", keys, dbfilename=seededdata, max_workers=2
+            )
+        )
+        assert len(results) == 4
+        for obs in results.values():
+            keypresses = obs["keypresses"]
+            assert list(keypresses[: len(QUIT)]) == QUIT
+            assert sorted(obs) == sorted(keys + ("keypresses",))
+            for key in keys:
+                assert len(obs[key]) == len(keypresses)
+            assert obs["glyphs"].shape[1:] == (21, 79)
+            assert np.all(obs["blstats"][: len(QUIT), 12] == 1)  # Dlvl.
+            assert obs["inv_letters"][0, 0] == ord("a")
+
+        # Games of the same seeds are identical.
+        a, b, c, d = (results[g] for g in sorted(results))
+        np.testing.assert_array_equal(a["glyphs"], b["glyphs"])
+        assert not np.array_equal(a["glyphs"], c["glyphs"])
+        np.testing.assert_array_equal(c["glyphs"], d["glyphs"])
+
+    def test_divergence(self, seededdata):
+        with db.db(filename=seededdata) as c:
+            root = db.get_root("seeded", c)
+            ((gameid, path),) = c.execute(
+                "SELECT gameid, path FROM ttyrecs ORDER BY gameid LIMIT 1"
+            ).fetchall()
+            core, disp, reseed, lgen = db.get_seeds(gameid, c)
+        paths = [os.path.join(root, path)]
+        kwargs = dict(character="val-hum-fem-law")
+
+        obs = resim.resimulate(paths, (core, disp, reseed, lgen), **kwargs)
+        keypresses = obs["keypresses"]
+
+        seeds = (core + 1, disp, reseed, lgen)
+        with pytest.raises(RuntimeError, match="diverged at keypress 0"):
+            resim.resimulate(paths, seeds, **kwargs)
+        obs = resim.resimulate(paths, seeds, check_tty=False, **kwargs)
+        np.testing.assert_array_equal(obs["keypresses"], keypresses)
+
+        with pytest.raises(ValueError, match="reseeding"):
+            resim.resimulate(paths, (core, disp, True, lgen), **kwargs)
+
+    def test_resimulate_no_keypresses(self, tmpdir):
+        # Eg a ttyrec that ends before the first keypress.
+        ttyrec = str(tmpdir.join("empty.ttyrec3.bz2"))
+        with bz2.BZ2File(ttyrec, "wb") as f:
+            for data in (b"Hello", b"World"):
+                f.write(struct.pack("<iiiB", 0, 0, len(data), 0) + data)
+
+        obs = resim.resimulate([ttyrec], (1, 42, False, None))
+        assert sorted(obs) == ["blstats", "glyphs", "keypresses"]
+        for key in ("glyphs", "blstats"):
+            assert obs[key].shape == (0,) + nle.nethack.OBSERVATION_DESC[key]["shape"]
+        assert len(obs["keypresses"]) == 0
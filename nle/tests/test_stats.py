@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+from test_db import dbfilename  # noqa: F401
+from test_db import mockdata  # noqa: F401
+
+from nle.dataset import dataset
+from nle.dataset import resim
+from nle.dataset import stats
+
+
+class TestStats:
+    def test_scan_ttyrec(self, mockdata):  # noqa: F811
+        for dataset_name in ("basictest", "nletest"):
+            data = dataset.TtyrecDataset(dataset_name)
+            for gameid in data._gameids[:3]:
+                paths = [
+                    os.path.join(data._rootpath, p) for p in data.get_paths(gameid)
+                ]
+                expected = resim.read_ttyrec(paths, data._ttyrec_version)
+                frames = stats.scan_ttyrec(paths, data._ttyrec_version, chunk_size=7)
+                assert frames.keys() == {"timestamps", "keypresses", "scores"}
+                for key, value in frames.items():
+                    np.testing.assert_array_equal(value, expected[key])
+
+    def test_add_game_stats(self, dbfilename):  # noqa: F811
+        assert stats.add_game_stats("nletest", dbfilename, commit_every=2) == 6
+        assert stats.add_game_stats("nletest", dbfilename) == 0
+        result = stats.get_game_stats("nletest", dbfilename)
+        assert stats.get_game_stats("basictest", dbfilename) == {}
+
+        data = dataset.TtyrecDataset("nletest", dbfilename=dbfilename)
+        assert sorted(result) == sorted(data._gameids)
+        for gameid, game in result.items():
+            paths = [os.path.join(data._rootpath, p) for p in data.get_paths(gameid)]
+            frames = resim.read_ttyrec(paths, data._ttyrec_version)
+            timestamps = frames["timestamps"]
+            assert game["frames"] == len(timestamps)
+            assert game["starttime"] == timestamps[0]
+            assert game["duration"] == timestamps[-1] - timestamps[0]
+            assert game["final_score"] == frames["scores"][-1]
+            assert game["max_score"] == frames["scores"].max()
+            np.testing.assert_array_equal(
+                game["actions"], np.bincount(frames["keypresses"], minlength=256)
+            )
+
+        assert stats.add_game_stats("basictest", dbfilename, max_workers=2) == 7
+        for game in stats.get_game_stats("basictest", dbfilename).values():
+            assert game["actions"] is None and game["final_score"] is None
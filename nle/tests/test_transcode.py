@@ -0,0 +1,98 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+from test_converter import TTYREC_NLE_V3
+from test_converter import getfilename
+from test_db import dbfilename  # noqa: F401
+from test_db import mockdata  # noqa: F401
+
+from nle.dataset import dataset
+from nle.dataset import db
+from nle.dataset import transcode
+
+
+def minibatches(**kwargs):
+    return [
+        {k: v.copy() for k, v in mb.items()} for mb in dataset.TtyrecDataset(**kwargs)
+    ]
+
+
+class TestTranscode:
+    @pytest.mark.parametrize("dataset_name", ["basictest", "nletest"])
+    def test_transcode(self, dbfilename, tmpdir, dataset_name):  # noqa: F811
+        root = str(tmpdir.join("gz"))
+        new_name = dataset_name + "_gz"
+        num_games = transcode.transcode(
+            dataset_name, new_name, root, dbfilename=dbfilename, commit_every=2
+        )
+        with db.db(filename=dbfilename) as conn:
+            gameids = [row[1] for row in db.get_games(dataset_name, conn)]
+            assert db.get_root(new_name, conn) == root
+            assert db.get_ttyrec_version(new_name, conn) == db.get_ttyrec_version(
+                dataset_name, conn
+            )
+            assert sorted(row[1] for row in db.get_games(new_name, conn)) == sorted(
+                gameids
+            )
+        assert num_games == len(gameids)
+
+        data = dataset.TtyrecDataset(new_name, dbfilename=dbfilename)
+        for gameid in gameids:
+            for path in data.get_paths(gameid):
+                path = os.path.join(root, path)
+                with gzip.open(path) as f:
+                    f.read()
+                assert os.path.exists(path + ".idx")
+
+        kwargs = dict(dbfilename=dbfilename, batch_size=3, seq_length=50, shuffle=False)
+        expected = minibatches(dataset_name=dataset_name, **kwargs)
+        result = minibatches(dataset_name=new_name, **kwargs)
+        assert len(result) == len(expected)
+        for mb, expected_mb in zip(result, expected):
+            assert mb.keys() == expected_mb.keys()
+            for key in mb:
+                np.testing.assert_array_equal(mb[key], expected_mb[key])
+
+        # Rerunning only adds new games.
+        assert (
+            transcode.transcode(dataset_name, new_name, root, dbfilename=dbfilename)
+            == 0
+        )
+        with pytest.raises(ValueError, match="already exists"):
+            transcode.transcode(
+                dataset_name, new_name, str(tmpdir), dbfilename=dbfilename
+            )
+
+    def test_resume(self, dbfilename, tmpdir):  # noqa: F811
+        root = str(tmpdir.join("gz"))
+        with db.db(filename=dbfilename) as conn:
+            src_root = db.get_root("nletest", conn)
+        data = dataset.TtyrecDataset("nletest", dbfilename=dbfilename)
+        gameid = data._gameids[0]
+        path = data.get_paths(gameid)[0]
+        dst = os.path.join(root, path)
+        os.makedirs(os.path.dirname(dst))
+        transcode.transcode_ttyrec(os.path.join(src_root, path), dst, compresslevel=0)
+        mtime = os.stat(dst).st_mtime_ns
+
+        assert (
+            transcode.transcode(
+                "nletest", "nletest_gz", root, index=False, dbfilename=dbfilename
+            )
+            == 6
+        )
+        assert os.stat(dst).st_mtime_ns == mtime  # Not written again.
+        assert not os.path.exists(dst + ".idx")
+
+    def test_truncated(self, tmpdir):
+        src = str(tmpdir.join("truncated.ttyrec.bz2"))
+        with open(getfilename(TTYREC_NLE_V3), "rb") as f:
+            data = f.read()
+        with open(src, "wb") as f:
+            f.write(data[: len(data) // 2])
+        dst = str(tmpdir.join("out.ttyrec.bz2"))
+        with pytest.raises(EOFError, match="Truncated"):
+            transcode.transcode_ttyrec(src, dst)
+        assert os.listdir(str(tmpdir)) == ["truncated.ttyrec.bz2"]
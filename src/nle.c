@@ -143,6 +143,7 @@ init_nle(FILE *ttyrec, nle_obs *obs)
     nle_ctx_t *nle = malloc(sizeof(nle_ctx_t));
 
     nle->ttyrec = ttyrec;
+    nle->ttyrec_score = 0;
 
 #ifdef NLE_BZ2_TTYRECS
     if (nle->ttyrec) {
@@ -247,6 +248,14 @@ write_ttyrec_header(int length, unsigned char channel)
     return TRUE;
 }
 
+static void
+write_ttyrec_score(nle_ctx_t *nle, nle_obs *obs)
+{
+    write_ttyrec_header(4, 2);
+    write_ttyrec_data(&obs->blstats[NLE_BL_SCORE], 4);
+    nle->ttyrec_score = obs->blstats[NLE_BL_SCORE];
+}
+
 /* win/tty only calls fflush(stdout). */
 int
 nle_fflush(FILE *stream)
@@ -372,6 +381,27 @@ nle_done(int how)
     nle->observation->how_done = how;
 }
 
+/* Called in topten() in topten.c. True if the logfile, xlogfile and record
+   files should be skipped as the entries are handed to the caller. */
+boolean
+nle_buffer_scores()
+{
+    return current_nle_ctx->observation->xlogentry != NULL;
+}
+
+/* Returns a stream writing into the caller's buffer for the (x)logfile
+   entry, or NULL. */
+FILE *
+nle_score_stream(int xlog)
+{
+    nle_obs *obs = current_nle_ctx->observation;
+    char *buf = xlog ? obs->xlogentry : obs->logentry;
+
+    if (!buf)
+        return NULL;
+    return fmemopen(buf, NLE_SCORE_ENTRY_SIZE, "w");
+}
+
 char *
 nle_ttyrecname()
 {
@@ -436,8 +466,7 @@ nle_start(nle_obs *obs, FILE *ttyrec, nle_settings *settings_p)
             /* See comment in `nle_step`. We record the score in line with
              * the state to ensure s,r -> a -> s', r'. These lines ensure
              * we don't skip the first reward. */
-            write_ttyrec_header(4, 2);
-            write_ttyrec_data(&obs->blstats[9], 4);
+            write_ttyrec_score(nle, obs);
         }
     }
 
@@ -473,12 +502,17 @@ nle_step(nle_ctx_t *nle, nle_obs *obs)
          * <step> ]). We chose the latter for compression & simplicity
          * reasons.
          *
+         * Since the score rarely changes between steps, we only write it
+         * when it differs from the last score written ("sparse scores").
+         * Readers carry the last score forward until the next channel 2
+         * record, so this stays compatible with version 3.
+         *
          * Note: blstats[9] == botl_score which is used for score/reward fns.
          * see winrl.cc
          */
-        if (obs->blstats) {
-            write_ttyrec_header(4, 2);
-            write_ttyrec_data(&obs->blstats[9], 4);
+        if (obs->blstats
+            && obs->blstats[NLE_BL_SCORE] != nle->ttyrec_score) {
+            write_ttyrec_score(nle, obs);
         }
     }
 
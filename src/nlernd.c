@@ -22,6 +22,15 @@ extern unsigned long NDECL(sys_random_seed);
 /* NLE settings contains the initial RNG seeds */
 extern nle_settings settings;
 
+unsigned long nle_seeds[] = { 0L, 0L, 0L };
+
+/* Seeds (core, disp) at the start of the game and whether NetHack was
+   allowed to reseed itself. Unlike nle_seeds, these are not overwritten
+   by reseeding. */
+static unsigned long nle_initial_seeds[] = { 0L, 0L };
+static boolean nle_initial_seeds_set[] = { FALSE, FALSE };
+static boolean nle_initial_reseed = FALSE;
+
 /*
  * Initializes the random number generator.
  * Originally in hacklib.c.
@@ -29,15 +38,23 @@ extern nle_settings settings;
 void
 init_random(int FDECL((*fn), (int) ))
 {
+    int rng = whichrng(fn);
+
     if (settings.initial_seeds.use_init_seeds) {
-        set_random(settings.initial_seeds.seeds[whichrng(fn)], fn);
+        set_random(settings.initial_seeds.seeds[rng], fn);
         has_strong_rngseed = settings.initial_seeds.reseed;
     } else {
         set_random(sys_random_seed(), fn);
     }
-}
 
-unsigned long nle_seeds[] = { 0L, 0L, 0L };
+    /* Remember the seeds the game started with, reseed_random() calls us
+       again later on. These get written to the xlogfile, see topten.c. */
+    if (!nle_initial_seeds_set[rng]) {
+        nle_initial_seeds[rng] = nle_seeds[rng];
+        nle_initial_seeds_set[rng] = TRUE;
+        nle_initial_reseed = has_strong_rngseed;
+    }
+}
 
 /* We define the number of dungeons explicitly here.
    NetHack works it out from the "dungeon.def" file,
@@ -165,4 +182,16 @@ nle_get_seed(nle_ctx_t *nle, unsigned long *core, unsigned long *disp,
     *reseed = has_strong_rngseed;
     *lgen = nle_seeds[2];
     *lgen_in_use = lgen_initialised;
-}
\ No newline at end of file
+}
+
+void
+nle_get_initial_seeds(unsigned long *core, unsigned long *disp,
+                      boolean *reseed, unsigned long *lgen,
+                      boolean *lgen_in_use)
+{
+    *core = nle_initial_seeds[0];
+    *disp = nle_initial_seeds[1];
+    *reseed = nle_initial_reseed;
+    *lgen = settings.initial_seeds.lgen_seed;
+    *lgen_in_use = settings.initial_seeds.use_lgen_seed;
+}
@@ -40,6 +40,11 @@ static long final_fpos;
 
 #define NLE_XLOG_INCLUDE_FILE
 extern char * FDECL(nle_ttyrecname, ());
+extern boolean NDECL(nle_buffer_scores);
+extern FILE * FDECL(nle_score_stream, (int));
+extern void FDECL(nle_get_initial_seeds,
+                  (unsigned long *, unsigned long *, boolean *,
+                   unsigned long *, boolean *));
 
 struct toptenentry {
     struct toptenentry *tt_next;
@@ -380,6 +385,18 @@ int how;
             aligns[1 - u.ualignbase[A_ORIGINAL]].filecode);
     Fprintf(rfile, "%cflags=0x%lx", XLOG_SEP, encodexlogflags());
 #ifdef NLE_XLOG_INCLUDE_FILE
+    {
+        /* Initial seeds, so recorded games can be re-simulated. */
+        unsigned long core, disp, lgen;
+        boolean reseed, lgen_in_use;
+
+        nle_get_initial_seeds(&core, &disp, &reseed, &lgen, &lgen_in_use);
+        Fprintf(rfile, "%ccoreseed=%lu%cdispseed=%lu%creseed=%d", XLOG_SEP,
+                core, XLOG_SEP, disp, XLOG_SEP, reseed ? 1 : 0);
+        if (lgen_in_use)
+            Fprintf(rfile, "%clgenseed=%lu", XLOG_SEP, lgen);
+    }
+    /* NB: ttyrecname must stay the last field, see populate_db.py. */
     if (nle_ttyrecname()[0] != '\0')
         Fprintf(rfile, "%cttyrecname=%s", XLOG_SEP, nle_ttyrecname());
 #endif
@@ -569,6 +586,26 @@ time_t when;
     t0->fpos = -1L;
 #endif
 
+#ifdef NLE_XLOG_INCLUDE_FILE
+    /* Hand the entries to NLE instead of locking and appending to the
+       files, and don't bother with the record (high score list). */
+    if (nle_buffer_scores()) {
+#ifdef LOGFILE
+        if ((lfile = nle_score_stream(FALSE)) != 0) {
+            writeentry(lfile, t0);
+            (void) fclose(lfile);
+        }
+#endif /* LOGFILE */
+#ifdef XLOGFILE
+        if ((xlfile = nle_score_stream(TRUE)) != 0) {
+            writexlentry(xlfile, t0, how);
+            (void) fclose(xlfile);
+        }
+#endif /* XLOGFILE */
+        goto showwin;
+    }
+#endif /* NLE_XLOG_INCLUDE_FILE */
+
 #ifdef LOGFILE /* used for debugging (who dies of what, where) */
     if (lock_file(LOGFILE, SCOREPREFIX, 10)) {
         if (!(lfile = fopen_datafile(LOGFILE, "a", SCOREPREFIX))) {
@@ -0,0 +1,383 @@
+/*
+ * Parallel decoding of the blocks of a bzip2 stream, see bzparallel.h.
+ *
+ * Each block is decoded on its own by wrapping it into a single-block stream:
+ * the file's "BZhN" header, the block's bits (starting with its magic number
+ * and CRC), the end-of-stream magic number and the block's CRC, which is the
+ * combined CRC of a stream with just that block. This is what bzip2recover
+ * does to salvage the blocks of damaged files.
+ */
+
+#include <bzlib.h>
+#include <limits.h>
+#include <pthread.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+
+#include "bzparallel.h"
+
+#define BLOCK_MAGIC 0x314159265359ULL
+#define EOS_MAGIC 0x177245385090ULL
+#define MAGIC_BITS 48
+#define CRC_BITS 32
+#define HEADER_BYTES 4 /* "BZh" and the block size digit. */
+
+enum { BLOCK_PENDING, BLOCK_DECODING, BLOCK_DONE, BLOCK_FAILED };
+
+typedef struct Block {
+  uint64_t start; /* Bit offset of the block's magic number. */
+  uint64_t end;   /* Bit offset of the next magic number. */
+  char *data;     /* Decompressed data, once decoded. */
+  size_t size;
+  int state;
+} Block;
+
+struct BzParallel {
+  unsigned char *input; /* The whole compressed file. */
+  size_t input_size;
+  int complete; /* Whether the first stream ends with its end-of-stream magic. */
+
+  Block *blocks;
+  size_t num_blocks;
+  size_t window; /* Number of blocks decoded ahead of the current one. */
+
+  size_t next;      /* Next block to decode. */
+  size_t current;   /* Block being read. */
+  size_t offset;    /* Read offset in the current block's data. */
+  size_t delivered; /* Bytes read so far. */
+
+  bz_stream *fallback; /* Sequential decoding once a block failed. */
+  size_t fallback_in;  /* Input bytes passed to `fallback` so far. */
+
+  pthread_t *threads;
+  int num_threads;
+  pthread_mutex_t mutex;
+  pthread_cond_t cond;
+  int stop;
+};
+
+/* Returns n <= 57 bits starting at bit `pos`, reading zeros past the end. */
+static uint64_t get_bits(const unsigned char *data, size_t size, uint64_t pos,
+                         int n) {
+  uint64_t v = 0;
+  size_t byte = pos / 8;
+  for (int i = 0; i < 8; ++i)
+    v = (v << 8) | (byte + i < size ? data[byte + i] : 0);
+  return (v << (pos % 8)) >> (64 - n);
+}
+
+/* Sets the n bits of `v` starting at bit `pos`, which need to be zero. */
+static void put_bits(unsigned char *data, uint64_t pos, uint64_t v, int n) {
+  for (int i = n - 1; i >= 0; --i, ++pos)
+    if ((v >> i) & 1) data[pos / 8] |= 0x80 >> (pos % 8);
+}
+
+static int add_block(BzParallel *p, uint64_t start, size_t *capacity) {
+  if (p->num_blocks == *capacity) {
+    Block *blocks = realloc(p->blocks, 2 * *capacity * sizeof(Block));
+    if (!blocks) return -1;
+    p->blocks = blocks;
+    *capacity *= 2;
+  }
+  if (p->num_blocks) p->blocks[p->num_blocks - 1].end = start;
+  p->blocks[p->num_blocks++] = (Block){start, 8 * (uint64_t)p->input_size,
+                                       NULL, 0, BLOCK_PENDING};
+  return 0;
+}
+
+/* Finds the blocks of the first stream. Magic numbers start at any bit, so
+ * instead of testing every bit offset, only test those where the byte after
+ * the magic number's first byte matches. */
+static int find_blocks(BzParallel *p) {
+  const unsigned char *d = p->input;
+  size_t size = p->input_size;
+  if (size < HEADER_BYTES || memcmp(d, "BZh", 3) != 0 || d[3] < '1' ||
+      d[3] > '9')
+    return -1;
+
+  unsigned char shifts[256] = {0};
+  for (int s = 0; s < 8; ++s) {
+    shifts[(BLOCK_MAGIC >> (32 + s)) & 0xFF] |= 1 << s;
+    shifts[(EOS_MAGIC >> (32 + s)) & 0xFF] |= 1 << s;
+  }
+
+  size_t capacity = 16;
+  p->blocks = malloc(capacity * sizeof(Block));
+  if (!p->blocks) return -1;
+  uint64_t total = 8 * (uint64_t)size;
+  for (size_t j = HEADER_BYTES + 1; j < size; ++j) {
+    unsigned char mask = shifts[d[j]];
+    for (int s = 0; mask && s < 8; ++s) {
+      if (!(mask & (1 << s))) continue;
+      uint64_t pos = 8 * (uint64_t)(j - 1) + s;
+      if (pos + MAGIC_BITS + CRC_BITS > total) return 0;
+      uint64_t magic = get_bits(d, size, pos, MAGIC_BITS);
+      if (magic == BLOCK_MAGIC) {
+        if (add_block(p, pos, &capacity) != 0) return -1;
+      } else if (magic == EOS_MAGIC) {
+        if (p->num_blocks) p->blocks[p->num_blocks - 1].end = pos;
+        p->complete = 1;
+        return 0;
+      }
+    }
+  }
+  return 0;
+}
+
+static int decode_block(const BzParallel *p, Block *b) {
+  uint64_t bits = b->end - b->start;
+  size_t body = (bits + 7) / 8;
+  size_t stream_size = HEADER_BYTES + body + (MAGIC_BITS + CRC_BITS) / 8 + 1;
+  if (stream_size > UINT_MAX) return -1;
+  unsigned char *stream = calloc(stream_size, 1);
+  if (!stream) return -1;
+
+  memcpy(stream, p->input, HEADER_BYTES);
+  size_t src = b->start / 8;
+  int shift = b->start % 8;
+  for (size_t i = 0; i < body; ++i) {
+    unsigned hi = p->input[src + i] << shift;
+    unsigned lo = 0;
+    if (shift && src + i + 1 < p->input_size)
+      lo = p->input[src + i + 1] >> (8 - shift);
+    stream[HEADER_BYTES + i] = (hi | lo) & 0xFF;
+  }
+  if (bits % 8) stream[HEADER_BYTES + body - 1] &= 0xFF << (8 - bits % 8);
+  uint64_t pos = 8 * HEADER_BYTES + bits;
+  uint64_t crc = get_bits(p->input, p->input_size, b->start + MAGIC_BITS,
+                          CRC_BITS);
+  put_bits(stream, pos, EOS_MAGIC, MAGIC_BITS);
+  put_bits(stream, pos + MAGIC_BITS, crc, CRC_BITS);
+
+  bz_stream strm;
+  memset(&strm, 0, sizeof(strm));
+  if (BZ2_bzDecompressInit(&strm, 0, 0) != BZ_OK) {
+    free(stream);
+    return -1;
+  }
+  strm.next_in = (char *)stream;
+  strm.avail_in = (pos + MAGIC_BITS + CRC_BITS + 7) / 8;
+
+  size_t capacity = 1 << 20;
+  char *out = malloc(capacity);
+  int ret = BZ_MEM_ERROR;
+  while (out) {
+    size_t n = strm.next_out ? (size_t)(strm.next_out - out) : 0;
+    if (n == capacity) {
+      char *grown = capacity < UINT_MAX / 2 ? realloc(out, 2 * capacity) : NULL;
+      if (!grown) {
+        ret = BZ_MEM_ERROR;
+        break;
+      }
+      out = grown;
+      capacity *= 2;
+    }
+    strm.next_out = out + n;
+    strm.avail_out = capacity - n;
+    ret = BZ2_bzDecompress(&strm);
+    if (ret != BZ_OK) break;
+    if (strm.avail_out > 0 && strm.avail_in == 0) {
+      ret = BZ_UNEXPECTED_EOF;
+      break;
+    }
+  }
+  BZ2_bzDecompressEnd(&strm);
+  free(stream);
+  if (ret != BZ_STREAM_END) {
+    free(out);
+    return -1;
+  }
+  b->data = out;
+  b->size = strm.next_out - out;
+  return 0;
+}
+
+static void *worker(void *arg) {
+  BzParallel *p = arg;
+  pthread_mutex_lock(&p->mutex);
+  while (!p->stop) {
+    if (p->next < p->num_blocks && p->next < p->current + p->window) {
+      Block *b = &p->blocks[p->next++];
+      b->state = BLOCK_DECODING;
+      pthread_mutex_unlock(&p->mutex);
+      int status = decode_block(p, b);
+      pthread_mutex_lock(&p->mutex);
+      b->state = (status == 0) ? BLOCK_DONE : BLOCK_FAILED;
+      pthread_cond_broadcast(&p->cond);
+    } else {
+      pthread_cond_wait(&p->cond, &p->mutex);
+    }
+  }
+  pthread_mutex_unlock(&p->mutex);
+  return NULL;
+}
+
+static void stop_threads(BzParallel *p) {
+  pthread_mutex_lock(&p->mutex);
+  p->stop = 1;
+  pthread_cond_broadcast(&p->cond);
+  pthread_mutex_unlock(&p->mutex);
+  for (int i = 0; i < p->num_threads; ++i) pthread_join(p->threads[i], NULL);
+  p->num_threads = 0;
+}
+
+/* Reads like BZ2_bzRead from the sequential fallback decoder. */
+static int fallback_read(int *bzerror, BzParallel *p, char *buf, size_t len) {
+  bz_stream *strm = p->fallback;
+  strm->next_out = buf;
+  strm->avail_out = len;
+  while (1) {
+    if (strm->avail_in == 0) {
+      size_t n = p->input_size - p->fallback_in;
+      if (n > INT_MAX) n = INT_MAX;
+      strm->next_in = (char *)p->input + p->fallback_in;
+      strm->avail_in = n;
+      p->fallback_in += n;
+    }
+    int ret = BZ2_bzDecompress(strm);
+    if (ret != BZ_OK) {
+      *bzerror = ret;
+      break;
+    }
+    if (strm->avail_out == 0) {
+      *bzerror = BZ_OK;
+      break;
+    }
+    if (strm->avail_in == 0 && p->fallback_in == p->input_size) {
+      *bzerror = BZ_UNEXPECTED_EOF;
+      break;
+    }
+  }
+  return len - strm->avail_out;
+}
+
+/* Decodes the stream sequentially from its start, skipping the bytes that
+ * were read already. */
+static int start_fallback(BzParallel *p) {
+  stop_threads(p);
+  p->fallback = calloc(1, sizeof(bz_stream));
+  if (!p->fallback) return BZ_MEM_ERROR;
+  int ret = BZ2_bzDecompressInit(p->fallback, 0, 0);
+  if (ret != BZ_OK) {
+    free(p->fallback);
+    p->fallback = NULL;
+    return ret;
+  }
+  char skipped[1 << 16];
+  for (size_t left = p->delivered; left > 0;) {
+    size_t n = left < sizeof(skipped) ? left : sizeof(skipped);
+    int bzerror;
+    if (fallback_read(&bzerror, p, skipped, n) != (int)n) return bzerror;
+    left -= n;
+  }
+  return BZ_OK;
+}
+
+BzParallel *bzp_open(FILE *f, int num_threads) {
+  BzParallel *p = calloc(1, sizeof(BzParallel));
+  if (!p) return NULL;
+
+  size_t capacity = 1 << 20;
+  p->input = malloc(capacity);
+  while (p->input) {
+    p->input_size += fread(p->input + p->input_size, 1,
+                           capacity - p->input_size, f);
+    if (p->input_size < capacity) break;
+    unsigned char *grown = realloc(p->input, 2 * capacity);
+    if (!grown) {
+      free(p->input);
+      p->input = NULL;
+      break;
+    }
+    p->input = grown;
+    capacity *= 2;
+  }
+  if (!p->input || ferror(f) || find_blocks(p) != 0) {
+    free(p->input);
+    free(p->blocks);
+    free(p);
+    return NULL;
+  }
+
+  pthread_mutex_init(&p->mutex, NULL);
+  pthread_cond_init(&p->cond, NULL);
+  if (num_threads < 1) num_threads = 1;
+  p->window = 2 * num_threads;
+  if (!p->complete) {
+    /* Truncated or damaged: Report its errors like BZ2_bzRead. */
+    start_fallback(p);
+    return p;
+  }
+  if ((size_t)num_threads > p->num_blocks) num_threads = p->num_blocks;
+  p->threads = malloc(num_threads * sizeof(pthread_t));
+  for (int i = 0; p->threads && i < num_threads; ++i) {
+    if (pthread_create(&p->threads[p->num_threads], NULL, worker, p) == 0)
+      ++p->num_threads;
+  }
+  if (p->num_threads == 0) start_fallback(p);
+  return p;
+}
+
+int bzp_read(int *bzerror, BzParallel *p, void *buf, int len) {
+  char *dst = buf;
+  size_t n = 0;
+  while (n < (size_t)len && !p->fallback && p->current < p->num_blocks) {
+    Block *b = &p->blocks[p->current];
+    pthread_mutex_lock(&p->mutex);
+    while (b->state == BLOCK_PENDING || b->state == BLOCK_DECODING)
+      pthread_cond_wait(&p->cond, &p->mutex);
+    pthread_mutex_unlock(&p->mutex);
+    if (b->state == BLOCK_FAILED) {
+      int ret = start_fallback(p);
+      if (ret != BZ_OK) {
+        *bzerror = ret;
+        return n;
+      }
+      break;
+    }
+
+    size_t k = b->size - p->offset;
+    if (k > len - n) k = len - n;
+    memcpy(dst + n, b->data + p->offset, k);
+    n += k;
+    p->offset += k;
+    p->delivered += k;
+    if (p->offset == b->size) {
+      free(b->data);
+      b->data = NULL;
+      p->offset = 0;
+      pthread_mutex_lock(&p->mutex);
+      ++p->current;
+      pthread_cond_broadcast(&p->cond);
+      pthread_mutex_unlock(&p->mutex);
+    }
+  }
+
+  if (p->fallback) {
+    int m = (n < (size_t)len) ? fallback_read(bzerror, p, dst + n, len - n) : 0;
+    if (n == (size_t)len) *bzerror = BZ_OK;
+    p->delivered += m;
+    return n + m;
+  }
+  *bzerror = (p->current == p->num_blocks) ? BZ_STREAM_END : BZ_OK;
+  return n;
+}
+
+size_t bzp_num_blocks(BzParallel *p) { return p->num_blocks; }
+
+void bzp_close(BzParallel *p) {
+  if (!p) return;
+  stop_threads(p);
+  pthread_mutex_destroy(&p->mutex);
+  pthread_cond_destroy(&p->cond);
+  for (size_t i = 0; i < p->num_blocks; ++i) free(p->blocks[i].data);
+  if (p->fallback) {
+    BZ2_bzDecompressEnd(p->fallback);
+    free(p->fallback);
+  }
+  free(p->threads);
+  free(p->blocks);
+  free(p->input);
+  free(p);
+}
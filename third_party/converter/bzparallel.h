@@ -0,0 +1,39 @@
+#ifndef BZPARALLEL_H
+#define BZPARALLEL_H
+
+#include <stdio.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+/* Decompresses the blocks of a bzip2 file on a pool of threads.
+ *
+ * bzip2 compresses data in independent blocks of up to 900 kB, each starting
+ * with a 48 bit magic number at an arbitrary bit offset. BzParallel reads the
+ * whole compressed file, finds the blocks of its first stream and decodes up
+ * to `window` of them ahead of the reader, handing out their data in order.
+ * If a block can't be decoded on its own (eg because the magic number also
+ * appears inside compressed data), it falls back to decoding the stream
+ * sequentially from its start. */
+typedef struct BzParallel BzParallel;
+
+/* Reads the rest of `f`. Returns NULL if it isn't a bzip2 file or on
+ * allocation failure. */
+BzParallel *bzp_open(FILE *f, int num_threads);
+
+/* Like BZ2_bzRead: Reads up to `len` bytes into `buf` and returns their
+ * number. Sets `*bzerror` to BZ_STREAM_END if the read reached the end of the
+ * stream, to BZ_OK if there is more, or to an error code. */
+int bzp_read(int *bzerror, BzParallel *p, void *buf, int len);
+
+/* Returns the number of blocks found in the stream. */
+size_t bzp_num_blocks(BzParallel *p);
+
+void bzp_close(BzParallel *p);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif /* BZPARALLEL_H */
@@ -18,14 +18,22 @@
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/stat.h>
 #include <sys/time.h>
 #include <unistd.h>
+#include <zlib.h>
 
+#include "bzparallel.h"
+#include "status.h"
 #include "stripgfx.h"
 #include "tmt.h"
 
 #include "converter.h"
 
+/* Ttyrecs smaller than this are decoded sequentially: They have few bzip2
+ * blocks, so there is little to gain from decoding these in parallel. */
+#define PARALLEL_MIN_SIZE (1 << 20)
+
 #define UNUSED(x) (void)(x)
 
 /* Callback for libtmt. */
@@ -118,10 +126,41 @@ vt_char_color_extract(TMTCHAR *c)
 }
 
 
-int read_header(BZFILE *bfp, Header *h, size_t version) {
+/* Like BZ2_bzRead for gzip-compressed ttyrecs (see nle/dataset/transcode.py),
+ * including reporting the end of the stream along with its last bytes, so
+ * that both formats convert to the same frames. */
+static int gz_read(int *bzerror, gzFile gz, void *buf, int len) {
+  int length = gzread(gz, buf, len);
+  int zerror;
+  gzerror(gz, &zerror);
+  if (length < 0 || (zerror != Z_OK && zerror != Z_BUF_ERROR)) {
+    *bzerror = BZ_IO_ERROR;
+    return length < 0 ? 0 : length;
+  }
+  if (length < len && zerror == Z_BUF_ERROR) {
+    *bzerror = BZ_UNEXPECTED_EOF; /* Truncated file. */
+    return length;
+  }
+  int next = gzgetc(gz);
+  if (next == -1) {
+    *bzerror = BZ_STREAM_END;
+  } else {
+    gzungetc(next, gz);
+    *bzerror = BZ_OK;
+  }
+  return length;
+}
+
+int conversion_read(Conversion *c, int *bzerror, void *buf, int len) {
+  if (c->gz) return gz_read(bzerror, c->gz, buf, len);
+  if (c->pbz) return bzp_read(bzerror, c->pbz, buf, len);
+  return BZ2_bzRead(bzerror, c->bfp, buf, len);
+}
+
+int read_header(Conversion *c, Header *h, size_t version) {
   int buf[3];
   int bzerror;
-  BZ2_bzRead(&bzerror, bfp, buf, sizeof(int) * 3);
+  conversion_read(c, &bzerror, buf, sizeof(int) * 3);
   if (bzerror != BZ_OK) {
     /* This could be BZ_STREAM_END, the logical end of a stream.
        We still stop in that case. */
@@ -137,7 +176,7 @@ int read_header(BZFILE *bfp, Header *h, size_t version) {
   if (version > 1) {
     /* NLE-based ttyrecs read have single-byte "channel" which codifies what 
     kind of information one is in the buffer. Here we read into the channel. */
-    BZ2_bzRead(&bzerror, bfp, &h->channel, 1);
+    conversion_read(c, &bzerror, &h->channel, 1);
     if (bzerror != BZ_OK) {
       if (bzerror == BZ_STREAM_END) return CONV_STREAM_END;
       return CONV_HEADER_ERROR;
@@ -155,8 +194,8 @@ int read_header(BZFILE *bfp, Header *h, size_t version) {
   return CONV_OK;
 }
 
-int ttyread(BZFILE *bfp, Header *h, char **buf, size_t version) {
-  int status = read_header(bfp, h, version);
+int ttyread(Conversion *c, Header *h, char **buf, size_t version) {
+  int status = read_header(c, h, version);
   if (status != CONV_OK) {
     return status;
   }
@@ -168,7 +207,7 @@ int ttyread(BZFILE *bfp, Header *h, char **buf, size_t version) {
   }
 
   int bzerror;
-  int length = BZ2_bzRead(&bzerror, bfp, *buf, h->len);
+  int length = conversion_read(c, &bzerror, *buf, h->len);
   if (bzerror != BZ_OK || length != h->len) {
     if (bzerror == BZ_STREAM_END) return CONV_STREAM_END;
     fprintf(stderr, "bzRead failed with return code %d (read %d bytes)\n",
@@ -194,14 +233,28 @@ Conversion *conversion_create(size_t rows, size_t cols, size_t term_rows,
   if (!term_rows) term_rows = rows;
   if (!term_cols) term_cols = cols;
   assert(rows <= term_rows && cols <= term_cols);
+  c->term_rows = term_rows;
+  c->term_cols = term_cols;
+  c->row_offset = 0;
+  c->col_offset = 0;
   c->chars = (UnsignedCharPtr){0};
   c->colors = (SignedCharPtr){0};
   c->cursors = (Int16Ptr){0};
   c->timestamps = (Int64Ptr){0};
   c->inputs = (UnsignedCharPtr){0};
   c->scores = (Int32Ptr){0};
+  c->blstats = (Int64Ptr){0};
+  c->message = (UnsignedCharPtr){0};
   c->remaining = 0;
+  c->scanning = 1; /* No buffers to convert into yet. */
+  c->score = 0;
   c->buf = NULL;
+  memset(c->last_blstats, 0, sizeof(c->last_blstats));
+  c->status_lines = malloc(3 * term_cols);
+  if (!c->status_lines) {
+    free(c);
+    return NULL;
+  }
   bool wrap = (version != 1);
   if (!wrap) {
     /* For old ttyrecs where we don't wrap, we make cols one character wider.
@@ -212,10 +265,14 @@ Conversion *conversion_create(size_t rows, size_t cols, size_t term_rows,
   c->vt = tmt_open(term_rows, term_cols, callback, c, NULL, wrap);
   if (!c->vt) {
     perror("could not allocate terminal");
+    free(c->status_lines);
     free(c);
     return NULL;
   }
   c->bfp = NULL;
+  c->pbz = NULL;
+  c->gz = NULL;
+  c->decode_threads = 1;
   return c;
 }
 
@@ -225,13 +282,29 @@ void conversion_set_buffers(Conversion *c, unsigned char *chars, size_t chars_si
                             int64_t *timestamps, size_t timestamps_size,
                             unsigned char *inputs, size_t inputs_size,
                             int32_t *scores, size_t scores_size) {
-  assert(chars_size % (c->rows * c->cols) == 0);
-  c->remaining = chars_size / (c->rows * c->cols);
-
-  assert(cursors_size % 2 == 0);
-  assert(cursors_size / 2 == c->remaining);
-
-  assert(timestamps_size == c->remaining);
+  /* Buffers may be NULL to not write their channel. The others all hold
+   * the same number of frames. */
+  const size_t frame = c->rows * c->cols;
+  if (chars)
+    c->remaining = chars_size / frame;
+  else if (colors)
+    c->remaining = colors_size / frame;
+  else if (cursors)
+    c->remaining = cursors_size / 2;
+  else if (timestamps)
+    c->remaining = timestamps_size;
+  else if (inputs)
+    c->remaining = inputs_size;
+  else
+    c->remaining = scores ? scores_size : 0;
+
+  assert(!chars || chars_size == c->remaining * frame);
+  assert(!colors || colors_size == c->remaining * frame);
+  assert(!cursors || cursors_size == c->remaining * 2);
+  assert(!timestamps || timestamps_size == c->remaining);
+  assert(!inputs || inputs_size == c->remaining);
+  assert(!scores || scores_size == c->remaining);
+  c->scanning = 0;
 
   c->chars = (UnsignedCharPtr){chars, chars, chars + chars_size};
   c->colors = (SignedCharPtr){colors, colors, colors + colors_size};
@@ -242,12 +315,107 @@ void conversion_set_buffers(Conversion *c, unsigned char *chars, size_t chars_si
       (UnsignedCharPtr){inputs, inputs, inputs + inputs_size};
   c->scores =
       (Int32Ptr){scores, scores, scores + scores_size};
+  c->blstats = (Int64Ptr){0};
+  c->message = (UnsignedCharPtr){0};
+}
+
+/* Forgets the blstats carried forward, eg before the first ttyrec of a game.
+ * Like the terminal, they carry over from one ttyrec to the next otherwise. */
+void conversion_reset_status(Conversion *c) {
+  memset(c->last_blstats, 0, sizeof(c->last_blstats));
+}
+
+/* Sets buffers for the status lines parsed into NetHack's blstats and for
+ * the top line message, for `size` frames, see status.h. Either may be NULL.
+ * Call after conversion_set_buffers, which unsets them. */
+void conversion_set_status_buffers(Conversion *c, int64_t *blstats,
+                                   unsigned char *message, size_t size) {
+  if (!c->chars.ptr && !c->colors.ptr && !c->cursors.ptr &&
+      !c->timestamps.ptr && !c->inputs.ptr && !c->scores.ptr)
+    c->remaining = size; /* The only buffers. */
+  assert(size == c->remaining);
+  size_t blstats_size = blstats ? size * STATUS_BLSTATS_SIZE : 0;
+  size_t message_size = message ? size * STATUS_MESSAGE_SIZE : 0;
+  c->blstats = (Int64Ptr){blstats, blstats, blstats + blstats_size};
+  c->message = (UnsignedCharPtr){message, message, message + message_size};
+}
+
+/* Sets buffers for conversion_scan_frames, which only writes timestamps,
+ * inputs and scores. */
+void conversion_set_scan_buffers(Conversion *c, int64_t *timestamps,
+                                 unsigned char *inputs, int32_t *scores,
+                                 size_t size) {
+  c->remaining = size;
+  c->scanning = 1;
+  c->chars = (UnsignedCharPtr){0};
+  c->colors = (SignedCharPtr){0};
+  c->cursors = (Int16Ptr){0};
+  c->timestamps = (Int64Ptr){timestamps, timestamps, timestamps + size};
+  c->inputs = (UnsignedCharPtr){inputs, inputs, inputs + size};
+  c->scores = (Int32Ptr){scores, scores, scores + size};
+  c->blstats = (Int64Ptr){0};
+  c->message = (UnsignedCharPtr){0};
+}
+
+/* Decode ttyrecs of at least PARALLEL_MIN_SIZE bytes with `decode_threads`
+ * threads, see bzparallel.h. Applies from the next conversion_load_ttyrec. */
+void conversion_set_decode_threads(Conversion *c, int decode_threads) {
+  c->decode_threads = decode_threads;
+}
+
+/* Returns the terminal's rows and columns from `row_offset` and `col_offset`
+ * on, instead of from its top left corner. Fails with -1 if the returned
+ * rows and columns don't fit into the terminal. */
+int conversion_set_window(Conversion *c, size_t row_offset, size_t col_offset) {
+  if (row_offset + c->rows > c->term_rows ||
+      col_offset + c->cols > c->term_cols)
+    return -1;
+  c->row_offset = row_offset;
+  c->col_offset = col_offset;
+  return 0;
 }
 
 int conversion_load_ttyrec(Conversion *c, FILE *f) {
   int bzerror;
   if (c->bfp) {
     BZ2_bzReadClose(&bzerror, c->bfp);
+    c->bfp = NULL;
+  }
+  if (c->pbz) {
+    bzp_close(c->pbz);
+    c->pbz = NULL;
+  }
+  if (c->gz) {
+    gzclose(c->gz);
+    c->gz = NULL;
+  }
+
+  unsigned char magic[2];
+  size_t n = fread(magic, 1, sizeof(magic), f);
+  rewind(f);
+  if (n == sizeof(magic) && magic[0] == 0x1f && magic[1] == 0x8b) {
+    /* zlib reads from the file descriptor, which gzclose closes. */
+    int fd = dup(fileno(f));
+    if (fd >= 0 && lseek(fd, 0, SEEK_SET) == 0) c->gz = gzdopen(fd, "rb");
+    if (!c->gz) {
+      perror("Could not open gzip file");
+      if (fd >= 0) close(fd);
+      return EXIT_FAILURE;
+    }
+    gzbuffer(c->gz, 1 << 16);
+    c->score = 0;
+    return EXIT_SUCCESS;
+  }
+
+  struct stat st;
+  if (c->decode_threads > 1 && fstat(fileno(f), &st) == 0 &&
+      st.st_size >= PARALLEL_MIN_SIZE) {
+    c->pbz = bzp_open(f, c->decode_threads);
+    if (c->pbz) {
+      c->score = 0;
+      return EXIT_SUCCESS;
+    }
+    rewind(f); /* Not a bzip2 file: Let bzlib report it. */
   }
 
   c->bfp = BZ2_bzReadOpen(&bzerror, f, 0, 1, NULL, 0);
@@ -256,6 +424,7 @@ int conversion_load_ttyrec(Conversion *c, FILE *f) {
     BZ2_bzReadClose(&bzerror, c->bfp);
     return EXIT_FAILURE;
   }
+  c->score = 0;
   return EXIT_SUCCESS;
 }
 
@@ -263,12 +432,13 @@ void write_to_buffers(Conversion *conv);
 
 /* Returns 1 at end of buffer, 0 at end of input, -1 on failure. */
 int conversion_convert_frames(Conversion *c) {
-  if (!c->bfp || !c->chars.cur) return CONV_CRITICAL_ERROR;
+  if ((!c->bfp && !c->pbz && !c->gz) || c->scanning)
+    return CONV_CRITICAL_ERROR;
 
   int status = CONV_OK;
 
   while (c->remaining) {
-    status = ttyread(c->bfp, &c->header, &c->buf, c->version);
+    status = ttyread(c, &c->header, &c->buf, c->version);
     if (status != CONV_OK) break;
 
     if (c->version > 1){
@@ -279,13 +449,17 @@ int conversion_convert_frames(Conversion *c) {
        * V2: [0 1 0 1 ...]
        *     Channel 0 -> update terminal/state
        *     Channel 1 -> we have an action: write state + action to buffers
-       * V3: [0 2 1 0 2 1 ...]
+       * V3: [0 2 1 0 2 1 ...] or, with sparse scores, [0 2 1 0 1 0 2 1 ...]
        *     Channel 0 -> update terminal/state
-       *     Channel 2 -> we have an reward: write reward only
-       *     Channel 1 -> we have an action: write state + action to buffers 
-       * NB. Will only end up writing when an action is given. */
+       *     Channel 2 -> we have an reward: remember it, write nothing
+       *     Channel 1 -> we have an action: write state + action + last
+       *                  reward to buffers
+       * NB. Will only end up writing when an action is given. The score is
+       * carried forward, so channel 2 only needs writing when it changes. */
       if (c->header.channel == 0) {
         tmt_write(c->vt, c->buf, c->header.len);
+      } else if (c->header.channel == 2) {
+        memcpy(&c->score, c->buf, sizeof(c->score));
       } else {
         write_to_buffers(c);
       }
@@ -301,35 +475,144 @@ int conversion_convert_frames(Conversion *c) {
   return status;
 }
 
+/* Like conversion_convert_frames, but only updates the terminal and score
+ * for `frames` frames, without writing them to the buffers. Sets
+ * c->remaining to the number of frames not skipped. */
+int conversion_skip_frames(Conversion *c, size_t frames) {
+  if (!c->bfp && !c->pbz && !c->gz) return CONV_CRITICAL_ERROR;
+
+  int status = CONV_OK;
+  c->remaining = frames;
+
+  while (c->remaining) {
+    status = ttyread(c, &c->header, &c->buf, c->version);
+    if (status != CONV_OK) break;
+
+    if (c->version > 1) {
+      if (c->header.channel == 0) {
+        tmt_write(c->vt, c->buf, c->header.len);
+      } else if (c->header.channel == 2) {
+        memcpy(&c->score, c->buf, sizeof(c->score));
+      } else {
+        --c->remaining;
+      }
+    } else {
+      tmt_write(c->vt, c->buf, c->header.len);
+      --c->remaining;
+    }
+  }
+
+  return status;
+}
+
+/* Like conversion_convert_frames, but without emulating the terminal: Only
+ * reads the headers and the action and score channels, and writes the
+ * timestamp, input and score of each frame. Terminal output is decompressed
+ * but otherwise ignored, so this is much faster than converting. */
+int conversion_scan_frames(Conversion *c) {
+  if ((!c->bfp && !c->pbz && !c->gz) || !c->timestamps.cur)
+    return CONV_CRITICAL_ERROR;
+
+  int status = CONV_OK;
+
+  while (c->remaining) {
+    status = ttyread(c, &c->header, &c->buf, c->version);
+    if (status != CONV_OK) break;
+
+    if (c->version > 1) {
+      if (c->header.channel == 2) {
+        memcpy(&c->score, c->buf, sizeof(c->score));
+        continue;
+      } else if (c->header.channel != 1) {
+        continue;
+      }
+      *c->inputs.cur++ = c->buf[0];
+      *c->scores.cur++ = c->score;
+    } else {
+      *c->inputs.cur++ = 0;
+      *c->scores.cur++ = 0;
+    }
+    int64_t usec = 1000000 * (int64_t)c->header.tv.tv_sec;
+    *c->timestamps.cur++ = usec + (int64_t)c->header.tv.tv_usec;
+    --c->remaining;
+  }
+
+  return status;
+}
+
+/* Writes the current frame to the buffers that are set. */
 void write_to_buffers(Conversion *conv) {
   if (conv->version > 1)  {
-    if (conv->header.channel == 2) {
-      /* V3: Write just the reward. Do not write the screen. */
-      memcpy(conv->scores.cur++, conv->buf, sizeof(*conv->scores.cur));
-      return;
-    }
     if (conv->header.channel == 1) {
       /* V2: Write the action, then continue to flush the screen too. */
-      *conv->inputs.cur++ = conv->buf[0];
+      if (conv->inputs.ptr) *conv->inputs.cur++ = conv->buf[0];
+      /* V3: Write the most recent reward alongside the action. */
+      if (conv->scores.ptr) *conv->scores.cur++ = conv->score;
     }
   }
-  
-  const TMTSCREEN *scr = tmt_screen(conv->vt);
-  for (size_t r = 0; r < conv->rows; ++r) {
-    for (size_t c = 0; c < conv->cols; ++c) {
-      assert(conv->chars.cur < conv->chars.end);
-      assert(scr->lines[r]->chars[c].c < 256);
-      *conv->chars.cur++ = strip_gfx(scr->lines[r]->chars[c].c, scr->lines[r]->chars[c].a.dec);
-      *conv->colors.cur++ = vt_char_color_extract(&(scr->lines[r]->chars[c]));
+
+  if (conv->chars.ptr || conv->colors.ptr) {
+    const TMTSCREEN *scr = tmt_screen(conv->vt);
+    for (size_t r = 0; r < conv->rows; ++r) {
+      TMTCHAR *line =
+          scr->lines[conv->row_offset + r]->chars + conv->col_offset;
+      if (conv->chars.ptr) {
+        assert(conv->chars.cur + conv->cols <= conv->chars.end);
+        for (size_t c = 0; c < conv->cols; ++c) {
+          assert(line[c].c < 256);
+          *conv->chars.cur++ = strip_gfx(line[c].c, line[c].a.dec);
+        }
+      }
+      if (conv->colors.ptr) {
+        for (size_t c = 0; c < conv->cols; ++c)
+          *conv->colors.cur++ = vt_char_color_extract(&line[c]);
+      }
     }
   }
 
-  const TMTPOINT *cur = tmt_cursor(conv->vt);
-  *conv->cursors.cur++ = cur->r;
-  *conv->cursors.cur++ = cur->c;
+  if (conv->cursors.ptr) {
+    /* In terminal coordinates, even if the window doesn't start at 0, 0. */
+    const TMTPOINT *cur = tmt_cursor(conv->vt);
+    *conv->cursors.cur++ = cur->r;
+    *conv->cursors.cur++ = cur->c;
+  }
+
+  if (conv->blstats.ptr || conv->message.ptr) {
+    /* Parsed from the whole terminal, even if the window doesn't hold the
+     * top and status lines. */
+    const TMTSCREEN *scr = tmt_screen(conv->vt);
+    const TMTPOINT *cur = tmt_cursor(conv->vt);
+    const size_t cols = conv->term_cols;
+    const size_t status = status_row(conv->term_rows);
+    const size_t rows[3] = {0, status, status + 1};
+    for (size_t i = 0; i < 3; ++i) {
+      const TMTCHAR *line = scr->lines[rows[i]]->chars;
+      for (size_t c = 0; c < cols; ++c)
+        conv->status_lines[i * cols + c] = strip_gfx(line[c].c, line[c].a.dec);
+    }
+    int64_t *blstats = conv->blstats.cur;
+    unsigned char *message = conv->message.cur;
+    if (blstats) {
+      assert(blstats + STATUS_BLSTATS_SIZE <= conv->blstats.end);
+      conv->blstats.cur += STATUS_BLSTATS_SIZE;
+    }
+    if (message) {
+      assert(message + STATUS_MESSAGE_SIZE <= conv->message.end);
+      conv->message.cur += STATUS_MESSAGE_SIZE;
+    }
+    const TMTCHAR *at_cursor = &scr->lines[cur->r]->chars[cur->c];
+    status_parse(conv->status_lines, conv->status_lines + cols,
+                 conv->status_lines + 2 * cols, cols, cur->r, cur->c,
+                 strip_gfx(at_cursor->c, at_cursor->a.dec),
+                 conv->last_blstats, blstats, message);
+    if (blstats)
+      memcpy(conv->last_blstats, blstats, sizeof(conv->last_blstats));
+  }
 
-  int64_t usec = 1000000 * (int64_t)conv->header.tv.tv_sec;
-  *conv->timestamps.cur++ = usec + (int64_t)conv->header.tv.tv_usec;
+  if (conv->timestamps.ptr) {
+    int64_t usec = 1000000 * (int64_t)conv->header.tv.tv_sec;
+    *conv->timestamps.cur++ = usec + (int64_t)conv->header.tv.tv_usec;
+  }
 
   --conv->remaining;
 
@@ -345,7 +628,10 @@ int conversion_close(Conversion *c) {
     int bzerror;
     BZ2_bzReadClose(&bzerror, c->bfp);
   }
+  bzp_close(c->pbz);
+  if (c->gz) gzclose(c->gz);
   if (c->buf) free(c->buf);
+  free(c->status_lines);
   free(c);
   return EXIT_SUCCESS;
 }
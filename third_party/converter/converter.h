@@ -62,18 +62,31 @@ typedef struct Conversion {
   size_t term_rows; /* Number of terminal (rendered) rows. */
   size_t term_cols; /* Number of terminal (rendered) columns. */
 
+  size_t row_offset; /* First terminal row returned. */
+  size_t col_offset; /* First terminal column returned. */
+
   UnsignedCharPtr chars;       /* Array to fill chars in */
   SignedCharPtr colors; /* Array to fill colors in */
   Int16Ptr cursors;    /* Array to fill current cursor positions in */
   Int64Ptr timestamps; /* Array to fill timestamp values in */
   UnsignedCharPtr inputs; /* Array to fill inputs values in */
   Int32Ptr scores; /* Array to fill in-game score values in */
+  Int64Ptr blstats; /* Array to fill status lines parsed into blstats in */
+  UnsignedCharPtr message; /* Array to fill top line messages in */
+  unsigned char *status_lines; /* Top and status lines, for status_parse. */
+  int64_t last_blstats[27]; /* Most recently parsed blstats (carried forward). */
 
   size_t remaining; /* Remaining (free) number of frames in buffers */
+  int scanning; /* Whether the buffers are for conversion_scan_frames. */
+
+  int32_t score; /* Most recently read in-game score (carried forward). */
 
   Header header; /* Most recently read header. */
 
   void *bfp; /* Pointer to current ttyrec BZFILE. */
+  void *pbz; /* Or to its BzParallel, see conversion_set_decode_threads. */
+  void *gz;  /* Or to its gzFile, for gzip-compressed ttyrecs. */
+  int decode_threads; /* Threads decoding large ttyrecs. */
   char *buf; /* Buffer for read data. */
 } Conversion;
 
@@ -85,8 +98,18 @@ void conversion_set_buffers(Conversion *c, unsigned char *chars, size_t chars_si
                             int64_t *timestamps, size_t timestamps_size,
                             unsigned char *inputs, size_t inputs_size,
                             int32_t *scores, size_t scores_size);
+void conversion_reset_status(Conversion *c);
+void conversion_set_status_buffers(Conversion *c, int64_t *blstats,
+                                   unsigned char *message, size_t size);
+void conversion_set_scan_buffers(Conversion *c, int64_t *timestamps,
+                                 unsigned char *inputs, int32_t *scores,
+                                 size_t size);
+void conversion_set_decode_threads(Conversion *c, int decode_threads);
+int conversion_set_window(Conversion *c, size_t row_offset, size_t col_offset);
 int conversion_load_ttyrec(Conversion *c, FILE *f);
 int conversion_convert_frames(Conversion *c);
+int conversion_skip_frames(Conversion *c, size_t frames);
+int conversion_scan_frames(Conversion *c);
 int conversion_close(Conversion *c);
 
 #ifdef __cplusplus
@@ -0,0 +1,497 @@
+/*
+ *  Seekable ttyrec reader.
+ *
+ *  Reads (optionally bzip2- or gzip-compressed) ttyrecs record by record,
+ *  feeding terminal output into libtmt. A per-record index built in a single
+ *  pass allows seeking: Since the screen can't be restored cheaply, seeking
+ *  resumes rendering from the last record that cleared the screen ("key
+ *  frame") before the target, skipping everything before it unrendered. The
+ *  index keeps the remaining terminal state (cursor, attributes, character
+ *  set) before each key frame, as clearing the screen doesn't reset it.
+ */
+
+#include <assert.h>
+#include <bzlib.h>
+#include <errno.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/stat.h>
+#include <unistd.h>
+#include <zlib.h>
+
+#include "stripgfx.h"
+#include "tmt.h"
+
+#include "player.h"
+
+#define UNUSED(x) (void)(x)
+
+#define INDEX_MAGIC "NLETTYX3"
+#define SKIP_CHUNK 65536
+
+/* See converter.c. */
+signed char vt_char_color_extract(TMTCHAR *c);
+
+static void player_callback(tmt_msg_t m, TMT *vt, const void *a, void *p) {
+  UNUSED(m);
+  UNUSED(a);
+  UNUSED(p);
+
+  tmt_clean(vt);
+}
+
+/* (Re)opens the stream at the beginning of the file. */
+static int player_open(Player *p) {
+  int bzerror;
+  if (p->bfp) {
+    BZ2_bzReadClose(&bzerror, p->bfp);
+    p->bfp = NULL;
+  }
+  if (p->gz) {
+    gzclose(p->gz);
+    p->gz = NULL;
+  }
+  rewind(p->f);
+
+  unsigned char magic[3];
+  size_t n = fread(magic, 1, sizeof(magic), p->f);
+  rewind(p->f);
+  if (n >= 2 && magic[0] == 0x1f && magic[1] == 0x8b) {
+    /* zlib reads from its own descriptor, which gzclose closes. */
+    int fd = dup(fileno(p->f));
+    if (fd >= 0 && lseek(fd, 0, SEEK_SET) == 0) p->gz = gzdopen(fd, "rb");
+    if (!p->gz) {
+      if (fd >= 0) close(fd);
+      return CONV_FILE_ERROR;
+    }
+  } else if (n == sizeof(magic) && memcmp(magic, "BZh", sizeof(magic)) == 0) {
+    p->bfp = BZ2_bzReadOpen(&bzerror, p->f, 0, 0, NULL, 0);
+    if (bzerror != BZ_OK) {
+      BZ2_bzReadClose(&bzerror, p->bfp);
+      p->bfp = NULL;
+      return CONV_FILE_ERROR;
+    }
+  }
+
+  p->eof = 0;
+  p->offset = 0;
+  p->record = 0;
+  tmt_reset(p->vt);
+  return CONV_OK;
+}
+
+Player *player_create(const char *filename, size_t rows, size_t cols,
+                      size_t version) {
+  static bool stripgfx_init = false;
+  if (!stripgfx_init) {
+    populate_gfx_arrays();
+    stripgfx_init = true;
+  }
+
+  Player *p = calloc(1, sizeof(Player));
+  if (!p) return NULL;
+  p->version = version;
+  p->rows = rows;
+  p->cols = cols;
+
+  /* See conversion_create: Old ttyrecs don't wrap. */
+  bool wrap = (version != 1);
+  p->vt = tmt_open(rows, wrap ? cols : cols + 1, player_callback, p, NULL,
+                   wrap);
+  p->filename = strdup(filename);
+  p->f = fopen(filename, "rb");
+  if (!p->vt || !p->filename || !p->f || player_open(p) != CONV_OK) {
+    int err = errno;
+    player_close(p);
+    errno = err;
+    return NULL;
+  }
+  return p;
+}
+
+/* Reads up to n bytes. Returns the number of bytes read or -1 on error. */
+static int read_bytes(Player *p, void *dst, int n) {
+  if (p->eof) return 0;
+  if (p->bfp) {
+    int bzerror;
+    int length = BZ2_bzRead(&bzerror, p->bfp, dst, n);
+    if (bzerror == BZ_STREAM_END)
+      p->eof = 1;
+    else if (bzerror != BZ_OK)
+      return -1;
+    return length;
+  }
+  if (p->gz) {
+    int length = gzread(p->gz, dst, n);
+    if (length < 0) return -1;
+    if (length < n) {
+      int zerror;
+      gzerror(p->gz, &zerror);
+      if (zerror != Z_OK) return -1; /* Truncated or corrupt. */
+      p->eof = 1;
+    }
+    return length;
+  }
+  size_t length = fread(dst, 1, n, p->f);
+  if (length < (size_t)n && ferror(p->f)) return -1;
+  return (int)length;
+}
+
+/* Handles a record cut short by the end of the file. Uncompressed ttyrecs
+   might still be written to, so we go back to allow reading it again. */
+static int truncated(Player *p) {
+  if (!p->bfp && !p->gz) {
+    fseek(p->f, p->offset, SEEK_SET);
+    clearerr(p->f);
+  }
+  return CONV_STREAM_END;
+}
+
+static int read_record(Player *p, int render) {
+  size_t hlen = (p->version > 1) ? 13 : 12;
+  unsigned char hbuf[13];
+  int length = read_bytes(p, hbuf, hlen);
+  if (length < 0) return CONV_HEADER_ERROR;
+  if ((size_t)length < hlen) return truncated(p);
+
+  int32_t fields[3];
+  memcpy(fields, hbuf, sizeof(fields));
+  p->header.tv.tv_sec = fields[0];
+  p->header.tv.tv_usec = fields[1];
+  p->header.len = fields[2];
+  p->header.channel = (p->version > 1) ? hbuf[12] : 0;
+
+  if (p->header.len == 0) {
+    /* Treated as the end of the ttyrec, see read_header in converter.c. */
+    return CONV_FILE_ERROR;
+  }
+  if (p->header.len < 0) return CONV_HEADER_ERROR;
+
+  if ((size_t)p->header.len > p->bufsize) {
+    char *buf = realloc(p->buf, p->header.len);
+    if (!buf) return CONV_CRITICAL_ERROR;
+    p->buf = buf;
+    p->bufsize = p->header.len;
+  }
+  length = read_bytes(p, p->buf, p->header.len);
+  if (length < 0) return CONV_BODY_ERROR;
+  if (length < p->header.len) return truncated(p);
+
+  p->offset += hlen + p->header.len;
+  p->record++;
+
+  if (render && p->header.channel == 0)
+    tmt_write(p->vt, p->buf, p->header.len);
+  return CONV_OK;
+}
+
+/* Reads the next record, updating the terminal if it's output. */
+int player_read_record(Player *p) { return read_record(p, 1); }
+
+/* Does this output clear the whole screen? */
+static int is_keyframe(const char *buf, size_t len) {
+  static const char *clears[] = {"\033[2J", "\033[H\033[J"};
+  for (const char *s = buf; (s = memchr(s, '\033', buf + len - s)); ++s) {
+    for (size_t i = 0; i < sizeof(clears) / sizeof(clears[0]); ++i) {
+      size_t n = strlen(clears[i]);
+      if ((size_t)(buf + len - s) >= n && memcmp(s, clears[i], n) == 0)
+        return 1;
+    }
+  }
+  return 0;
+}
+
+static void free_index(TtyrecIndex *index) {
+  free(index->offsets);
+  free(index->timestamps);
+  free(index->channels);
+  free(index->keyframes);
+  free(index->modes);
+  memset(index, 0, sizeof(*index));
+}
+
+static int alloc_index(TtyrecIndex *index, size_t capacity) {
+  int64_t *offsets = realloc(index->offsets, capacity * sizeof(int64_t));
+  if (offsets) index->offsets = offsets;
+  int64_t *timestamps = realloc(index->timestamps, capacity * sizeof(int64_t));
+  if (timestamps) index->timestamps = timestamps;
+  unsigned char *channels = realloc(index->channels, capacity);
+  if (channels) index->channels = channels;
+  unsigned char *keyframes = realloc(index->keyframes, capacity);
+  if (keyframes) index->keyframes = keyframes;
+  return (offsets && timestamps && channels && keyframes) ? CONV_OK
+                                                         : CONV_CRITICAL_ERROR;
+}
+
+/* Reads the whole ttyrec once to index its records. Keeps the position. */
+int player_build_index(Player *p) {
+  size_t record = p->record;
+  TtyrecIndex index = {0};
+  size_t capacity = 0, modes_capacity = 0;
+
+  int status = player_open(p);
+  while (status == CONV_OK) {
+    int64_t offset = p->offset;
+    TMTMODES modes;
+    tmt_get_modes(p->vt, &modes);
+    status = read_record(p, 1);
+    if (status != CONV_OK) break;
+
+    if (index.len == capacity) {
+      capacity = capacity ? 2 * capacity : 1024;
+      if (alloc_index(&index, capacity) != CONV_OK) {
+        free_index(&index);
+        return CONV_CRITICAL_ERROR;
+      }
+    }
+    index.offsets[index.len] = offset;
+    index.timestamps[index.len] =
+        1000000 * (int64_t)p->header.tv.tv_sec + p->header.tv.tv_usec;
+    index.channels[index.len] = p->header.channel;
+    index.keyframes[index.len] =
+        p->header.channel == 0 && is_keyframe(p->buf, p->header.len);
+    if (index.keyframes[index.len]) {
+      if (index.nkeyframes == modes_capacity) {
+        modes_capacity = modes_capacity ? 2 * modes_capacity : 64;
+        TMTMODES *m = realloc(index.modes, modes_capacity * sizeof(TMTMODES));
+        if (!m) {
+          free_index(&index);
+          return CONV_CRITICAL_ERROR;
+        }
+        index.modes = m;
+      }
+      index.modes[index.nkeyframes++] = modes;
+    }
+    ++index.len;
+  }
+  if (status != CONV_STREAM_END && status != CONV_FILE_ERROR) {
+    free_index(&index);
+    return status;
+  }
+  if (index.len == 0 && alloc_index(&index, 1) != CONV_OK) {
+    free_index(&index);
+    return CONV_CRITICAL_ERROR;
+  }
+  index.zero_header = status == CONV_FILE_ERROR;
+
+  free_index(&p->index);
+  p->index = index;
+  if ((status = player_open(p)) != CONV_OK) return status;
+  return player_seek(p, record);
+}
+
+/* Skips forward to `offset` (the start of `record`) without rendering. */
+static int skip_to(Player *p, int64_t offset, size_t record) {
+  if (!p->bfp && !p->gz) {
+    if (fseek(p->f, offset, SEEK_SET) != 0) return CONV_FILE_ERROR;
+  } else {
+    char chunk[SKIP_CHUNK];
+    for (int64_t todo = offset - p->offset; todo > 0;) {
+      int n = todo < SKIP_CHUNK ? (int)todo : SKIP_CHUNK;
+      int length = read_bytes(p, chunk, n);
+      if (length <= 0) return CONV_BODY_ERROR;
+      todo -= length;
+    }
+  }
+  p->offset = offset;
+  p->record = record;
+  return CONV_OK;
+}
+
+/* Positions the player such that the next record read is `record` and the
+   terminal shows the state after all records before it. */
+int player_seek(Player *p, size_t record) {
+  int status;
+  if (!p->index.offsets && (status = player_build_index(p)) != CONV_OK)
+    return status;
+  if (record > p->index.len) record = p->index.len;
+
+  /* The last key frame before `record`, from which we start rendering. */
+  size_t start = record;
+  while (start > 0 && !p->index.keyframes[start - 1]) --start;
+  if (start > 0) --start;
+  size_t keyframe = 0;
+  for (size_t i = 0; i < start; ++i) keyframe += p->index.keyframes[i];
+
+  if (record < p->record || start > p->record) {
+    if (p->index.offsets[start] < p->offset &&
+        (status = player_open(p)) != CONV_OK)
+      return status;
+    if (start > p->record &&
+        (status = skip_to(p, p->index.offsets[start], start)) != CONV_OK)
+      return status;
+    tmt_reset(p->vt);
+    if (p->index.keyframes[start])
+      tmt_set_modes(p->vt, &p->index.modes[keyframe]);
+  }
+
+  while (p->record < record) {
+    if ((status = player_read_record(p)) != CONV_OK) return status;
+  }
+  return CONV_OK;
+}
+
+int player_load_index(Player *p, const char *path) {
+  struct stat st;
+  if (stat(p->filename, &st) != 0) return CONV_FILE_ERROR;
+
+  FILE *f = fopen(path, "rb");
+  if (!f) return CONV_FILE_ERROR;
+
+  char magic[8];
+  int64_t header[6]; /* size, mtime, version, len, nkeyframes,
+                        zero_header */
+  TtyrecIndex index = {0};
+  int status = CONV_FILE_ERROR;
+  if (fread(magic, 1, sizeof(magic), f) == sizeof(magic) &&
+      memcmp(magic, INDEX_MAGIC, sizeof(magic)) == 0 &&
+      fread(header, sizeof(int64_t), 6, f) == 6 &&
+      header[0] == (int64_t)st.st_size && header[1] == (int64_t)st.st_mtime &&
+      header[2] == (int64_t)p->version && header[3] >= 0 &&
+      header[4] >= 0 && header[4] <= header[3] &&
+      alloc_index(&index, header[3] ? header[3] : 1) == CONV_OK &&
+      (index.modes = malloc((header[4] ? header[4] : 1) * sizeof(TMTMODES)))) {
+    index.len = header[3];
+    index.nkeyframes = header[4];
+    index.zero_header = header[5] != 0;
+    if (fread(index.offsets, sizeof(int64_t), index.len, f) == index.len &&
+        fread(index.timestamps, sizeof(int64_t), index.len, f) == index.len &&
+        fread(index.channels, 1, index.len, f) == index.len &&
+        fread(index.keyframes, 1, index.len, f) == index.len &&
+        fread(index.modes, sizeof(TMTMODES), index.nkeyframes, f) ==
+            index.nkeyframes)
+      status = CONV_OK;
+  }
+  fclose(f);
+
+  if (status != CONV_OK) {
+    free_index(&index);
+    return status;
+  }
+  free_index(&p->index);
+  p->index = index;
+  return CONV_OK;
+}
+
+int player_save_index(Player *p, const char *path) {
+  struct stat st;
+  if (!p->index.offsets || stat(p->filename, &st) != 0) return CONV_FILE_ERROR;
+
+  /* Write to a temporary file first, so readers never see partial indices. */
+  size_t len = strlen(path);
+  char *tmppath = malloc(len + 5);
+  if (!tmppath) return CONV_CRITICAL_ERROR;
+  memcpy(tmppath, path, len);
+  memcpy(tmppath + len, ".tmp", 5);
+
+  FILE *f = fopen(tmppath, "wb");
+  if (!f) {
+    free(tmppath);
+    return CONV_FILE_ERROR;
+  }
+  const TtyrecIndex *index = &p->index;
+  int64_t header[6] = {st.st_size, st.st_mtime, p->version, index->len,
+                       index->nkeyframes, index->zero_header};
+  int ok = fwrite(INDEX_MAGIC, 1, 8, f) == 8 &&
+           fwrite(header, sizeof(int64_t), 6, f) == 6 &&
+           fwrite(index->offsets, sizeof(int64_t), index->len, f) ==
+               index->len &&
+           fwrite(index->timestamps, sizeof(int64_t), index->len, f) ==
+               index->len &&
+           fwrite(index->channels, 1, index->len, f) == index->len &&
+           fwrite(index->keyframes, 1, index->len, f) == index->len &&
+           fwrite(index->modes, sizeof(TMTMODES), index->nkeyframes, f) ==
+               index->nkeyframes;
+  ok = (fclose(f) == 0) && ok;
+  ok = ok && rename(tmppath, path) == 0;
+  if (!ok) remove(tmppath);
+  free(tmppath);
+  return ok ? CONV_OK : CONV_FILE_ERROR;
+}
+
+/* Writes the current screen as in conversion_convert_frames. */
+void player_screen(Player *p, unsigned char *chars, signed char *colors,
+                   int16_t *cursor) {
+  const TMTSCREEN *scr = tmt_screen(p->vt);
+  for (size_t r = 0; r < p->rows; ++r) {
+    for (size_t c = 0; c < p->cols; ++c) {
+      TMTCHAR *ch = &scr->lines[r]->chars[c];
+      assert(ch->c < 256);
+      *chars++ = strip_gfx(ch->c, ch->a.dec);
+      *colors++ = vt_char_color_extract(ch);
+    }
+  }
+  const TMTPOINT *cur = tmt_cursor(p->vt);
+  cursor[0] = cur->r;
+  cursor[1] = cur->c;
+}
+
+static int same_attrs(const TMTATTRS *a, const TMTATTRS *b) {
+  return a->bold == b->bold && a->dim == b->dim &&
+         a->underline == b->underline && a->blink == b->blink &&
+         a->reverse == b->reverse && a->invisible == b->invisible &&
+         a->fg == b->fg && a->bg == b->bg;
+}
+
+static size_t write_sgr(char *out, const TMTATTRS *a) {
+  size_t n = sprintf(out, "\033[0");
+  if (a->bold) n += sprintf(out + n, ";1");
+  if (a->dim) n += sprintf(out + n, ";2");
+  if (a->underline) n += sprintf(out + n, ";4");
+  if (a->blink) n += sprintf(out + n, ";5");
+  if (a->reverse) n += sprintf(out + n, ";7");
+  if (a->invisible) n += sprintf(out + n, ";8");
+  if (a->fg != TMT_COLOR_DEFAULT)
+    n += sprintf(out + n, ";3%d", a->fg - TMT_COLOR_BLACK);
+  if (a->bg != TMT_COLOR_DEFAULT)
+    n += sprintf(out + n, ";4%d", a->bg - TMT_COLOR_BLACK);
+  out[n++] = 'm';
+  return n;
+}
+
+/* Maximum number of bytes written per cell and per row by render_ansi. */
+#define ANSI_CELL_MAX 32
+#define ANSI_ROW_MAX 16
+
+/* Writes ANSI escape sequences drawing the current screen (in ASCII) into
+   `out`, which needs at least rows * (cols * 32 + 16) + 64 bytes. Returns the
+   number of bytes written. */
+size_t player_render_ansi(Player *p, char *out, size_t size) {
+  assert(size >= p->rows * (p->cols * ANSI_CELL_MAX + ANSI_ROW_MAX) + 64);
+  UNUSED(size);
+
+  const TMTSCREEN *scr = tmt_screen(p->vt);
+  size_t n = sprintf(out, "\033[0m\033[H\033[2J");
+  for (size_t r = 0; r < p->rows; ++r) {
+    n += sprintf(out + n, "\033[%zu;1H", r + 1);
+    const TMTATTRS *pen = NULL;
+    for (size_t c = 0; c < p->cols; ++c) {
+      TMTCHAR *ch = &scr->lines[r]->chars[c];
+      if (!pen || !same_attrs(pen, &ch->a)) {
+        pen = &ch->a;
+        n += write_sgr(out + n, pen);
+      }
+      unsigned char s = strip_gfx(ch->c, ch->a.dec);
+      out[n++] = (s < 32 || s == 127) ? ' ' : s;
+    }
+  }
+  const TMTPOINT *cur = tmt_cursor(p->vt);
+  n += sprintf(out + n, "\033[0m\033[%zu;%zuH", cur->r + 1, cur->c + 1);
+  return n;
+}
+
+void player_close(Player *p) {
+  if (!p) return;
+  if (p->bfp) {
+    int bzerror;
+    BZ2_bzReadClose(&bzerror, p->bfp);
+  }
+  if (p->gz) gzclose(p->gz);
+  if (p->f) fclose(p->f);
+  if (p->vt) tmt_close(p->vt);
+  free_index(&p->index);
+  free(p->filename);
+  free(p->buf);
+  free(p);
+}
@@ -0,0 +1,65 @@
+#ifndef PLAYER_H
+#define PLAYER_H
+
+#include <stdint.h>
+#include <stdio.h>
+
+#include "converter.h"
+
+#ifdef __cplusplus
+extern "C"{
+#endif
+
+/* Per-record index of a ttyrec. Records are numbered from 0. */
+typedef struct TtyrecIndex {
+  size_t len;                /* Number of records. */
+  int64_t *offsets;          /* (Uncompressed) offset of each record header. */
+  int64_t *timestamps;       /* Timestamp of each record in usec. */
+  unsigned char *channels;   /* Channel of each record (0 for version 1). */
+  unsigned char *keyframes;  /* 1 if the record clears the screen. */
+  size_t nkeyframes;
+  struct TMTMODES *modes;    /* Terminal modes before each key frame. */
+  int zero_header;           /* 1 if the ttyrec ends in a zero-length header
+                                rather than at the end of the stream. */
+} TtyrecIndex;
+
+typedef struct Player {
+  void *vt; /* TMT object. */
+
+  size_t version; /* What version of ttyrec format are we reading */
+  size_t rows;    /* Number of terminal rows. */
+  size_t cols;    /* Number of terminal columns. */
+
+  char *filename;
+  FILE *f;
+  void *bfp;      /* BZFILE if the ttyrec is bzip2-compressed, else NULL. */
+  void *gz;       /* gzFile if the ttyrec is gzip-compressed, else NULL. */
+  int eof;        /* Set when the (compressed) stream ended. */
+
+  Header header;  /* Most recently read header. */
+  char *buf;      /* Data of the most recently read record. */
+  size_t bufsize;
+
+  int64_t offset; /* (Uncompressed) offset of the next record. */
+  size_t record;  /* Number of the next record. */
+
+  TtyrecIndex index; /* Empty until player_build_index is called. */
+} Player;
+
+Player *player_create(const char *filename, size_t rows, size_t cols,
+                      size_t version);
+int player_read_record(Player *p);
+int player_seek(Player *p, size_t record);
+int player_build_index(Player *p);
+int player_load_index(Player *p, const char *path);
+int player_save_index(Player *p, const char *path);
+void player_screen(Player *p, unsigned char *chars, signed char *colors,
+                   int16_t *cursor);
+size_t player_render_ansi(Player *p, char *out, size_t size);
+void player_close(Player *p);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif /* PLAYER_H */
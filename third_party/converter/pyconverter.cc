@@ -1,14 +1,25 @@
 /* Copyright (c) Facebook, Inc. and its affiliates. */
+#include <algorithm>
+#include <atomic>
+#include <cerrno>
+#include <condition_variable>
 #include <cstdio>
+#include <cstring>
+#include <exception>
 #include <iostream>
 #include <memory>
+#include <mutex>
 #include <new>
 #include <sstream>
+#include <thread>
+#include <vector>
 
 #include <pybind11/numpy.h>
 #include <pybind11/pybind11.h>
 
 #include "converter.h"
+#include "player.h"
+#include "status.h"
 
 namespace py = pybind11;
 using namespace py::literals;
@@ -55,11 +66,97 @@ checked_conversion(py::handle h, const std::vector<size_t> &shape)
 }
 // end of adapted from pynethack.c
 
+// Returns `p + n`, or nullptr for a buffer that isn't written.
+template <typename T>
+T *
+offset(T *p, size_t n)
+{
+    return p ? p + n : nullptr;
+}
+
+// Throws unless a window of `rows` x `cols` at the offsets fits into the
+// terminal.
+void
+check_window(size_t rows, size_t cols, size_t term_rows, size_t term_cols,
+             size_t row_offset, size_t col_offset)
+{
+    if (row_offset + rows > term_rows || col_offset + cols > term_cols)
+        throw std::invalid_argument(
+            "Window invalid: row_offset + rows and col_offset + cols must "
+            "fit into the terminal");
+}
+
+// Returns the length of the first dimension of the first array that isn't
+// None.
+size_t
+leading_dim(std::initializer_list<py::handle> arrays)
+{
+    for (py::handle h : arrays) {
+        if (h.is_none())
+            continue;
+        if (!py::isinstance<py::array>(h))
+            throw std::invalid_argument("Numpy array required");
+        py::array array = py::array::ensure(h);
+        if (array.ndim() < 1)
+            throw std::invalid_argument("Array has no dimensions");
+        return array.shape(0);
+    }
+    throw std::invalid_argument("At least one array required");
+}
+
+// Parses the top and status lines of [N, rows, cols] `chars` with [N, 2]
+// `cursors` into [N, NLE_MESSAGE_SIZE] `message` and [N, NLE_BLSTATS_SIZE]
+// `blstats`, like converting with these arrays does. Either may be None.
+// The hero's position, and all of blstats while the status lines are hidden,
+// are carried forward from the previous frame, or for the first one from the
+// blstats `previous` if given (see status.h).
+void
+parse_status(py::object chars, py::object cursors, py::object blstats,
+             py::object message, py::object previous)
+{
+    if (!py::isinstance<py::array>(chars))
+        throw std::invalid_argument("Numpy array required");
+    py::array array = py::array::ensure(chars);
+    if (array.ndim() != 3)
+        throw std::invalid_argument(
+            "Array has wrong number of dimensions (expected 3)");
+    size_t n = array.shape(0), rows = array.shape(1), cols = array.shape(2);
+    if (rows < 3)
+        throw std::invalid_argument("Frames need at least 3 rows");
+
+    const uint8_t *chars_ = checked_conversion<uint8_t>(chars, { n, rows, cols });
+    const int16_t *cursors_ = checked_conversion<int16_t>(cursors, { n, 2 });
+    if (cursors_ == nullptr)
+        throw std::invalid_argument("Numpy array required");
+    int64_t *blstats_ =
+        checked_conversion<int64_t>(blstats, { n, STATUS_BLSTATS_SIZE });
+    uint8_t *message_ =
+        checked_conversion<uint8_t>(message, { n, STATUS_MESSAGE_SIZE });
+    const int64_t *previous_ =
+        checked_conversion<int64_t>(previous, { STATUS_BLSTATS_SIZE });
+
+    py::gil_scoped_release release;
+    const size_t status = status_row(rows);
+    for (size_t i = 0; i < n; ++i) {
+        const uint8_t *frame = chars_ + i * rows * cols;
+        int64_t *blstats = offset(blstats_, i * STATUS_BLSTATS_SIZE);
+        size_t row = cursors_[2 * i], col = cursors_[2 * i + 1];
+        uint8_t at_cursor = row < rows && col < cols ? frame[row * cols + col]
+                                                     : ' ';
+        status_parse(frame, frame + status * cols, frame + (status + 1) * cols,
+                     cols, row, col, at_cursor,
+                     blstats && i > 0 ? blstats - STATUS_BLSTATS_SIZE
+                                      : previous_,
+                     blstats,
+                     offset(message_, i * STATUS_MESSAGE_SIZE));
+    }
+}
+
 class Converter
 {
   public:
-    Converter(size_t rows, size_t cols, size_t ttyrec_version, size_t term_rows, size_t term_cols
-              )
+    Converter(size_t rows, size_t cols, size_t ttyrec_version, size_t term_rows, size_t term_cols,
+              size_t decode_threads, size_t row_offset, size_t col_offset)
         : rows_(rows), cols_(cols),
           ttyrec_version_(ttyrec_version),
           term_rows_((term_rows != 0) ? term_rows : rows),
@@ -67,12 +164,16 @@ class Converter
     {
         if (term_rows_ < 2 || term_cols_ < 2)
            throw std::invalid_argument("Terminal invalid: term_rows and term_cols must be >1");
+        check_window(rows_, cols_, term_rows_, term_cols_, row_offset,
+                     col_offset);
 
         conversion_ = conversion_create(rows_, cols_, term_rows_, term_cols_,
                                         ttyrec_version_);
         if (conversion_ == nullptr) {
             throw std::bad_alloc();
         }
+        conversion_set_decode_threads(conversion_, decode_threads);
+        conversion_set_window(conversion_, row_offset, col_offset);
     }
 
     ~Converter()
@@ -101,6 +202,8 @@ class Converter
                                      + "'");
         }
 
+        if (part == 0)
+            conversion_reset_status(conversion_);
         gameid_ = gameid;
         part_ = part;
         filename_ = std::move(filename);
@@ -108,16 +211,14 @@ class Converter
 
     int
     convert(py::object chars, py::object colors, py::object cursors,
-            py::object timestamps, py::object inputs, py::object scores)
+            py::object timestamps, py::object inputs, py::object scores,
+            py::object blstats, py::object message)
     {
         int status = 0;
 
-        if (!py::isinstance<py::array>(chars))
-            throw std::invalid_argument("Numpy array required");
-        py::array array = py::array::ensure(chars);
-        if (!array.dtype().is(py::dtype::of<uint8_t>()))
-            throw std::invalid_argument("Buffer dtype mismatch.");
-        size_t unroll = array.request().shape[0];
+        // Arrays may be None to not write their channel.
+        size_t unroll = leading_dim({ chars, colors, cursors, timestamps,
+                                      inputs, scores, blstats, message });
 
         conversion_set_buffers(
             conversion_,
@@ -129,6 +230,13 @@ class Converter
             checked_conversion<int64_t>(timestamps, { unroll }), unroll,
             checked_conversion<uint8_t>(inputs, { unroll }), unroll,
             checked_conversion<int32_t>(scores, { unroll }), unroll);
+        conversion_set_status_buffers(
+            conversion_,
+            checked_conversion<int64_t>(blstats,
+                                        { unroll, STATUS_BLSTATS_SIZE }),
+            checked_conversion<uint8_t>(message,
+                                        { unroll, STATUS_MESSAGE_SIZE }),
+            unroll);
         {
             py::gil_scoped_release release;
             status = conversion_convert_frames(conversion_);
@@ -145,6 +253,29 @@ class Converter
         return conversion_->remaining;
     }
 
+    // Like convert, but only fills timestamps, inputs and scores, without
+    // emulating the terminal.
+    int
+    scan(py::object timestamps, py::object inputs, py::object scores)
+    {
+        if (!py::isinstance<py::array>(timestamps))
+            throw std::invalid_argument("Numpy array required");
+        size_t unroll = py::array::ensure(timestamps).shape(0);
+
+        conversion_set_scan_buffers(
+            conversion_, checked_conversion<int64_t>(timestamps, { unroll }),
+            checked_conversion<uint8_t>(inputs, { unroll }),
+            checked_conversion<int32_t>(scores, { unroll }), unroll);
+        int status;
+        {
+            py::gil_scoped_release release;
+            status = conversion_scan_frames(conversion_);
+        }
+        if (status == CONV_CRITICAL_ERROR)
+            throw std::runtime_error("Error in file.");
+        return conversion_->remaining;
+    }
+
     bool
     is_loaded()
     {
@@ -185,18 +316,641 @@ class Converter
     size_t gameid_ = 0;
 };
 
+// Raised (as OSError) when a ttyrec of a BatchConverter can't be opened.
+struct LoadError {
+    int errnum;
+    std::string filename;
+};
+
+// Converts whole [batch_size, seq_length, ...] minibatches at once. Each
+// batch entry ("lane") owns a Conversion and a queue of ttyrecs that it
+// converts one after the other, like TtyrecDataset's load functions did in
+// Python. The lanes of a minibatch are converted in parallel on a pool of
+// native threads with the GIL released. On top, each lane decompresses large
+// ttyrecs on `decode_threads` threads (see bzparallel.h).
+class BatchConverter
+{
+  public:
+    BatchConverter(size_t batch_size, size_t rows, size_t cols,
+                   size_t ttyrec_version, bool loop_forever,
+                   size_t num_threads, size_t term_rows, size_t term_cols,
+                   size_t decode_threads, size_t row_offset, size_t col_offset)
+        : batch_size_(batch_size), rows_(rows), cols_(cols),
+          ttyrec_version_(ttyrec_version), loop_forever_(loop_forever),
+          term_rows_((term_rows != 0) ? term_rows : rows),
+          term_cols_((term_cols != 0) ? term_cols : cols), lanes_(batch_size)
+    {
+        if (term_rows_ < 2 || term_cols_ < 2)
+            throw std::invalid_argument(
+                "Terminal invalid: term_rows and term_cols must be >1");
+        check_window(rows_, cols_, term_rows_, term_cols_, row_offset,
+                     col_offset);
+        for (Lane &lane : lanes_) {
+            lane.conversion = conversion_create(rows_, cols_, term_rows_,
+                                                term_cols_, ttyrec_version_);
+            if (lane.conversion == nullptr)
+                throw std::bad_alloc();
+            conversion_set_decode_threads(lane.conversion, decode_threads);
+            conversion_set_window(lane.conversion, row_offset, col_offset);
+        }
+
+        if (num_threads == 0)
+            num_threads = std::max(1u, std::thread::hardware_concurrency());
+        num_threads = std::min(num_threads, batch_size_);
+        // The calling thread converts lanes too.
+        for (size_t i = 1; i < num_threads; ++i)
+            threads_.emplace_back(&BatchConverter::worker, this);
+    }
+
+    ~BatchConverter()
+    {
+        {
+            std::lock_guard<std::mutex> lock(mutex_);
+            stop_ = true;
+        }
+        start_cv_.notify_all();
+        for (std::thread &thread : threads_)
+            thread.join();
+        for (Lane &lane : lanes_) {
+            if (lane.conversion != nullptr)
+                conversion_close(lane.conversion);
+            if (lane.ttyrec != nullptr)
+                fclose(lane.ttyrec);
+        }
+    }
+
+    // Appends a ttyrec to the queue of `lane`. Parts of a game need to be
+    // added in order.
+    void
+    add_ttyrec(size_t lane, size_t gameid, size_t part, std::string path)
+    {
+        if (lane >= batch_size_)
+            throw std::out_of_range("Lane out of range");
+        lanes_[lane].items.push_back({ gameid, part, std::move(path) });
+    }
+
+    // Fills the given [batch_size, seq_length, ...] arrays. Lanes that run
+    // out of ttyrecs are filled with zeros. Returns the number of lanes that
+    // still had data. All but `resets` and `gameids` may be None to not
+    // write their channel. `blstats` and `message` are parsed from the top
+    // and status lines, see status.h.
+    size_t
+    convert(py::object chars, py::object colors, py::object cursors,
+            py::object timestamps, py::object inputs, py::object scores,
+            py::object resets, py::object gameids, py::object blstats,
+            py::object message)
+    {
+        if (!py::isinstance<py::array>(resets))
+            throw std::invalid_argument("Numpy array required");
+        py::array array = py::array::ensure(resets);
+        if (array.ndim() != 2)
+            throw std::invalid_argument(
+                "Array has wrong number of dimensions (expected 2)");
+        seq_length_ = array.shape(1);
+
+        size_t b = batch_size_, t = seq_length_;
+        chars_ = checked_conversion<uint8_t>(chars, { b, t, rows_, cols_ });
+        colors_ = checked_conversion<int8_t>(colors, { b, t, rows_, cols_ });
+        cursors_ = checked_conversion<int16_t>(cursors, { b, t, 2 });
+        timestamps_ = checked_conversion<int64_t>(timestamps, { b, t });
+        inputs_ = checked_conversion<uint8_t>(inputs, { b, t });
+        scores_ = checked_conversion<int32_t>(scores, { b, t });
+        resets_ = checked_conversion<uint8_t>(resets, { b, t });
+        gameids_ = checked_conversion<int32_t>(gameids, { b, t });
+        blstats_ = checked_conversion<int64_t>(blstats,
+                                               { b, t, STATUS_BLSTATS_SIZE });
+        message_ = checked_conversion<uint8_t>(message,
+                                               { b, t, STATUS_MESSAGE_SIZE });
+
+        run(&BatchConverter::fill_lane);
+
+        size_t active = 0;
+        for (const Lane &lane : lanes_)
+            active += !lane.done;
+        return active;
+    }
+
+    // Returns the position of each lane as a tuple (item, frame, done): The
+    // index of the ttyrec of the lane being converted (-1 before the first
+    // call to convert), the number of frames converted from it, and whether
+    // the lane ran out of ttyrecs.
+    py::list
+    state()
+    {
+        py::list result;
+        for (const Lane &lane : lanes_) {
+            long item = lane.started ? static_cast<long>(lane.next) - 1 : -1;
+            result.append(py::make_tuple(item, lane.frames, lane.done));
+        }
+        return result;
+    }
+
+    // Restores the lane positions returned by `state`, given the same
+    // ttyrecs were added. Skips to the frame of each lane's ttyrec without
+    // converting the frames before it or the lane's previous ttyrecs, so the
+    // terminal only differs if the ttyrec doesn't start by clearing it.
+    void
+    restore(py::list states)
+    {
+        if (states.size() != batch_size_)
+            throw std::invalid_argument("Expected one state per lane");
+        for (size_t i = 0; i < batch_size_; ++i) {
+            py::tuple state = states[i].cast<py::tuple>();
+            long item = state[0].cast<long>();
+            Lane &lane = lanes_[i];
+            if (item >= static_cast<long>(lane.items.size()))
+                throw std::out_of_range("Item out of range");
+            lane.started = item >= 0;
+            lane.next = item + 1;
+            lane.frames = state[1].cast<size_t>();
+            lane.done = state[2].cast<bool>();
+        }
+        run(&BatchConverter::restore_lane);
+    }
+
+    size_t
+    num_threads()
+    {
+        return threads_.size() + 1;
+    }
+
+    const size_t batch_size_ = 0;
+    const size_t rows_ = 0;
+    const size_t cols_ = 0;
+    const size_t ttyrec_version_ = 0;
+    const bool loop_forever_ = false;
+    const size_t term_rows_ = 0;
+    const size_t term_cols_ = 0;
+
+  private:
+    struct Item {
+        size_t gameid;
+        size_t part;
+        std::string path;
+    };
+
+    struct Lane {
+        Conversion *conversion = nullptr;
+        FILE *ttyrec = nullptr;
+        std::vector<Item> items;
+        size_t next = 0; // Next item to load.
+        size_t gameid = 0;
+        size_t part = 0;
+        size_t frames = 0; // Frames converted from the current ttyrec.
+        bool started = false;
+        bool done = false;
+    };
+
+    // Loads the next ttyrec of `lane`. Returns false if there is none.
+    bool
+    load_next(Lane &lane)
+    {
+        if (lane.next == lane.items.size()) {
+            if (!loop_forever_ || lane.items.empty())
+                return false;
+            lane.next = 0;
+        }
+        const Item &item = lane.items[lane.next++];
+
+        if (lane.ttyrec == nullptr)
+            lane.ttyrec = fopen(item.path.c_str(), "r");
+        else
+            lane.ttyrec = freopen(item.path.c_str(), "r", lane.ttyrec);
+        if (lane.ttyrec == nullptr)
+            throw LoadError{ errno, item.path };
+        if (conversion_load_ttyrec(lane.conversion, lane.ttyrec) != 0)
+            throw std::runtime_error("File failed to load: '" + item.path
+                                     + "'");
+        if (item.part == 0)
+            conversion_reset_status(lane.conversion);
+        lane.gameid = item.gameid;
+        lane.part = item.part;
+        lane.frames = 0;
+        return true;
+    }
+
+    // Loads the ttyrec of `lane` being converted and skips the frames that
+    // were converted from it, see `restore`.
+    void
+    restore_lane(size_t i)
+    {
+        Lane &lane = lanes_[i];
+        if (!lane.started || lane.done)
+            return;
+        size_t frames = lane.frames;
+        --lane.next;
+        load_next(lane);
+        int status = conversion_skip_frames(lane.conversion, frames);
+        if (status == CONV_CRITICAL_ERROR)
+            throw std::runtime_error("Error in file.");
+        lane.frames = frames - lane.conversion->remaining;
+    }
+
+    // Same as convert_frames in dataset.py used to do for one batch entry.
+    void
+    fill_lane(size_t i)
+    {
+        Lane &lane = lanes_[i];
+        const size_t t = seq_length_, frame = rows_ * cols_;
+        uint8_t *chars = offset(chars_, i * t * frame);
+        int8_t *colors = offset(colors_, i * t * frame);
+        int16_t *cursors = offset(cursors_, i * t * 2);
+        int64_t *timestamps = offset(timestamps_, i * t);
+        uint8_t *inputs = offset(inputs_, i * t);
+        int32_t *scores = offset(scores_, i * t);
+        uint8_t *resets = resets_ + i * t;
+        int32_t *gameids = gameids_ + i * t;
+        int64_t *blstats = offset(blstats_, i * t * STATUS_BLSTATS_SIZE);
+        uint8_t *message = offset(message_, i * t * STATUS_MESSAGE_SIZE);
+
+        if (!lane.started) {
+            lane.started = true;
+            if (!load_next(lane))
+                throw std::runtime_error("Not enough ttyrecs to fill a batch!");
+        }
+
+        size_t start = 0;
+        resets[0] = 0;
+        while (!lane.done) {
+            size_t n = t - start;
+            conversion_set_buffers(
+                lane.conversion, offset(chars, start * frame), n * frame,
+                reinterpret_cast<signed char *>(
+                    offset(colors, start * frame)),
+                n * frame, offset(cursors, start * 2), n * 2,
+                offset(timestamps, start), n, offset(inputs, start), n,
+                offset(scores, start), n);
+            conversion_set_status_buffers(
+                lane.conversion,
+                offset(blstats, start * STATUS_BLSTATS_SIZE),
+                offset(message, start * STATUS_MESSAGE_SIZE), n);
+            int status = conversion_convert_frames(lane.conversion);
+            if (status == CONV_CRITICAL_ERROR)
+                throw std::runtime_error("Error in file.");
+
+            size_t end = t - lane.conversion->remaining;
+            lane.frames += end - start;
+            if (end > start + 1)
+                memset(resets + start + 1, 0, end - start - 1);
+            std::fill(gameids + start, gameids + end, lane.gameid);
+            if (end == t)
+                return;
+
+            // There is still space in the buffers; load a new ttyrec.
+            start = end;
+            if (load_next(lane))
+                resets[start] = (lane.part == 0);
+            else
+                lane.done = true;
+        }
+
+        size_t n = t - start;
+        if (chars)
+            memset(chars + start * frame, 0, n * frame);
+        if (colors)
+            memset(colors + start * frame, 0, n * frame);
+        if (cursors)
+            memset(cursors + start * 2, 0, n * 2 * sizeof(int16_t));
+        if (timestamps)
+            memset(timestamps + start, 0, n * sizeof(int64_t));
+        if (inputs)
+            memset(inputs + start, 0, n);
+        if (scores)
+            memset(scores + start, 0, n * sizeof(int32_t));
+        if (blstats)
+            memset(blstats + start * STATUS_BLSTATS_SIZE, 0,
+                   n * STATUS_BLSTATS_SIZE * sizeof(int64_t));
+        if (message)
+            memset(message + start * STATUS_MESSAGE_SIZE, 0,
+                   n * STATUS_MESSAGE_SIZE);
+        memset(resets + start, 0, n);
+        memset(gameids + start, 0, n * sizeof(int32_t));
+    }
+
+    // Runs `task_` on lanes until none are left.
+    void
+    work()
+    {
+        size_t finished = 0;
+        for (size_t i; (i = next_lane_++) < batch_size_; ++finished) {
+            try {
+                (this->*task_)(i);
+            } catch (...) {
+                std::lock_guard<std::mutex> lock(mutex_);
+                if (!error_)
+                    error_ = std::current_exception();
+            }
+        }
+        if (finished > 0) {
+            std::lock_guard<std::mutex> lock(mutex_);
+            finished_ += finished;
+            if (finished_ == batch_size_)
+                done_cv_.notify_all();
+        }
+    }
+
+    void
+    worker()
+    {
+        size_t generation = 0;
+        while (true) {
+            {
+                std::unique_lock<std::mutex> lock(mutex_);
+                start_cv_.wait(lock, [&] {
+                    return stop_ || generation_ != generation;
+                });
+                if (stop_)
+                    return;
+                generation = generation_;
+            }
+            work();
+        }
+    }
+
+    // Runs `task` on all lanes in parallel and rethrows the first error.
+    void
+    run(void (BatchConverter::*task)(size_t))
+    {
+        {
+            py::gil_scoped_release release;
+            {
+                std::lock_guard<std::mutex> lock(mutex_);
+                task_ = task;
+                next_lane_ = 0;
+                finished_ = 0;
+                ++generation_;
+            }
+            start_cv_.notify_all();
+            work();
+            std::unique_lock<std::mutex> lock(mutex_);
+            done_cv_.wait(lock, [&] { return finished_ == batch_size_; });
+        }
+
+        if (error_) {
+            std::exception_ptr error = error_;
+            error_ = nullptr;
+            try {
+                std::rethrow_exception(error);
+            } catch (const LoadError &e) {
+                errno = e.errnum;
+                PyErr_SetFromErrnoWithFilename(PyExc_OSError,
+                                               e.filename.c_str());
+                throw py::error_already_set();
+            }
+        }
+    }
+
+    std::vector<Lane> lanes_;
+    std::vector<std::thread> threads_;
+
+    std::mutex mutex_;
+    std::condition_variable start_cv_;
+    std::condition_variable done_cv_;
+    size_t generation_ = 0;
+    void (BatchConverter::*task_)(size_t) = &BatchConverter::fill_lane;
+    size_t finished_ = 0;
+    bool stop_ = false;
+    std::atomic<size_t> next_lane_{ 0 };
+    std::exception_ptr error_;
+
+    // Buffers of the current call to convert.
+    size_t seq_length_ = 0;
+    uint8_t *chars_ = nullptr;
+    int8_t *colors_ = nullptr;
+    int16_t *cursors_ = nullptr;
+    int64_t *timestamps_ = nullptr;
+    uint8_t *inputs_ = nullptr;
+    int32_t *scores_ = nullptr;
+    uint8_t *resets_ = nullptr;
+    int32_t *gameids_ = nullptr;
+    int64_t *blstats_ = nullptr;
+    uint8_t *message_ = nullptr;
+};
+
+class TtyrecReader
+{
+  public:
+    TtyrecReader(const std::string filename, size_t ttyrec_version,
+                 size_t rows, size_t cols, bool index_cache)
+        : rows_(rows), cols_(cols), ttyrec_version_(ttyrec_version),
+          index_cache_(index_cache), filename_(filename)
+    {
+        if (rows_ < 2 || cols_ < 2)
+            throw std::invalid_argument(
+                "Terminal invalid: rows and cols must be >1");
+        player_ = player_create(filename.c_str(), rows_, cols_,
+                                ttyrec_version_);
+        if (player_ == nullptr) {
+            PyErr_SetFromErrnoWithFilename(PyExc_OSError, filename.c_str());
+            throw py::error_already_set();
+        }
+    }
+
+    ~TtyrecReader() { player_close(player_); }
+
+    // Returns (timestamp in usec, channel, data) of the next record or None
+    // at the end of the ttyrec.
+    py::object
+    read()
+    {
+        int status;
+        {
+            py::gil_scoped_release release;
+            status = player_read_record(player_);
+        }
+        if (status == CONV_STREAM_END || status == CONV_FILE_ERROR)
+            return py::none();
+        check(status);
+        const Header &header = player_->header;
+        int64_t usec = 1000000 * (int64_t) header.tv.tv_sec + header.tv.tv_usec;
+        return py::make_tuple(usec, (unsigned char) header.channel,
+                              py::bytes(player_->buf, header.len));
+    }
+
+    py::object
+    next()
+    {
+        py::object record = read();
+        if (record.is_none())
+            throw py::stop_iteration();
+        return record;
+    }
+
+    size_t
+    tell()
+    {
+        return player_->record;
+    }
+
+    void
+    seek(size_t record)
+    {
+        ensure_index();
+        if (record > player_->index.len)
+            throw std::out_of_range("Record out of range");
+        int status;
+        {
+            py::gil_scoped_release release;
+            status = player_seek(player_, record);
+        }
+        check(status);
+    }
+
+    // Seeks to the record holding keypress `step` (for version 1, which
+    // doesn't record keypresses, to record `step`).
+    void
+    seek_step(size_t step)
+    {
+        ensure_index();
+        const TtyrecIndex &index = player_->index;
+        if (ttyrec_version_ < 2) {
+            seek(step);
+            return;
+        }
+        size_t record = 0;
+        for (size_t n = 0; record < index.len; ++record) {
+            if (index.channels[record] == 1 && n++ == step)
+                break;
+        }
+        seek(record);
+    }
+
+    // Seeks to the first record with a timestamp of at least `usec`.
+    void
+    seek_time(int64_t usec)
+    {
+        ensure_index();
+        const TtyrecIndex &index = player_->index;
+        size_t record = 0;
+        while (record < index.len && index.timestamps[record] < usec)
+            ++record;
+        seek(record);
+    }
+
+    void
+    screen(py::object chars, py::object colors, py::object cursor)
+    {
+        player_screen(player_,
+                      checked_conversion<uint8_t>(chars, { rows_, cols_ }),
+                      checked_conversion<int8_t>(colors, { rows_, cols_ }),
+                      checked_conversion<int16_t>(cursor, { 2 }));
+    }
+
+    py::bytes
+    render_ansi()
+    {
+        std::vector<char> out(rows_ * (cols_ * 32 + 16) + 64);
+        size_t n = player_render_ansi(player_, out.data(), out.size());
+        return py::bytes(out.data(), n);
+    }
+
+    // Not __len__, as list(reader) would then build the index first.
+    size_t
+    num_records()
+    {
+        ensure_index();
+        return player_->index.len;
+    }
+
+    py::array_t<int64_t>
+    timestamps()
+    {
+        ensure_index();
+        return py::array_t<int64_t>(player_->index.len,
+                                    player_->index.timestamps);
+    }
+
+    py::array_t<uint8_t>
+    channels()
+    {
+        ensure_index();
+        return py::array_t<uint8_t>(player_->index.len,
+                                    player_->index.channels);
+    }
+
+    py::array_t<uint8_t>
+    keyframes()
+    {
+        ensure_index();
+        return py::array_t<uint8_t>(player_->index.len,
+                                    player_->index.keyframes);
+    }
+
+    bool
+    zero_header()
+    {
+        ensure_index();
+        return player_->index.zero_header;
+    }
+
+    const std::string &
+    filename()
+    {
+        return filename_;
+    }
+
+    const size_t rows_ = 0;
+    const size_t cols_ = 0;
+    const size_t ttyrec_version_ = 0;
+    const bool index_cache_ = true;
+
+  private:
+    void
+    check(int status)
+    {
+        if (status != CONV_OK)
+            throw std::runtime_error("Error in file: '" + filename_
+                                     + "' (status " + std::to_string(status)
+                                     + ")");
+    }
+
+    // Builds the index on first use, or loads it from next to the ttyrec.
+    void
+    ensure_index()
+    {
+        if (player_->index.offsets != nullptr)
+            return;
+        std::string path = filename_ + ".idx";
+        int status;
+        {
+            py::gil_scoped_release release;
+            if (index_cache_
+                && player_load_index(player_, path.c_str()) == CONV_OK)
+                return;
+            status = player_build_index(player_);
+            if (status == CONV_OK && index_cache_)
+                player_save_index(player_, path.c_str());  // Best effort.
+        }
+        check(status);
+    }
+
+    Player *player_ = nullptr;
+    std::string filename_;
+};
+
 PYBIND11_MODULE(_pyconverter, m)
 {
     m.doc() = "Ttyrec Converter";
 
+    m.def("parse_status", &parse_status, py::arg("chars"), py::arg("cursors"),
+          py::arg("blstats"), py::arg("message") = py::none(),
+          py::arg("previous") = py::none());
+    m.attr("BLSTATS_SIZE") = py::int_(STATUS_BLSTATS_SIZE);
+    m.attr("MESSAGE_SIZE") = py::int_(STATUS_MESSAGE_SIZE);
+
     py::class_<Converter>(m, "Converter")
-        .def(py::init<size_t, size_t, size_t, size_t, size_t>(),
+        .def(py::init<size_t, size_t, size_t, size_t, size_t, size_t, size_t,
+                      size_t>(),
              py::arg("rows"), py::arg("cols"), py::arg("ttyrec_version"), py::arg("term_rows") = 0,
-             py::arg("term_cols") = 0)
+             py::arg("term_cols") = 0, py::arg("decode_threads") = 1,
+             py::arg("row_offset") = 0, py::arg("col_offset") = 0)
         .def("load_ttyrec", &Converter::load_ttyrec, py::arg("filename"),
              py::arg("gameid") = 0, py::arg("part") = 0)
         .def("convert", &Converter::convert, py::arg("chars"),
              py::arg("colors"), py::arg("cursors"), py::arg("timestamps"),
+             py::arg("inputs"), py::arg("scores"),
+             py::arg("blstats") = py::none(), py::arg("message") = py::none())
+        .def("scan", &Converter::scan, py::arg("timestamps"),
              py::arg("inputs"), py::arg("scores"))
         .def("is_loaded", &Converter::is_loaded)
         .def_readonly("rows", &Converter::rows_)
@@ -207,4 +961,53 @@ PYBIND11_MODULE(_pyconverter, m)
         .def_property_readonly("filename", &Converter::filename)
         .def_property_readonly("part", &Converter::part)
         .def_property_readonly("gameid", &Converter::gameid);
-}
\ No newline at end of file
+
+    py::class_<TtyrecReader>(m, "TtyrecReader")
+        .def(py::init<std::string, size_t, size_t, size_t, bool>(),
+             py::arg("filename"), py::arg("ttyrec_version"),
+             py::arg("rows") = 24, py::arg("cols") = 80,
+             py::arg("index_cache") = true)
+        .def("read", &TtyrecReader::read)
+        .def("__iter__", [](TtyrecReader &r) -> TtyrecReader & { return r; })
+        .def("__next__", &TtyrecReader::next)
+        .def("num_records", &TtyrecReader::num_records)
+        .def("tell", &TtyrecReader::tell)
+        .def("seek", &TtyrecReader::seek, py::arg("record"))
+        .def("seek_step", &TtyrecReader::seek_step, py::arg("step"))
+        .def("seek_time", &TtyrecReader::seek_time, py::arg("usec"))
+        .def("screen", &TtyrecReader::screen, py::arg("chars"),
+             py::arg("colors"), py::arg("cursor"))
+        .def("render_ansi", &TtyrecReader::render_ansi)
+        .def_property_readonly("timestamps", &TtyrecReader::timestamps)
+        .def_property_readonly("channels", &TtyrecReader::channels)
+        .def_property_readonly("keyframes", &TtyrecReader::keyframes)
+        .def_property_readonly("zero_header", &TtyrecReader::zero_header)
+        .def_property_readonly("filename", &TtyrecReader::filename)
+        .def_readonly("rows", &TtyrecReader::rows_)
+        .def_readonly("cols", &TtyrecReader::cols_)
+        .def_readonly("ttyrec_version", &TtyrecReader::ttyrec_version_);
+
+    py::class_<BatchConverter>(m, "BatchConverter")
+        .def(py::init<size_t, size_t, size_t, size_t, bool, size_t, size_t,
+                      size_t, size_t, size_t, size_t>(),
+             py::arg("batch_size"), py::arg("rows"), py::arg("cols"),
+             py::arg("ttyrec_version"), py::arg("loop_forever") = false,
+             py::arg("num_threads") = 0, py::arg("term_rows") = 0,
+             py::arg("term_cols") = 0, py::arg("decode_threads") = 1,
+             py::arg("row_offset") = 0, py::arg("col_offset") = 0)
+        .def("add_ttyrec", &BatchConverter::add_ttyrec, py::arg("lane"),
+             py::arg("gameid"), py::arg("part"), py::arg("path"))
+        .def("convert", &BatchConverter::convert, py::arg("chars"),
+             py::arg("colors"), py::arg("cursors"), py::arg("timestamps"),
+             py::arg("inputs"), py::arg("scores"), py::arg("resets"),
+             py::arg("gameids"), py::arg("blstats") = py::none(),
+             py::arg("message") = py::none())
+        .def("state", &BatchConverter::state)
+        .def("restore", &BatchConverter::restore, py::arg("states"))
+        .def_property_readonly("num_threads", &BatchConverter::num_threads)
+        .def_readonly("batch_size", &BatchConverter::batch_size_)
+        .def_readonly("rows", &BatchConverter::rows_)
+        .def_readonly("cols", &BatchConverter::cols_)
+        .def_readonly("ttyrec_version", &BatchConverter::ttyrec_version_)
+        .def_readonly("loop_forever", &BatchConverter::loop_forever_);
+}
@@ -0,0 +1,238 @@
+/* Parses the tty status lines of NetHack (see botl.c, and tty_status_update
+ * in wintty.c) into NLE's blstats, and the top line into its message. */
+
+#include <stdlib.h>
+#include <string.h>
+
+#include "status.h"
+
+#define STATUS_LINE_MAX 256
+#define MAP_ROWS 21 /* ROWNO */
+#define NOT_HUNGRY 1
+
+static const char *const hunger_names[] = { "Satiated", "",         "Hungry",
+                                            "Weak",     "Fainting", "Fainted",
+                                            "Starved" };
+
+/* Full and progressively shorter names, see encvals and conditions in
+ * wintty.c. */
+static const char *const cap_names[3][6] = {
+  { "", "Burdened", "Stressed", "Strained", "Overtaxed", "Overloaded" },
+  { "", "Burden", "Stress", "Strain", "Overtax", "Overload" },
+  { "", "Brd", "Strs", "Strn", "Ovtx", "Ovld" }
+};
+
+static const struct {
+  int64_t mask; /* BL_MASK_* in botl.h */
+  const char *names[3];
+} conditions[] = {
+  { 0x0001, { "Stone", "Ston", "Sto" } },
+  { 0x0002, { "Slime", "Slim", "Slm" } },
+  { 0x0004, { "Strngl", "Stngl", "Str" } },
+  { 0x0008, { "FoodPois", "Fpois", "Poi" } },
+  { 0x0010, { "TermIll", "Ill", "Ill" } },
+  { 0x0020, { "Blind", "Blnd", "Bl" } },
+  { 0x0040, { "Deaf", "Def", "Df" } },
+  { 0x0080, { "Stun", "Stun", "St" } },
+  { 0x0100, { "Conf", "Cnf", "Cf" } },
+  { 0x0200, { "Hallu", "Hal", "Hl" } },
+  { 0x0400, { "Lev", "Lev", "Lv" } },
+  { 0x0800, { "Fly", "Fly", "Fl" } },
+  { 0x1000, { "Ride", "Rid", "Rd" } },
+};
+
+#define NUM_CONDITIONS (sizeof(conditions) / sizeof(conditions[0]))
+
+static const struct {
+  const char *label;
+  int index;
+} line1_fields[] = {
+  { "Dx:", STATUS_BL_DEX }, { "Co:", STATUS_BL_CON },  { "In:", STATUS_BL_INT },
+  { "Wi:", STATUS_BL_WIS }, { "Ch:", STATUS_BL_CHA },  { "S:", STATUS_BL_SCORE },
+}, line2_fields[] = {
+  { "Dlvl:", STATUS_BL_DEPTH }, { "AC:", STATUS_BL_AC }, { "HD:", STATUS_BL_HD },
+  { "T:", STATUS_BL_TIME },     { "Exp:", STATUS_BL_XP },
+};
+
+size_t status_row(size_t term_rows) {
+  /* The status window starts right below the map, see tty_create_nhwindow. */
+  return term_rows < MAP_ROWS + 3 ? term_rows - 2 : MAP_ROWS + 1;
+}
+
+/* Copies a line into `buf` as a string. Returns its length without trailing
+ * spaces. */
+static size_t copy_line(char *buf, const unsigned char *line, size_t cols) {
+  size_t n = cols < STATUS_LINE_MAX - 1 ? cols : STATUS_LINE_MAX - 1;
+  memcpy(buf, line, n);
+  while (n && buf[n - 1] == ' ') --n;
+  buf[n] = '\0';
+  return n;
+}
+
+/* Returns the next space-separated token of `*s`, or NULL at its end. */
+static char *next_token(char **s) {
+  char *token = *s;
+  while (*token == ' ') ++token;
+  if (!*token) return NULL;
+  char *end = strchr(token, ' ');
+  if (end) {
+    *end = '\0';
+    *s = end + 1;
+  } else {
+    *s = token + strlen(token);
+  }
+  return token;
+}
+
+static int starts_with(const char *s, const char *prefix) {
+  return !strncmp(s, prefix, strlen(prefix));
+}
+
+/* Parses "a" or "a<sep>b" into `first` and, if given, `second`. */
+static void parse_pair(const char *s, char sep, int64_t *first,
+                       int64_t *second) {
+  char *end;
+  *first = strtol(s, &end, 10);
+  if (*end == sep) *second = strtol(end + 1, NULL, 10);
+}
+
+/* Parses "St:" values like "16", "18/02", "18/**" and "19" into the 3..125
+ * strength and the 3..25 one, see ACURRSTR. */
+static void parse_strength(const char *s, int64_t *blstats) {
+  char *end;
+  int64_t str = strtol(s, &end, 10);
+  if (*end == '/')
+    str += end[1] == '*' ? 100 : strtol(end + 1, NULL, 10);
+  else if (str > 18)
+    str += 100;
+  blstats[STATUS_BL_STR125] = str;
+  if (str <= 18)
+    blstats[STATUS_BL_STR25] = str;
+  else if (str <= 121)
+    blstats[STATUS_BL_STR25] = 19 + str / 50;
+  else
+    blstats[STATUS_BL_STR25] = (str < 125 ? str : 125) - 100;
+}
+
+static void parse_line1(char *s, int64_t *blstats) {
+  char *token;
+  while ((token = next_token(&s))) {
+    if (starts_with(token, "St:")) {
+      parse_strength(token + 3, blstats);
+    } else if (!strcmp(token, "Lawful")) {
+      blstats[STATUS_BL_ALIGN] = 1;
+    } else if (!strcmp(token, "Chaotic")) {
+      blstats[STATUS_BL_ALIGN] = -1;
+    } else {
+      for (size_t i = 0; i < sizeof(line1_fields) / sizeof(line1_fields[0]);
+           ++i) {
+        if (starts_with(token, line1_fields[i].label)) {
+          blstats[line1_fields[i].index] =
+              strtol(token + strlen(line1_fields[i].label), NULL, 10);
+          break;
+        }
+      }
+    }
+  }
+}
+
+/* Returns whether the line has hit points, ie is a status line. */
+static int parse_line2(char *s, int64_t *blstats) {
+  int found = 0;
+  char *token;
+  blstats[STATUS_BL_HUNGER] = NOT_HUNGRY;
+  while ((token = next_token(&s))) {
+    if (starts_with(token, "HP:")) {
+      parse_pair(token + 3, '(', &blstats[STATUS_BL_HP],
+                 &blstats[STATUS_BL_HPMAX]);
+      found = 1;
+      continue;
+    }
+    if (starts_with(token, "Pw:")) {
+      parse_pair(token + 3, '(', &blstats[STATUS_BL_ENE],
+                 &blstats[STATUS_BL_ENEMAX]);
+      continue;
+    }
+    if (starts_with(token, "Xp:")) {
+      parse_pair(token + 3, '/', &blstats[STATUS_BL_XP],
+                 &blstats[STATUS_BL_EXP]);
+      continue;
+    }
+    size_t i;
+    for (i = 0; i < sizeof(line2_fields) / sizeof(line2_fields[0]); ++i) {
+      if (starts_with(token, line2_fields[i].label)) {
+        blstats[line2_fields[i].index] =
+            strtol(token + strlen(line2_fields[i].label), NULL, 10);
+        break;
+      }
+    }
+    if (i < sizeof(line2_fields) / sizeof(line2_fields[0])) continue;
+    if (token[0] && token[1] == ':') {
+      /* Gold, after the (possibly DECgraphics) gold symbol. */
+      blstats[STATUS_BL_GOLD] = strtol(token + 2, NULL, 10);
+      continue;
+    }
+    for (i = 0; i < sizeof(hunger_names) / sizeof(hunger_names[0]); ++i) {
+      if (*hunger_names[i] && !strcmp(token, hunger_names[i]))
+        blstats[STATUS_BL_HUNGER] = i;
+    }
+    for (size_t j = 0; j < 3; ++j) {
+      for (i = 1; i < 6; ++i) {
+        if (!strcmp(token, cap_names[j][i])) blstats[STATUS_BL_CAP] = i;
+      }
+      for (i = 0; i < NUM_CONDITIONS; ++i) {
+        if (!strcmp(token, conditions[i].names[j]))
+          blstats[STATUS_BL_CONDITION] |= conditions[i].mask;
+      }
+    }
+  }
+  return found;
+}
+
+void status_parse(const unsigned char *top, const unsigned char *line1,
+                  const unsigned char *line2, size_t cols, int cursor_row,
+                  int cursor_col, unsigned char cursor_char,
+                  const int64_t *previous, int64_t *blstats,
+                  unsigned char *message) {
+  char buf[STATUS_LINE_MAX];
+
+  if (message) {
+    size_t n = copy_line(buf, top, cols);
+    /* Messages start at the left, menus drawn over the map don't. */
+    if (buf[0] == ' ') n = 0;
+    /* Drop the prompt of messages waiting for a keypress. */
+    if (n >= 8 && !strcmp(buf + n - 8, "--More--")) {
+      n -= 8;
+      while (n && buf[n - 1] == ' ') --n;
+    }
+    memset(message, 0, STATUS_MESSAGE_SIZE);
+    memcpy(message, buf, n < STATUS_MESSAGE_SIZE ? n : STATUS_MESSAGE_SIZE - 1);
+  }
+
+  if (!blstats) return;
+
+  memset(blstats, 0, sizeof(int64_t) * STATUS_BLSTATS_SIZE);
+  copy_line(buf, line2, cols);
+  if (!parse_line2(buf, blstats)) {
+    /* Hidden by a menu, or not in the game yet or anymore. */
+    if (previous)
+      memcpy(blstats, previous, sizeof(int64_t) * STATUS_BLSTATS_SIZE);
+    else
+      memset(blstats, 0, sizeof(int64_t) * STATUS_BLSTATS_SIZE);
+    return;
+  }
+  copy_line(buf, line1, cols);
+  parse_line1(buf, blstats);
+  /* Between turns, the cursor is on the hero, an @ unless polymorphed. Text
+   * windows drawn over the map have it elsewhere. */
+  int on_hero = cursor_char == '@' ||
+                (blstats[STATUS_BL_HD] && cursor_char != ' ');
+  if (cursor_row >= 1 && cursor_row <= MAP_ROWS && on_hero) {
+    blstats[STATUS_BL_X] = cursor_col;
+    blstats[STATUS_BL_Y] = cursor_row - 1;
+  } else if (previous) {
+    /* Eg at a --More-- prompt on the top line. */
+    blstats[STATUS_BL_X] = previous[STATUS_BL_X];
+    blstats[STATUS_BL_Y] = previous[STATUS_BL_Y];
+  }
+}
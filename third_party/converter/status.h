@@ -0,0 +1,71 @@
+#ifndef INCLUDED_status_h
+#define INCLUDED_status_h
+
+#include <stddef.h>
+#include <stdint.h>
+
+#ifdef __cplusplus
+extern "C" {
+#endif
+
+/* Sizes and indices of NLE's `message` and `blstats` observations, see
+ * NLE_MESSAGE_SIZE, NLE_BLSTATS_SIZE and NLE_BL_* in include/nletypes.h. */
+#define STATUS_MESSAGE_SIZE 256
+#define STATUS_BLSTATS_SIZE 27
+
+#define STATUS_BL_X 0
+#define STATUS_BL_Y 1
+#define STATUS_BL_STR25 2
+#define STATUS_BL_STR125 3
+#define STATUS_BL_DEX 4
+#define STATUS_BL_CON 5
+#define STATUS_BL_INT 6
+#define STATUS_BL_WIS 7
+#define STATUS_BL_CHA 8
+#define STATUS_BL_SCORE 9
+#define STATUS_BL_HP 10
+#define STATUS_BL_HPMAX 11
+#define STATUS_BL_DEPTH 12
+#define STATUS_BL_GOLD 13
+#define STATUS_BL_ENE 14
+#define STATUS_BL_ENEMAX 15
+#define STATUS_BL_AC 16
+#define STATUS_BL_HD 17
+#define STATUS_BL_XP 18
+#define STATUS_BL_EXP 19
+#define STATUS_BL_TIME 20
+#define STATUS_BL_HUNGER 21
+#define STATUS_BL_CAP 22
+#define STATUS_BL_DNUM 23
+#define STATUS_BL_DLEVEL 24
+#define STATUS_BL_CONDITION 25
+#define STATUS_BL_ALIGN 26
+
+/* Returns the terminal row of the first of NetHack's two tty status lines. */
+size_t status_row(size_t term_rows);
+
+/* Parses the top line and the two status lines of a tty frame, each `cols`
+ * characters, into a zero-padded `message` and `blstats`. Either output may
+ * be NULL. `cursor_row` and `cursor_col` are in terminal coordinates, and
+ * `cursor_char` is the character at the cursor.
+ *
+ * Only two things are taken from the `previous` blstats, if given:
+ *  - X and Y, when the cursor isn't on the hero. Frames show the hero's
+ *    position only by the cursor, and only between turns.
+ *  - All of blstats, when the status lines don't show hit points, eg
+ *    because a menu hides them.
+ * Without `previous`, these are 0. Any other field the status lines don't
+ * show is 0, whatever `previous` holds: DNUM and DLEVEL always, and eg the
+ * score, time or experience points without the showscore, time or showexp
+ * options. */
+void status_parse(const unsigned char *top, const unsigned char *line1,
+                  const unsigned char *line2, size_t cols, int cursor_row,
+                  int cursor_col, unsigned char cursor_char,
+                  const int64_t *previous, int64_t *blstats,
+                  unsigned char *message);
+
+#ifdef __cplusplus
+}
+#endif
+
+#endif /* !INCLUDED_status_h */
@@ -0,0 +1,106 @@
+/* Times tmt_write on the terminal output of ttyrecs.
+ *
+ * Usage: tmt_bench VERSION REPEATS TTYREC...
+ *
+ * Reads the output records of the ttyrecs into memory, then writes them to a
+ * fresh terminal record by record, like the converter, REPEATS times, and
+ * prints the fastest time. */
+
+#include <stdbool.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include <string.h>
+#include <time.h>
+
+#include "player.h"
+#include "tmt.h"
+
+#define ROWS 24
+#define COLS 80
+
+typedef struct Records {
+  char *data;
+  size_t *lens;
+  size_t n, size, capacity, lens_capacity;
+} Records;
+
+static int append(Records *r, const char *data, size_t len) {
+  if (r->size + len > r->capacity) {
+    size_t capacity = 2 * r->capacity + len;
+    char *p = realloc(r->data, capacity);
+    if (!p) return -1;
+    r->data = p;
+    r->capacity = capacity;
+  }
+  if (r->n == r->lens_capacity) {
+    size_t capacity = 2 * r->lens_capacity + 1024;
+    size_t *p = realloc(r->lens, capacity * sizeof(size_t));
+    if (!p) return -1;
+    r->lens = p;
+    r->lens_capacity = capacity;
+  }
+  memcpy(r->data + r->size, data, len);
+  r->size += len;
+  r->lens[r->n++] = len;
+  return 0;
+}
+
+static int read_ttyrec(Records *r, const char *filename, size_t version) {
+  Player *p = player_create(filename, ROWS, COLS, version);
+  if (!p) {
+    fprintf(stderr, "Failed to open %s\n", filename);
+    return -1;
+  }
+  int status;
+  while ((status = player_read_record(p)) == CONV_OK) {
+    if (p->header.channel == 0 && append(r, p->buf, p->header.len) != 0) {
+      status = CONV_CRITICAL_ERROR;
+      break;
+    }
+  }
+  player_close(p);
+  return status < CONV_STREAM_END && status != CONV_FILE_ERROR ? -1 : 0;
+}
+
+static double now(void) {
+  struct timespec t;
+  clock_gettime(CLOCK_MONOTONIC, &t);
+  return t.tv_sec + 1e-9 * t.tv_nsec;
+}
+
+int main(int argc, char **argv) {
+  if (argc < 4) {
+    fprintf(stderr, "Usage: %s VERSION REPEATS TTYREC...\n", argv[0]);
+    return EXIT_FAILURE;
+  }
+  size_t version = strtoul(argv[1], NULL, 10);
+  int repeats = atoi(argv[2]);
+
+  Records r = {0};
+  for (int i = 3; i < argc; ++i) {
+    if (read_ttyrec(&r, argv[i], version) != 0) return EXIT_FAILURE;
+  }
+
+  /* See conversion_create: Old ttyrecs don't wrap. */
+  bool wrap = (version != 1);
+  double best = 0;
+  for (int i = 0; i < repeats; ++i) {
+    TMT *vt = tmt_open(ROWS, wrap ? COLS : COLS + 1, NULL, NULL, NULL, wrap);
+    if (!vt) return EXIT_FAILURE;
+    double start = now();
+    const char *data = r.data;
+    for (size_t j = 0; j < r.n; ++j) {
+      tmt_write(vt, data, r.lens[j]);
+      data += r.lens[j];
+    }
+    double elapsed = now() - start;
+    if (!i || elapsed < best) best = elapsed;
+    tmt_close(vt);
+  }
+
+  printf("%zu records, %.2f MB: %.1f ms, %.1f MB/s, %.2f ns/byte\n", r.n,
+         r.size / 1e6, 1e3 * best, r.size / 1e6 / best, 1e9 * best / r.size);
+  free(r.data);
+  free(r.lens);
+  return EXIT_SUCCESS;
+}
@@ -53,7 +53,7 @@
 
 struct TMT{
     TMTPOINT curs, oldcurs;
-    TMTATTRS attrs, oldattrs;
+    TMTATTRS attrs, oldattrs, defattrs;
 
     bool dirty, acs, ignored, wrap;
     TMTSCREEN screen;
@@ -73,7 +73,7 @@ struct TMT{
     enum {S_NUL, S_ESC, S_ARG, S_DEC} state;
 };
 
-static TMTATTRS defattrs = {.fg = TMT_COLOR_DEFAULT, .bg = TMT_COLOR_DEFAULT, .dec = 0};
+static const TMTATTRS defattrs = {.fg = TMT_COLOR_DEFAULT, .bg = TMT_COLOR_DEFAULT, .dec = 0};
 static void writecharatcurs(TMT *vt, wchar_t w);
 
 static wchar_t
@@ -104,7 +104,7 @@ clearline(TMT *vt, TMTLINE *l, size_t s, size_t e)
 {
     vt->dirty = l->dirty = true;
     for (size_t i = s; i < e && i < vt->screen.ncol; i++){
-        l->chars[i].a = defattrs;
+        l->chars[i].a = vt->defattrs;
         l->chars[i].c = L' ';
     }
 }
@@ -204,7 +204,7 @@ HANDLER(el)
 HANDLER(sgr)
     #define FGBG(c) *(P0(i) < 40? &vt->attrs.fg : &vt->attrs.bg) = c
     for (size_t i = 0; i < vt->npar; i++) switch (P0(i)){
-        case  0: vt->attrs                    = defattrs;   break;
+        case  0: vt->attrs                    = vt->defattrs; break;
         case  1: case 22: vt->attrs.bold      = P0(0) < 20; break;
         case  2: case 23: vt->attrs.dim       = P0(0) < 20; break;
         case  4: case 24: vt->attrs.underline = P0(0) < 20; break;
@@ -314,8 +314,8 @@ handlechar(TMT *vt, char i)
     DO(S_ARG, "u",          vt->curs = vt->oldcurs; vt->attrs = vt->oldattrs)
     DO(S_ARG, "@",          ich(vt))
     ON(S_DEC, "\x1b",       vt->state = S_ESC)
-    DO(S_DEC, "0",          vt->attrs.dec = true; defattrs.dec = true)
-    DO(S_DEC, "B",          vt->attrs.dec = false; defattrs.dec = false)
+    DO(S_DEC, "0",          vt->attrs.dec = true; vt->defattrs.dec = true)
+    DO(S_DEC, "B",          vt->attrs.dec = false; vt->defattrs.dec = false)
     if (vt->state == S_ESC || vt->state == S_ARG) {
         /* We have unrecognised terminal commands (eg from VT420+) that have 
          * fallen through. In this case, we abort the commands instead of 
@@ -364,6 +364,7 @@ tmt_open(size_t nline, size_t ncol, TMTCALLBACK cb, void *p,
 
     /* ASCII-safe defaults for box-drawing characters. */
     vt->acschars = acs? acs : L"><^v#+:o##+++++~---_++++|<>*!fo";
+    vt->defattrs = defattrs;
     vt->cb = cb;
     vt->p = p;
     vt->wrap = wrap;
@@ -445,6 +446,40 @@ writecharatcurs(TMT *vt, wchar_t w)
     }
 }
 
+#define PRINTABLE(x) ((unsigned char)(x) - 0x20U < 0x5FU)
+
+/* Writes the run of printable ASCII at the start of `str`, which handlechar
+ * passes on one at a time outside of escape sequences, and returns its
+ * length. Up to the last column, characters go into the line in bulk with
+ * one cursor update and one dirty mark; the last column wraps or scrolls as
+ * usual. Printable ASCII is one column wide, so wcwidth doesn't matter. */
+static size_t
+writeprintable(TMT *vt, const char *str, size_t n)
+{
+    COMMON_VARS;
+    (void)t;
+    size_t i = 0;
+
+    while (i < n && PRINTABLE(str[i])){
+        size_t m = c->c < s->ncol - 1? MIN(n - i, s->ncol - 1 - c->c) : 0;
+        size_t k = 0;
+        for (TMTCHAR *ch = l->chars + c->c; k < m && PRINTABLE(str[i + k]); k++){
+            ch[k].c = (wchar_t)str[i + k];
+            ch[k].a = vt->attrs;
+        }
+        if (k){
+            l->dirty = vt->dirty = true;
+            c->c += k;
+            i += k;
+        }
+        if (k == m && i < n && PRINTABLE(str[i])){
+            writecharatcurs(vt, str[i++]);
+            l = CLINE(vt);
+        }
+    }
+    return i;
+}
+
 /* TODO(heiner): Consider removing these functions and all mentions
  * of wchars. */
 static inline size_t
@@ -470,7 +505,9 @@ tmt_write(TMT *vt, const char *s, size_t n)
     n = n? n : strlen(s);
 
     for (size_t p = 0; p < n; p++){
-        if (handlechar(vt, s[p]))
+        if (vt->state == S_NUL && PRINTABLE(s[p]))
+            p += writeprintable(vt, s + p, n - p) - 1;
+        else if (handlechar(vt, s[p]))
             continue;
         else
             writecharatcurs(vt, s[p]);
@@ -505,9 +542,31 @@ tmt_reset(TMT *vt)
 {
     vt->curs.r = vt->curs.c = vt->oldcurs.r = vt->oldcurs.c = vt->acs = (bool)0;
     resetparser(vt);
-    vt->attrs = vt->oldattrs = defattrs;
+    vt->attrs = vt->oldattrs = vt->defattrs = defattrs;
     memset(&vt->ms, 0, sizeof(vt->ms));
     clearlines(vt, 0, vt->screen.nline);
     CB(vt, TMT_MSG_CURSOR, "t");
     notify(vt, true, true);
 }
+
+void
+tmt_get_modes(const TMT *vt, TMTMODES *m)
+{
+    m->curs = vt->curs;
+    m->oldcurs = vt->oldcurs;
+    m->attrs = vt->attrs;
+    m->oldattrs = vt->oldattrs;
+    m->defattrs = vt->defattrs;
+    m->acs = vt->acs;
+}
+
+void
+tmt_set_modes(TMT *vt, const TMTMODES *m)
+{
+    vt->curs = m->curs;
+    vt->oldcurs = m->oldcurs;
+    vt->attrs = m->attrs;
+    vt->oldattrs = m->oldattrs;
+    vt->defattrs = m->defattrs;
+    vt->acs = m->acs;
+}
@@ -116,6 +116,14 @@ struct TMTSCREEN{
     TMTLINE **lines;
 };
 
+/* Terminal state other than the screen contents. */
+typedef struct TMTMODES TMTMODES;
+struct TMTMODES{
+    TMTPOINT curs, oldcurs;
+    TMTATTRS attrs, oldattrs, defattrs;
+    bool acs;
+};
+
 /**** CALLBACK SUPPORT */
 typedef enum{
     TMT_MSG_MOVED,
@@ -137,5 +145,7 @@ const TMTSCREEN *tmt_screen(const TMT *vt);
 const TMTPOINT *tmt_cursor(const TMT *vt);
 void tmt_clean(TMT *vt);
 void tmt_reset(TMT *vt);
+void tmt_get_modes(const TMT *vt, TMTMODES *m);
+void tmt_set_modes(TMT *vt, const TMTMODES *m);
 
 #endif
@@ -358,6 +358,25 @@ class Nethack
         return static_cast<game_end_types>(obs_.how_done);
     }
 
+    void
+    set_buffer_scores(bool buffer_scores)
+    {
+        obs_.logentry = buffer_scores ? logentry_ : nullptr;
+        obs_.xlogentry = buffer_scores ? xlogentry_ : nullptr;
+    }
+
+    py::bytes
+    logfile_entry()
+    {
+        return py::bytes(logentry_);
+    }
+
+    py::bytes
+    xlogfile_entry()
+    {
+        return py::bytes(xlogentry_);
+    }
+
     void
     set_wizkit(std::string wizkit)
     {
@@ -496,6 +515,9 @@ class Nethack
         if (!ttyrec)
             strncpy(settings_.ttyrecname, "", sizeof(settings_.ttyrecname));
 
+        logentry_[0] = '\0';
+        xlogentry_[0] = '\0';
+
         if (!nle_) {
             nle_ = nle_start(dlpath_.c_str(), &obs_,
                              ttyrec ? ttyrec : ttyrec_, &settings_);
@@ -524,6 +546,8 @@ class Nethack
     nle_settings settings_;
     tile_t *tileset = nullptr;
     short prev_glyphs[ROWNO * (COLNO - 1)] = { 0 };
+    char logentry_[NLE_SCORE_ENTRY_SIZE] = { 0 };
+    char xlogentry_[NLE_SCORE_ENTRY_SIZE] = { 0 };
 };
 
 PYBIND11_MODULE(_pynethack, m)
@@ -563,6 +587,10 @@ PYBIND11_MODULE(_pynethack, m)
         .def("get_seeds", &Nethack::get_seeds)
         .def("in_normal_game", &Nethack::in_normal_game)
         .def("how_done", &Nethack::how_done)
+        .def("set_buffer_scores", &Nethack::set_buffer_scores,
+             py::arg("buffer_scores"))
+        .def("logfile_entry", &Nethack::logfile_entry)
+        .def("xlogfile_entry", &Nethack::xlogfile_entry)
         .def("set_wizkit", &Nethack::set_wizkit)
         .def("setup_tiles", &Nethack::setup_tileset)
         .def("get_tileset", &Nethack::get_tileset)